@@ -1,3 +1,21 @@
+import hashlib
+import inspect
+import os
+import sys
+
+from mc6502.flag import Flag, C, Z, D, V, N
+
+
+def _nz(ret, p):
+    """Set N and Z of Processor Status Register by the result"""
+    p &= ~(N | Z)
+    if ret & 0x80:
+        p |= N
+    if (ret & 0xff) == 0x00:
+        p |= Z
+    return p
+
+
 class ALU(object):
 
     def __init__(self):
@@ -5,142 +23,259 @@ class ALU(object):
             'inc': self._inc, 'dec': self._dec,
             'asl': self._asl, 'lsr': self._lsr,
             'rol': self._rol, 'ror': self._ror,
-            'adc': self._adc, 'sbc': self._sbc, 
+            'adc': self._adc, 'sbc': self._sbc,
             'bit': self._bit, 'cmp': self._cmp,
             'and': self._and, 'ora': self._ora,
             'eor': self._eor, 'tha': self._tha,
         }
 
     def __call__(self, a, b, flag, ctrl):
-        ret, flag = self._table[ctrl](a, b, flag)
-        ret = ret & 0xff
-        return ret, flag
+        ret, p = self._table[ctrl](a, b, flag.data)
+        return ret & 0xff, Flag(p)
+
+    def execute(self, a, b, p, ctrl):
+        """Return tuple (result, Processor Status Register)"""
+        ret, p = self._table[ctrl](a, b, p)
+        return ret & 0xff, p
 
-    def _inc(self, a, b, flag):
+    def _inc(self, a, b, p):
         """Increment source A"""
         ret = a + 1
-        flag['N'] = ret & 0x80
-        flag['Z'] = (ret & 0xff) == 0x00
-        return ret, flag
+        return ret, _nz(ret, p)
 
-    def _dec(self, a, b, flag):
+    def _dec(self, a, b, p):
         """Decrement source A"""
         ret = a - 1
-        flag['N'] = ret & 0x80
-        flag['Z'] = (ret & 0xff) == 0x00
-        return ret, flag
+        return ret, _nz(ret, p)
 
-    def _asl(self, a, b, flag):
+    def _asl(self, a, b, p):
         """Arithmetic shift left source A"""
         ret = a << 1
-        flag['N'] = ret & 0x80
-        flag['Z'] = (ret & 0xff) == 0x00
-        flag['C'] = ret >> 8
-        return ret, flag
+        p = _nz(ret, p) & ~C
+        return ret, p | (C if ret >> 8 else 0)
 
-    def _lsr(self, a, b, flag):
+    def _lsr(self, a, b, p):
         """Logical shift right source A"""
         ret = a >> 1
-        flag['Z'] = (ret & 0xff) == 0x00
-        flag['C'] = a & 0x01
-        return ret, flag
+        p &= ~(Z | C)
+        if (ret & 0xff) == 0x00:
+            p |= Z
+        return ret, p | (a & 0x01)
 
-    def _rol(self, a, b, flag):
+    def _rol(self, a, b, p):
         """Rotate left source A"""
-        ret = (a << 1) | flag['C']
-        flag['N'] = ret & 0x80
-        flag['Z'] = (ret & 0xff) == 0x00
-        flag['C'] = ret >> 8
-        return ret, flag
+        ret = (a << 1) | (p & C)
+        p = _nz(ret, p) & ~C
+        return ret, p | (C if ret >> 8 else 0)
 
-    def _ror(self, a, b, flag):
+    def _ror(self, a, b, p):
         """Rotate right source A"""
-        ret = (flag['C'] << 7) | (a >> 1)
-        flag['N'] = ret & 0x80
-        flag['Z'] = (ret & 0xff) == 0x00
-        flag['C'] = a & 0x01
-        return ret, flag
+        ret = ((p & C) << 7) | (a >> 1)
+        p = _nz(ret, p) & ~C
+        return ret, p | (a & 0x01)
 
-    def _adc(self, a, b, flag):
+    def _adc(self, a, b, p):
         """Add source A and source B"""
-        if flag['D']:
-            l = (a & 0x0f) + (b & 0x0f) + flag['C']
+        if p & D:
+            l = (a & 0x0f) + (b & 0x0f) + (p & C)
             if l >= 0x0a:
                 l = ((l + 0x06) & 0x0f) + 0x10
             s = (a & 0xf0) + (b & 0xf0) + l
             t = s
             ret = s + 0x60 if s >= 0xa0 else 0x00
-            flag['N'] = ret & 0x80
-            flag['V'] = (t < -128) | (t > 127)
-            flag['Z'] = (ret & 0xff) == 0x00
-            flag['C'] = ret >= 0x100
+            overflow = (t < -128) | (t > 127)
         else:
-            ret = a + b + flag['C']
+            ret = a + b + (p & C)
             a_msb, b_msb = (a & 0x80), (b & 0x80)
-            flag['N'] = ret & 0x80
-            flag['V'] = (a_msb == b_msb) & ((a_msb ^ (ret & 0x80)) > 0)
-            flag['Z'] = (ret & 0xff) == 0x00
-            flag['C'] = ret >= 0x100
-        return ret, flag
+            overflow = (a_msb == b_msb) & ((a_msb ^ (ret & 0x80)) > 0)
+        p = _nz(ret, p) & ~(V | C)
+        if overflow:
+            p |= V
+        if ret >= 0x100:
+            p |= C
+        return ret, p
 
-    def _sbc(self, a, b, flag):
+    def _sbc(self, a, b, p):
         """Subtract source A and source B"""
-        borrow = 1 - flag['C']
-        if flag['D']:
+        borrow = 1 - (p & C)
+        if p & D:
             l = (a & 0x0f) - (b & 0x0f) - borrow
-            s = a - b + flag['C'] - 1
+            s = a - b + (p & C) - 1
             ret = s - (0x60 if s < 0 else 0) - (0x06 if l < 0 else 0)
-            flag['N'] = ret & 0x80
-            flag['V'] = ((ret & 0x80) > 0) ^ ((ret & 0x100) != 0)
-            flag['Z'] = (ret & 0xff) == 0x00
-            flag['C'] = not (s & 0x100)
+            carry = not (s & 0x100)
         else:
             ret = a - b - borrow
-            a_msb, b_msb = a & 0x80, b & 0x80
-            flag['N'] = ret & 0x80
-            flag['V'] = ((ret & 0x80) > 0) ^ ((ret & 0x100) != 0)
-            flag['Z'] = (ret & 0xff) == 0x00
-            flag['C'] = ret & 0x100
-        return ret, flag
-
-    def _bit(self, a, b, flag):
+            carry = ret & 0x100
+        p = _nz(ret, p) & ~(V | C)
+        if ((ret & 0x80) > 0) ^ ((ret & 0x100) != 0):
+            p |= V
+        if carry:
+            p |= C
+        return ret, p
+
+    def _bit(self, a, b, p):
         """Bits 7 and 6 of operand are transfered to bit 7 and 6 of SR (N,V);
         the zeroflag is set to the result of operand AND accumulator."""
         ret = a & b
-        flag['N'] = b & 0x80
-        flag['V'] = b & 0x40
-        flag['Z'] = ret == 0x00
-        return a, flag
+        p = (p & ~(N | V | Z)) | (b & (N | V))
+        if ret == 0x00:
+            p |= Z
+        return a, p
 
-    def _cmp(self, a, b, flag):
+    def _cmp(self, a, b, p):
         """Compare source A and source B"""
         ret = a - b
-        flag['N'] = ret & 0x80
-        flag['Z'] = ret == 0x00
-        flag['C'] = ret & 0x100
-        return a, flag
+        p &= ~(N | Z | C)
+        if ret & 0x80:
+            p |= N
+        if ret == 0x00:
+            p |= Z
+        if ret & 0x100:
+            p |= C
+        return a, p
 
-    def _and(self, a, b, flag):
+    def _and(self, a, b, p):
         """And source A and source B"""
         ret = a & b
-        flag['N'] = ret & 0x80
-        flag['Z'] = ret == 0x00
-        return ret, flag
+        return ret, _nz(ret, p)
 
-    def _ora(self, a, b, flag):
+    def _ora(self, a, b, p):
         """OR source A and source B"""
         ret = a | b
-        flag['N'] = ret & 0x80
-        flag['Z'] = ret == 0x00
-        return ret, flag
+        return ret, _nz(ret, p)
 
-    def _eor(self, a, b, flag):
+    def _eor(self, a, b, p):
         """Exclusive-OR source A and source B"""
         ret = a ^ b
-        flag['N'] = ret & 0x80
-        flag['Z'] = ret == 0x00
-        return ret, flag
+        return ret, _nz(ret, p)
 
-    def _tha(self, a, b, flag):
+    def _tha(self, a, b, p):
         """Through source A"""
-        return a, flag
+        return a, p
+
+
+# Lookup table index layouts: source A, source B, carry and decimal flags
+LUT_A, LUT_AC, LUT_AB, LUT_ABCD = 0, 1, 2, 3
+
+LUT_LAYOUT = (
+    ('inc', LUT_A, N | Z), ('dec', LUT_A, N | Z),
+    ('asl', LUT_A, N | Z | C), ('lsr', LUT_A, Z | C),
+    ('rol', LUT_AC, N | Z | C), ('ror', LUT_AC, N | Z | C),
+    ('adc', LUT_ABCD, N | V | Z | C), ('sbc', LUT_ABCD, N | V | Z | C),
+    ('bit', LUT_AB, N | V | Z), ('cmp', LUT_AB, N | Z | C),
+    ('and', LUT_AB, N | Z), ('ora', LUT_AB, N | Z),
+    ('eor', LUT_AB, N | Z), ('tha', LUT_A, 0x00),
+)
+
+LUT_SIZE = {LUT_A: 0x100, LUT_AC: 0x200, LUT_AB: 0x10000, LUT_ABCD: 0x40000}
+
+
+def _lut_cache_path(directory=None):
+    """Return the cache file path in `directory` keyed by the source of this
+    module and the table layout"""
+    try:
+        source = inspect.getsource(sys.modules[__name__])
+    except (IOError, OSError, TypeError):
+        return None
+    key = source + repr((LUT_LAYOUT, sorted(LUT_SIZE.items())))
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    if directory is None:
+        directory = os.path.join(os.path.expanduser('~'), '.cache', 'mc6502')
+    return os.path.join(directory, 'alu-{}.bin'.format(digest))
+
+
+class TableALU(ALU):
+    """ALU looking up precomputed results and flags
+
+    Each operation has a result table and a flag table indexed by its
+    sources and, for the operations reading them, the carry and decimal
+    flags. The flag table holds the bits of `mask` only, so the other bits
+    of Processor Status Register pass through. The tables are built from
+    ALU on first use and shared by all instances.
+
+    With `cache`, a directory or True for ~/.cache/mc6502, the tables are
+    also kept on disk for the next processes.
+    """
+
+    _lut = None
+
+    def __init__(self, cache=None):
+        super(TableALU, self).__init__()
+        if TableALU._lut is None:
+            path = None
+            if cache:
+                path = _lut_cache_path(None if cache is True else cache)
+            TableALU._lut = self._load(path)
+        self._lut = TableALU._lut
+
+    def __call__(self, a, b, flag, ctrl):
+        ret, p = self.execute(a, b, flag.data, ctrl)
+        return ret, Flag(p)
+
+    def execute(self, a, b, p, ctrl):
+        """Return tuple (result, Processor Status Register)"""
+        if ctrl == 'tha':
+            return a, p
+        layout, ret, flags, mask = self._lut[ctrl]
+        if layout == LUT_ABCD:
+            i = ((p & C) << 16) | ((p & D) << 14) | (b << 8) | a
+        elif layout == LUT_AB:
+            i = (b << 8) | a
+        elif layout == LUT_AC:
+            i = ((p & C) << 8) | a
+        else:
+            i = a
+        return ret[i], (p & ~mask) | flags[i]
+
+    def _build(self):
+        """Return bytes of result and flag tables in the order of
+        LUT_LAYOUT"""
+        blob = bytearray()
+        for ctrl, layout, mask in LUT_LAYOUT:
+            op = self._table[ctrl]
+            ret = bytearray(LUT_SIZE[layout])
+            flags = bytearray(LUT_SIZE[layout])
+            for i in range(LUT_SIZE[layout]):
+                a, b = i & 0xff, (i >> 8) & 0xff
+                if layout == LUT_AC:
+                    p = i >> 8
+                else:
+                    p = ((i >> 16) & C) | ((i >> 14) & D)
+                r, p = op(a, b, p)
+                ret[i], flags[i] = r & 0xff, p & mask
+            blob += ret + flags
+        return blob
+
+    def _load(self, path):
+        """Return dict op -> (layout, result, flags, mask)"""
+        size = sum(2 * LUT_SIZE[layout] for _, layout, _ in LUT_LAYOUT)
+        blob = bytearray(size)
+        try:
+            with open(path, 'rb') as f:
+                loaded = f.readinto(blob)
+        except (IOError, OSError, TypeError):
+            loaded = 0
+        if loaded != size:
+            blob = self._build()
+            if path:
+                self._save(path, blob)
+
+        lut, offset = {}, 0
+        for ctrl, layout, mask in LUT_LAYOUT:
+            n = LUT_SIZE[layout]
+            lut[ctrl] = (layout, blob[offset:offset + n],
+                         blob[offset + n:offset + 2 * n], mask)
+            offset += 2 * n
+        return lut
+
+    def _save(self, path, blob):
+        """Write the tables atomically, ignoring unwritable cache"""
+        tmp = '{}.{}'.format(path, os.getpid())
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(tmp, 'wb') as f:
+                f.write(blob)
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            pass
@@ -0,0 +1,412 @@
+from mc6502.controller import execute_control, FLAG_OPERATION, \
+    T1_FETCH_OPERAND
+from mc6502.fastmpu import FastMPU, MAX_CYCLES
+from mc6502.fusion import BRANCHES, RMW_OPS, STR_OPS
+from mc6502.icache import OPERANDS
+
+# Upper limit of instructions translated into one block
+MAX_BLOCK = 64
+
+# Self-modifying code invalidated this many times is not translated again
+MAX_REWRITES = 4
+
+TERMINATORS = ('BRK', 'JMP', 'JSR', 'RTI', 'RTS')
+
+
+class _Source(object):
+    """Python source of a translated block"""
+
+    def __init__(self):
+        self.lines = []
+        self.cycles = 0
+        self.instructions = 0
+        self.opcode = None
+
+    def emit(self, line, indent=2):
+        self.lines.append('    ' * indent + line)
+
+    def exit(self, indent=2):
+        """Leave the block after the current instruction"""
+        self.emit('c += {}'.format(self.cycles), indent)
+        self.emit('n = {}'.format(self.instructions), indent)
+        self.emit('opcode = {}'.format(self.opcode), indent)
+        self.emit('break', indent)
+
+
+class BlockMPU(FastMPU):
+    """Instruction level MPU running translated basic blocks
+
+    Straight-line instructions from an instruction boundary up to the next
+    branch, JMP, JSR, RTS, RTI or BRK are translated into a Python function
+    with the operands as constants. The functions are cached by (PC, IR)
+    and dropped when the memory sees a write into the translated range.
+    Instructions a block can not hold (illegal opcodes, shifts on memory and
+    wrapping PC) are left to FastMPU.
+
+    Writes bypassing `Memory.__call__` (e.g. through `Memory.view`) are not
+    seen, so `flush` the blocks after such writes.
+    """
+
+    def __init__(self, precompiled=False, lut=False):
+        super(BlockMPU, self).__init__(precompiled=precompiled, lut=lut)
+        self._blocks = {}
+        self._rewrites = {}
+        self._memory = None
+
+    def run(self, memory, cycles=None, until=None, instructions=None):
+        """Run the MPU on memory and return tuple (cycles, instructions)
+
+        Same as `MPU.run`. `until` is checked at every instruction boundary,
+        so blocks are not used with it, nor with `stall`, nor on a `Bus`
+        with mapped pages since blocks access the memory directly.
+        """
+        if until is not None or self.stall is not None or \
+           getattr(memory, 'mapped', False):
+            return super(BlockMPU, self).run(
+                memory, cycles, until, instructions)
+        if memory is not self._memory:
+            self.flush()
+            self._memory = memory
+
+        controller, dp = self.controller, self.datapath
+        ncycles = ninstrs = 0
+        while instructions is None or ninstrs < instructions:
+            remain = None if cycles is None else cycles - ncycles
+            block = None
+            if controller._state == T1_FETCH_OPERAND:
+                # Translate only when the budget can run a whole block
+                translate = \
+                    (remain is None or remain >= MAX_CYCLES * MAX_BLOCK) and \
+                    (instructions is None or
+                     instructions - ninstrs >= MAX_BLOCK)
+                block = self._block(memory, dp.pc, dp.ir.data, translate)
+            if block is None or \
+               (instructions is not None and
+                instructions - ninstrs < block[1]) or \
+               (remain is not None and remain < MAX_CYCLES * block[1]):
+                c, n = super(BlockMPU, self).run(
+                    memory, remain, instructions=1)
+                ncycles += c
+                ninstrs += n
+                if not n:
+                    break
+                continue
+
+            self._load()
+            c, n, opcode = block[0](self, memory)
+            self._store(opcode)
+            ncycles += c
+            ninstrs += n
+            self.cycles += c
+        return ncycles, ninstrs
+
+    def flush(self):
+        """Drop all translated blocks and decoded instructions"""
+        super(BlockMPU, self).flush()
+        if self._memory is not None:
+            self._memory.unwatch(callback=self._invalidate)
+        self._blocks = {}
+        self._rewrites = {}
+
+    def _block(self, memory, pc, ir, translate=True):
+        """Return tuple (function, instructions, start, stop) or None"""
+        key = (pc, ir)
+        if key not in self._blocks:
+            if not translate:
+                return None
+            block = None
+            if self._rewrites.get(key, 0) < MAX_REWRITES:
+                block = self._translate(memory, pc, ir)
+            self._blocks[key] = block
+            if block is not None:
+                memory.watch(block[2], block[3], self._invalidate)
+        return self._blocks[key]
+
+    def _invalidate(self, address):
+        """Drop blocks translated from the written address"""
+        memory = self._memory
+        hit = [key for key, block in self._blocks.items()
+               if block is not None and block[2] <= address < block[3]]
+        for key in hit:
+            _, _, start, stop = self._blocks.pop(key)
+            memory.unwatch(start, stop, self._invalidate)
+            self._rewrites[key] = self._rewrites.get(key, 0) + 1
+        # Watch again the ranges shared with the remaining blocks
+        for block in self._blocks.values():
+            if block is not None:
+                memory.watch(block[2], block[3], self._invalidate)
+
+    def _translate(self, memory, pc, ir):
+        """Translate the block from PC with the opcode IR"""
+        m = memory._data
+        src = _Source()
+        start = stop = pc
+        opcode = ir
+        while True:
+            entry = self._table[opcode]
+            if src.instructions == MAX_BLOCK or \
+               not self._translatable(m, pc, entry):
+                if src.instructions:
+                    self._fetch_source(src, pc - 1)
+                    src.exit()
+                break
+            op_name, addr_mode, _, execute, flag_op = entry
+            size = OPERANDS[addr_mode]
+            operands = m[pc], m[pc + 1]
+            src.instructions += 1
+            src.opcode = opcode
+            src.emit('# 0x{:04x}: {} {}'.format(pc - 1, op_name, addr_mode))
+            stop = max(stop, pc + max(size, 1))
+            if addr_mode == 'rel' or op_name in TERMINATORS:
+                self._terminator(src, op_name, addr_mode, pc, operands,
+                                 execute, flag_op)
+                break
+
+            writes = self._instruction(src, op_name, addr_mode, pc,
+                                       operands)
+            self._execute_source(src, execute, flag_op)
+            pc += size
+            if writes:
+                # Leave the block when it modifies itself
+                src.emit('if LO <= w < HI:')
+                self._fetch_source(src, pc, 3)
+                src.exit(3)
+            opcode = m[pc]
+            stop = max(stop, pc + 1)
+            pc += 1
+
+        if src.instructions == 0:
+            return None
+        lines = [
+            'def block(mpu, memory):',
+            '    m = memory._data',
+            '    alu = mpu._alu.execute',
+            '    a, x, y, s, p, t = '
+            'mpu._a, mpu._x, mpu._y, mpu._s, mpu._p, mpu._t',
+            '    c = 0',
+            '    while True:',
+        ] + src.lines + [
+            '    mpu._a, mpu._x, mpu._y, mpu._s, mpu._p, mpu._t = '
+            'a, x, y, s, p, t',
+            '    mpu._ir, mpu._pc = ir, pc',
+            '    return c, n, opcode',
+        ]
+        namespace = {'LO': start, 'HI': stop}
+        exec(compile('\n'.join(lines) + '\n', '<block 0x{:04x}>'.format(
+            start - 1), 'exec'), namespace)
+        return namespace['block'], src.instructions, start, stop
+
+    def _translatable(self, m, pc, entry):
+        """Return True if the instruction at PC can be in a block"""
+        if entry is None:
+            return False
+        op_name, addr_mode = entry[:2]
+        if pc + OPERANDS[addr_mode] + 1 >= 0xffff:
+            return False
+        if op_name in RMW_OPS and addr_mode != 'acc' and \
+           execute_control(op_name, None)[:2] != ('t', 't'):
+            return False
+        if addr_mode == 'rel':
+            dst = (pc & 0xff) + 1 + m[pc]
+            return (pc >> 8) + (dst >> 8) <= 0xff
+        return True
+
+    def _fetch_source(self, src, pc, indent=2):
+        """T0: fetch next opcode from the constant PC"""
+        src.emit('ir = m[{}]'.format(pc), indent)
+        src.emit('pc = {}'.format((pc + 1) & 0xffff), indent)
+
+    def _execute_source(self, src, execute, flag_op, indent=2):
+        """T0: execute the instruction with the fetched data"""
+        a, dst, ctrl = execute
+        if dst == 'p':
+            src.emit('p = t', indent)
+        elif flag_op[1] == 'set':
+            src.emit('p |= {}'.format(flag_op[0]), indent)
+        elif flag_op[1] == 'clr':
+            src.emit('p &= ~{}'.format(flag_op[0]), indent)
+        elif ctrl == 'tha':
+            if dst in ['a', 'x', 'y', 's'] and a != dst:
+                src.emit('{} = {}'.format(dst, a), indent)
+        else:
+            a = a if a in ['a', 'x', 'y', 's', 't'] else '0'
+            src.emit('r, p = alu({}, t, p, {!r})'.format(a, ctrl), indent)
+            if dst in ['a', 'x', 'y', 's']:
+                src.emit('{} = r'.format(dst), indent)
+
+    def _access_source(self, src, op_name, addr, indent=2):
+        """Tx: fetch, modify and write data at the effective address"""
+        src.emit('w = {}'.format(addr), indent)
+        if op_name in STR_OPS:
+            reg = op_name[-1].lower()
+            src.emit('memory(w, {}, True)'.format(reg), indent)
+            return 1
+        src.emit('t = m[w]', indent)
+        if op_name not in RMW_OPS:
+            return 1
+        ctrl = execute_control(op_name, None)[2]
+        src.emit('memory(w, t, True)', indent)
+        src.emit('t, p = alu(t, t, p, {!r})'.format(ctrl), indent)
+        src.emit('memory(w, t, True)', indent)
+        return 3
+
+    def _index_carry_source(self, src, op_name, bah):
+        """Tx_fetch_data_c0: add carry to the base address high"""
+        src.emit('carry = p & 0x01')
+        src.emit('adh, p = alu({}, 0x00, p, {!r})'.format(bah, 'adc'))
+        if op_name not in RMW_OPS:
+            src.emit('if carry:')
+        if op_name in STR_OPS:
+            # Stores are not written after the page crossing
+            src.emit('w = (adh << 8) | adl', 3)
+            src.emit('t = m[w]', 3)
+            src.emit('c += 2', 3)
+        else:
+            indent = 2 if op_name in RMW_OPS else 3
+            cycles = self._access_source(
+                src, op_name, '(adh << 8) | adl', indent)
+            src.emit('c += {}'.format(1 + cycles), indent)
+        if op_name in RMW_OPS:
+            return
+        src.emit('else:')
+        if op_name in STR_OPS:
+            self._access_source(src, op_name, '({} << 8) | adl'.format(bah), 3)
+            src.emit('c += 2', 3)
+        else:
+            src.emit('t = m[({} << 8) | adl]'.format(bah), 3)
+            src.emit('c += 1', 3)
+
+    def _instruction(self, src, op_name, addr_mode, pc, operands):
+        """Emit the instruction up to T0 and return True if it may write"""
+        b1, b2 = operands
+        index = 'y' if addr_mode in ['zpgy', 'absy'] else 'x'
+        if addr_mode in ['acc', 'imm']:
+            src.emit('t = {}'.format(b1))
+            src.cycles += 2
+            return False
+        elif addr_mode == 'impl':
+            src.emit('t = {}'.format(b1))
+            if op_name in ['PHA', 'PHP']:
+                src.emit('w = 0x0100 | s')
+                src.emit('memory(w, {}, True)'.format(
+                    'a' if op_name == 'PHA' else 'p'))
+                src.emit('s = (s - 1) & 0xff')
+                src.cycles += 3
+                return True
+            elif op_name in ['PLA', 'PLP']:
+                src.emit('s = (s + 1) & 0xff')
+                src.emit('t = m[0x0100 | s]')
+                src.cycles += 4
+                return False
+            src.cycles += 2
+            return False
+        elif addr_mode == 'zpg':
+            src.emit('t = {}'.format(b1))
+            src.cycles += 2 + self._access_source(src, op_name, b1)
+        elif addr_mode in ['zpgx', 'zpgy']:
+            src.emit('t = {}'.format(b1))
+            src.emit('adl, p = alu({}, {}, p, {!r})'.format(index, b1, 'adc'))
+            src.cycles += 3 + self._access_source(src, op_name, 'adl')
+        elif addr_mode == 'abs':
+            src.emit('t = {}'.format(b1))
+            src.cycles += 3 + self._access_source(
+                src, op_name, (b2 << 8) | b1)
+        elif addr_mode in ['absx', 'absy']:
+            src.emit('t = {}'.format(b1))
+            src.emit('adl, p = alu({}, {}, p, {!r})'.format(index, b1, 'adc'))
+            src.cycles += 3
+            self._index_carry_source(src, op_name, b2)
+        elif addr_mode == 'indx':
+            src.emit('t = {}'.format(b1))
+            src.emit('zpa, p = alu(x, {}, p, {!r})'.format(b1, 'adc'))
+            src.emit('adl = m[zpa]')
+            src.emit('zpa, p = alu(zpa, 0x00, p, {!r})'.format('inc'))
+            src.cycles += 5 + self._access_source(
+                src, op_name, '(m[zpa] << 8) | adl')
+        elif addr_mode == 'indy':
+            src.emit('t = {}'.format(b1))
+            src.emit('bal = m[{}]'.format(b1))
+            src.emit('ial, p = alu({}, 0x00, p, {!r})'.format(b1, 'inc'))
+            src.emit('bah = m[ial]')
+            src.emit('adl, p = alu(y, bal, p, {!r})'.format('adc'))
+            src.cycles += 4
+            self._index_carry_source(src, op_name, 'bah')
+        return op_name in STR_OPS or op_name in RMW_OPS
+
+    def _terminator(self, src, op_name, addr_mode, pc, operands, execute,
+                    flag_op):
+        """Emit the instruction ending the block"""
+        b1, b2 = operands
+        if addr_mode == 'rel':
+            mask, is_set = BRANCHES.get(op_name, (0x00, False))
+            src.emit('t = {}'.format(b1))
+            if not mask:
+                self._fetch_source(src, pc + 1)
+                src.cycles += 2
+                src.exit()
+                return
+            # Relative address is added to PCL and carried to PCH
+            dst = (pc & 0xff) + 1 + b1
+            target = (((pc >> 8) + (dst >> 8)) << 8) | (dst & 0xff)
+            src.emit('if p & {} {} 0:'.format(mask, '!=' if is_set else '=='))
+            src.cycles += 3 + (dst >> 8)
+            self._fetch_source(src, target, 3)
+            src.exit(3)
+            src.emit('else:')
+            src.cycles -= 1 + (dst >> 8)
+            self._fetch_source(src, pc + 1, 3)
+            src.exit(3)
+            return
+
+        src.emit('t = {}'.format(b1))
+        if op_name == 'JMP' and addr_mode == 'abs':
+            src.emit('pc = {}'.format((b2 << 8) | b1))
+            src.cycles += 3
+        elif op_name == 'JMP':
+            src.emit('adl = m[{}]'.format((b2 << 8) | b1))
+            src.emit('ial, p = alu({}, 0x00, p, {!r})'.format(b1, 'inc'))
+            src.emit('t = adl')
+            src.emit('pc = (m[{} | ial] << 8) | adl'.format(b2 << 8))
+            src.cycles += 5
+        elif op_name == 'JSR':
+            src.emit('memory(0x0100 | s, {}, True)'.format((pc + 1) >> 8))
+            src.emit('s = (s - 1) & 0xff')
+            src.emit('memory(0x0100 | s, {}, True)'.format((pc + 1) & 0xff))
+            src.emit('s = (s - 1) & 0xff')
+            src.emit('pc = (m[{}] << 8) | {}'.format(pc + 1, b1))
+            src.cycles += 6
+        elif op_name == 'BRK':
+            src.emit('memory(0x0100 | s, {}, True)'.format(pc >> 8))
+            src.emit('s, p = alu(s, 0x00, p, {!r})'.format('dec'))
+            src.emit('memory(0x0100 | s, {}, True)'.format(pc & 0xff))
+            src.emit('s, p = alu(s, 0x00, p, {!r})'.format('dec'))
+            src.emit('memory(0x0100 | s, p, True)')
+            src.emit('s, p = alu(s, 0x00, p, {!r})'.format('dec'))
+            src.emit('t = m[0xfffe]')
+            src.emit('pc = (m[0xffff] << 8) | t')
+            src.cycles += 7
+        elif op_name == 'RTI':
+            src.emit('s = (s + 1) & 0xff')
+            src.emit('p = m[0x0100 | s]')
+            src.emit('s = (s + 1) & 0xff')
+            src.emit('pcl = m[0x0100 | s]')
+            src.emit('s = (s + 1) & 0xff')
+            src.emit('pc = (m[0x0100 | s] << 8) | pcl')
+            src.cycles += 6
+        elif op_name == 'RTS':
+            src.emit('s = (s + 1) & 0xff')
+            src.emit('pcl = m[0x0100 | s]')
+            src.emit('s = (s + 1) & 0xff')
+            src.emit('pch = m[0x0100 | s]')
+            src.emit('pc = (((pch << 8) | pcl) + 1) & 0xffff')
+            self._execute_source(src, execute, flag_op)
+            # Address bus high is not updated by the increment
+            src.emit('ir = m[(pch << 8) | (pc & 0xff)]')
+            src.emit('pc = (pc + 1) & 0xffff')
+            src.cycles += 6
+            src.exit()
+            return
+        self._execute_source(src, execute, flag_op)
+        src.emit('ir = m[pc]')
+        src.emit('pc = (pc + 1) & 0xffff')
+        src.exit()
@@ -0,0 +1,91 @@
+from mc6502.memory import Memory
+
+PAGE_SIZE = 0x100
+PAGES = 0x100
+
+
+def _ignore(address, data):
+    pass
+
+
+class Bus(Memory):
+    """Memory with a page table mapping each 256 byte page to RAM, ROM or
+    a device
+
+    A RAM or ROM page reads the backing bytearray at the address plus the
+    offset of the page, so mirrors cost one addition. A device page calls
+    `read(address)` and `write(address, data)` with the full address.
+    Unmapped pages are RAM at their own address.
+    """
+
+    def __init__(self, data=None, filename=None, size=0xffff, binfile=None):
+        super(Bus, self).__init__(data, filename, size, binfile)
+        self._offset = [0] * PAGES
+        self._read = [None] * PAGES
+        self._write = [None] * PAGES
+        self.mapped = False
+        # Reads of the device pages, see `IdleLoop`
+        self.device_reads = 0
+
+    def __call__(self, address, data=None, we=False):
+        page = address >> 8
+        if we and data is not None:
+            write = self._write[page]
+            if write is not None:
+                write(address, data)
+                return data
+            assert 0x00 <= data < 0x100, \
+                'data: 0x{:x} address: 0x{:x}'.format(data, address)
+            address += self._offset[page]
+            self._data[address] = data
+            if self._watch is not None and self._watch[address]:
+                self._watcher(address)
+            return data
+        read = self._read[page]
+        if read is None:
+            return self._data[address + self._offset[page]]
+        self.device_reads += 1
+        return read(address)
+
+    def backing(self, address):
+        page = address >> 8
+        if self._read[page] is not None:
+            return None
+        return address + self._offset[page]
+
+    def _pages(self, start, stop):
+        assert start % PAGE_SIZE == 0 and stop % PAGE_SIZE == 0 and \
+            0 <= start < stop <= PAGE_SIZE * PAGES, \
+            'unaligned pages 0x{:x}-0x{:x}'.format(start, stop)
+        return range(start // PAGE_SIZE, stop // PAGE_SIZE)
+
+    def _update(self):
+        self.mapped = any(read is not None for read in self._read) or \
+            any(self._offset) or \
+            any(write is not None for write in self._write)
+
+    def map_ram(self, start, stop, base=None, size=None, rom=False):
+        """Map [start, stop) to the memory at `base` repeated every `size`
+        bytes; ROM ignores writes"""
+        base = start if base is None else base
+        size = stop - start if size is None else size
+        assert size % PAGE_SIZE == 0, 'unaligned size 0x{:x}'.format(size)
+        for page in self._pages(start, stop):
+            address = page * PAGE_SIZE
+            self._offset[page] = base + (address - start) % size - address
+            self._read[page] = None
+            self._write[page] = _ignore if rom else None
+        self._update()
+
+    def map_device(self, start, stop, read, write=None):
+        """Map [start, stop) to the device handlers; mirrors are mapped by
+        calling this again with the same handlers"""
+        for page in self._pages(start, stop):
+            self._offset[page] = 0
+            self._read[page] = read
+            self._write[page] = _ignore if write is None else write
+        self._update()
+
+    def unmap(self, start=0x0000, stop=PAGE_SIZE * PAGES):
+        """Bring [start, stop) back to RAM at its own address"""
+        self.map_ram(start, stop)
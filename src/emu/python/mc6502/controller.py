@@ -1,17 +1,293 @@
 from mc6502 import decoder
+from mc6502.datapath import DB_SELECTOR, PCL_SELECTOR, PCH_SELECTOR, \
+    ALU_A_SELECTOR, ALU_B_SELECTOR, REG_SELECTOR, P_SELECTOR, \
+    ABL_SELECTOR, ABH_SELECTOR
+from mc6502.flag import C, Z, V, N, PCC
+
+
+# Control signals driven by the controller to the datapath in every cycle
+SIGNALS = (
+    'r_w', 'db_src', 'dl_we', 'ir_we',
+    'pcadder_ctrl', 'pcl_src', 'pcl_we', 'pch_src', 'pch_we',
+    'reg_src', 'a_we', 'x_we', 'y_we', 's_we', 't_we',
+    'p_src', 'p_mask',
+    'alu_src_a', 'alu_src_b', 'alu_ctrl',
+    'abl_src', 'abl_we', 'abh_src', 'abh_we',
+)
+
+# Multiplexer selectors of the datapath resolved from the source signals,
+# kept in the control words next to the signals
+SELECTORS = (
+    'db_sel', 'pcl_sel', 'pch_sel', 'reg_sel', 'p_sel',
+    'alu_sel_a', 'alu_sel_b', 'abl_sel', 'abh_sel',
+)
+
+def execute_control(op_name, addr_mode):
+    """Return tuple (ALU source A, ALU destination, ALU control) to
+    execute the instruction at T0"""
+    a_m = 'a' if addr_mode == 'acc' else 'm'
+    return {
+        # op     A   Out  Control
+        'ADC': ('a', 'a', 'adc'),
+        'AND': ('a', 'a', 'and'),
+        'ASL': (a_m, a_m, 'asl'),
+        'BIT': ('a', 'a', 'bit'),
+        'CMP': ('a', 'a', 'cmp'),
+        'CPX': ('x', 'x', 'cmp'),
+        'CPY': ('y', 'y', 'cmp'),
+        'DEC': ('t', 't', 'dec'),
+        'DEX': ('x', 'x', 'dec'),
+        'DEY': ('y', 'y', 'dec'),
+        'EOR': ('a', 'a', 'eor'),
+        'INC': ('t', 't', 'inc'),
+        'INX': ('x', 'x', 'inc'),
+        'INY': ('y', 'y', 'inc'),
+        'LDA': ('t', 'a', 'tha'),
+        'LDX': ('t', 'x', 'tha'),
+        'LDY': ('t', 'y', 'tha'),
+        'LSR': (a_m, a_m, 'lsr'),
+        'ORA': ('a', 'a', 'ora'),
+        'PLA': ('t', 'a', 'tha'),
+        'PLP': ('t', 'p', 'tha'),
+        'ROL': (a_m, a_m, 'rol'),
+        'ROR': (a_m, a_m, 'ror'),
+        'SBC': ('a', 'a', 'sbc'),
+        'TAX': ('a', 'x', 'tha'),
+        'TAY': ('a', 'y', 'tha'),
+        'TSX': ('s', 'x', 'tha'),
+        'TXA': ('x', 'a', 'tha'),
+        'TXS': ('x', 's', 'tha'),
+        'TYA': ('y', 'a', 'tha'),
+    }.get(op_name, ('-', '-', 'tha'))
+
+
+# FSM states, a snapshot keeps the state as the index of this tuple
+STATES = (
+    'T0_fetch_opcode', 'T1_fetch_operand',
+    'Tx_fetch_data_c0', 'Tx_fetch_data', 'Tx_modify_data', 'Tx_write_data',
+    'T2_abs_addr_mode', 'T3_jsr_op', 'T4_jsr_op', 'T5_jsr_op',
+    'T2_absi_addr_mode',
+    'T2_ind_addr_mode', 'T3_ind_addr_mode', 'T4_ind_addr_mode',
+    'T2_indx_addr_mode', 'T3_indx_addr_mode', 'T4_indx_addr_mode',
+    'T2_indy_addr_mode', 'T3_indy_addr_mode',
+    'T2_rel_addr_mode', 'T3_rel_addr_mode',
+    'T2_zpgi_addr_mode',
+    'T2_brk_op', 'T3_brk_op', 'T4_brk_op', 'T5_brk_op', 'T6_brk_op',
+    'T2_plr_op', 'T2_phr_op',
+    'T2_rti_op', 'T3_rti_op', 'T4_rti_op', 'T5_rti_op',
+    'T2_rts_op', 'T3_rts_op', 'T4_rts_op', 'T5_rts_op',
+)
+
+# State ids, the controller keeps the state as one of them
+(T0_FETCH_OPCODE, T1_FETCH_OPERAND,
+ TX_FETCH_DATA_C0, TX_FETCH_DATA, TX_MODIFY_DATA, TX_WRITE_DATA,
+ T2_ABS_ADDR_MODE, T3_JSR_OP, T4_JSR_OP, T5_JSR_OP,
+ T2_ABSI_ADDR_MODE,
+ T2_IND_ADDR_MODE, T3_IND_ADDR_MODE, T4_IND_ADDR_MODE,
+ T2_INDX_ADDR_MODE, T3_INDX_ADDR_MODE, T4_INDX_ADDR_MODE,
+ T2_INDY_ADDR_MODE, T3_INDY_ADDR_MODE,
+ T2_REL_ADDR_MODE, T3_REL_ADDR_MODE,
+ T2_ZPGI_ADDR_MODE,
+ T2_BRK_OP, T3_BRK_OP, T4_BRK_OP, T5_BRK_OP, T6_BRK_OP,
+ T2_PLR_OP, T2_PHR_OP,
+ T2_RTI_OP, T3_RTI_OP, T4_RTI_OP, T5_RTI_OP,
+ T2_RTS_OP, T3_RTS_OP, T4_RTS_OP, T5_RTS_OP) = range(len(STATES))
+
+# States of pure write cycles, the data read from the bus is not used in
+# them. Tx_modify_data writes back the data read again in the same cycle.
+WRITE_STATES = frozenset([
+    TX_WRITE_DATA, T3_JSR_OP, T4_JSR_OP,
+    T2_BRK_OP, T3_BRK_OP, T4_BRK_OP, T2_PHR_OP,
+])
+
+# Flags which the state functions look at by state id, the others never
+# change the control word nor the next state
+FLAG_DEPENDENCY = tuple({
+    T1_FETCH_OPERAND: C | Z | V | N,
+    TX_FETCH_DATA_C0: C,
+    T2_REL_ADDR_MODE: PCC,
+}.get(state, 0x000) for state in range(len(STATES)))
+
+
+# Processor status operations at T0 (mask, 'set' or 'clr')
+FLAG_OPERATION = {
+    'CLC': (0x01, 'clr'), 'SEC': (0x01, 'set'),
+    'CLI': (0x04, 'clr'), 'SEI': (0x04, 'set'),
+    'CLD': (0x08, 'clr'), 'SED': (0x08, 'set'),
+    'CLV': (0x40, 'clr'),
+}
+
+
+# Op names and addressing modes by id, the last ones are of the illegal
+# opcodes
+_decoder = decoder.InstructionDecoder()
+OP_NAMES = tuple(_decoder.name) + (None,)
+ADDR_MODES = tuple(_decoder.mode) + (None,)
+OP_ID = dict((name, i) for i, name in enumerate(OP_NAMES))
+MODE_ID = dict((mode, i) for i, mode in enumerate(ADDR_MODES))
+
+_JMP, _JSR, _PHA = OP_ID['JMP'], OP_ID['JSR'], OP_ID['PHA']
+_ABSX, _ZPGX, _IMPL = MODE_ID['absx'], MODE_ID['zpgx'], MODE_ID['impl']
+_STORE_SOURCE = {OP_ID['STA']: 'a', OP_ID['STX']: 'x', OP_ID['STY']: 'y'}
+
+# Opcode properties
+RMW = 0x01      # ASL, DEC, INC, LSR, ROL and ROR
+STORE = 0x02    # STA, STX and STY
+STACK = 0x04    # Address bus at the stack after T1
+ZERO_PAGE = 0x08  # Address bus at the zero page after T1
+BRANCH = 0x10   # Conditional branch
+
+# Branch conditions (flag, value to take the branch)
+BRANCH_CONDITION = {
+    'BCC': (C, 0), 'BCS': (C, C), 'BNE': (Z, 0), 'BEQ': (Z, Z),
+    'BVC': (V, 0), 'BVS': (V, V), 'BPL': (N, 0), 'BMI': (N, N),
+}
+
+# Next state after T1 by addressing mode, and by op for implied ones
+_T1_NEXT = {
+    'acc': T0_FETCH_OPCODE, 'imm': T0_FETCH_OPCODE,
+    'abs': T2_ABS_ADDR_MODE,
+    'absx': T2_ABSI_ADDR_MODE, 'absy': T2_ABSI_ADDR_MODE,
+    'ind': T2_IND_ADDR_MODE, 'indx': T2_INDX_ADDR_MODE,
+    'indy': T2_INDY_ADDR_MODE,
+    'zpgx': T2_ZPGI_ADDR_MODE, 'zpgy': T2_ZPGI_ADDR_MODE,
+    'rel': T0_FETCH_OPCODE,     # T2_rel_addr_mode if the branch is taken
+}
+_T1_NEXT_IMPL = {
+    'BRK': T2_BRK_OP,
+    'PLA': T2_PLR_OP, 'PLP': T2_PLR_OP,
+    'PHA': T2_PHR_OP, 'PHP': T2_PHR_OP,
+    'RTI': T2_RTI_OP, 'RTS': T2_RTS_OP,
+}
+
+
+def _opcodes():
+    ret = []
+    for opcode in range(0x100):
+        op_name, addr_mode, _ = _decoder(opcode)
+        props = 0
+        if op_name in ['ASL', 'DEC', 'INC', 'LSR', 'ROL', 'ROR']:
+            props |= RMW
+        if op_name in ['STA', 'STX', 'STY']:
+            props |= STORE
+        if addr_mode in ['indx', 'indy', 'zpg', 'zpgx', 'zpgy']:
+            props |= ZERO_PAGE
+        elif op_name in ['PHP', 'PHA', 'PLP', 'PLA',
+                         'JSR', 'BRK', 'RTI', 'RTS']:
+            props |= STACK
+        if op_name in BRANCH_CONDITION:
+            props |= BRANCH
+        if addr_mode == 'zpg':
+            t1_next = TX_WRITE_DATA if props & STORE else TX_FETCH_DATA
+        elif addr_mode == 'impl':
+            t1_next = _T1_NEXT_IMPL.get(op_name, T0_FETCH_OPCODE)
+        else:
+            t1_next = _T1_NEXT.get(addr_mode)
+        ret.append((
+            OP_ID[op_name], MODE_ID[addr_mode], props,
+            BRANCH_CONDITION.get(op_name, (0x00, 0x00)), t1_next,
+            execute_control(op_name, addr_mode),
+            FLAG_OPERATION.get(op_name, (0x00, None))))
+    return tuple(ret)
+
+# Decoded opcodes: (op id, mode id, properties, branch condition, next
+# state after T1, execute control, flag operation)
+OPCODES = _opcodes()
 
 
 class Controller(object):
 
-    def __init__(self):
-        self._decoder = decoder.InstructionDecoder()
+    # Precompiled control words shared by all instances
+    # (state, opcode, flags) packed in an int -> (control word, next state,
+    # opcode decoded at T1)
+    _control_words = {}
+
+    def __init__(self, precompiled=False):
+        self._precompiled = precompiled
+
+        self._state = T0_FETCH_OPCODE
+        self._decode(0xea)
+
+        # State functions by state id
+        self._functions = [
+            # Common part
+            self._t0_fetch_opcode,
+            self._t1_fetch_operand,
+
+            # Fetch/Moidify/Write
+            self._tx_fetch_data_c0,
+            self._tx_fetch_data,
+            self._tx_modify_data,
+            self._tx_write_data,
+
+            # Absolute Addressing
+            self._t2_abs_addr_mode,
+            self._t3_jsr_op,
+            self._t4_jsr_op,
+            self._t5_jsr_op,
 
-        self._state = 'T0_fetch_opcode'
-        self._instr = 0xea
-        self._op_name = 'NOP'
-        self._addr_mode = 'impl'
+            # Absolute, X or Y Addressing
+            self._t2_absi_addr_mode,
+
+            # Indirect Addressing (JMP Operation)
+            self._t2_ind_addr_mode,
+            self._t3_ind_addr_mode,
+            self._t4_ind_addr_mode,
+
+            # Indirect, X Addressing
+            self._t2_indx_addr_mode,
+            self._t3_indx_addr_mode,
+            self._t4_indx_addr_mode,
+
+            # Indirect, Y Addressing
+            self._t2_indy_addr_mode,
+            self._t3_indy_addr_mode,
+
+            # Relative Addressing (Branch Operations)
+            self._t2_rel_addr_mode,
+            self._t3_rel_addr_mode,
+
+            # Zero Page, X or Y Addressing
+            self._t2_zpgi_addr_mode,
+
+            # Implied Addressing
+            self._t2_brk_op,
+            self._t3_brk_op,
+            self._t4_brk_op,
+            self._t5_brk_op,
+            self._t6_brk_op,
+
+            self._t2_plr_op,
+            self._t2_phr_op,
+
+            self._t2_rti_op,
+            self._t3_rti_op,
+            self._t4_rti_op,
+            self._t5_rti_op,
+
+            self._t2_rts_op,
+            self._t3_rts_op,
+            self._t4_rts_op,
+            self._t5_rts_op,
+        ]
+        assert len(self._functions) == len(STATES)
 
         self.reset()
+        self._select()
+
+    def _decode(self, instr):
+        """Latch the instruction `instr` decoded through `OPCODES`"""
+        self._instr = instr
+        self._opcode = OPCODES[instr]
+        self._op, self._mode, self._props = self._opcode[:3]
+
+    @property
+    def _op_name(self):
+        return OP_NAMES[self._op]
+
+    @property
+    def _addr_mode(self):
+        return ADDR_MODES[self._mode]
 
     def reset(self):
         self.r_w = 'r'
@@ -57,7 +333,8 @@ class Controller(object):
         str_reg = lambda src, we: '({},{})'.format(src, we)
         fmt = [
             'OPCODE={}(0x{:02x}) ADDRMODE={} NextSTATE={}'.format(
-                self._op_name, self._instr, self._addr_mode, self._state),
+                self._op_name, self._instr, self._addr_mode,
+                STATES[self._state]),
             'RW={} DBSrc={} DLWe={} IRWe={}'.format(
                 self.r_w, self.db_src, self.dl_we, self.ir_we),
             'PCL={} PCH={} PCAdderCtrl={}'.format(
@@ -80,112 +357,63 @@ class Controller(object):
 
     def __call__(self, instr, flag, rdy=True,
                  res_n=True, irq_n=True, nmi_n=True):
+        if self._precompiled:
+            self._replay(instr, flag)
+        else:
+            self._interpret(instr, flag)
+
+    def _replay(self, instr, flag):
+        state = self._state
+        key = (state << 8 | (instr if state == T1_FETCH_OPERAND else
+                             self._instr)) << 9 | \
+            flag.data & FLAG_DEPENDENCY[state]
+
+        entry = self._control_words.get(key)
+        if entry is None:
+            entry = self._compile(instr, flag)
+            self._control_words[key] = entry
+
+        word, self._state, decoded = entry
+        self.__dict__.update(word)
+        if decoded is not None:
+            self._decode(decoded)
+
+    def _compile(self, instr, flag):
+        """Resolve the current state into an immutable control word"""
+        decode = self._state == T1_FETCH_OPERAND
+        self._interpret(instr, flag)
+        word = tuple((name, getattr(self, name))
+                     for name in SIGNALS + SELECTORS)
+        decoded = self._instr if decode else None
+        return word, self._state, decoded
+
+    def _interpret(self, instr, flag):
         self.reset()
-        self._state = {
-            # Common part
-            'T0_fetch_opcode': self._t0_fetch_opcode,
-            'T1_fetch_operand': self._t1_fetch_operand,
-
-            # Fetch/Moidify/Write
-            'Tx_fetch_data_c0': self._tx_fetch_data_c0,
-            'Tx_fetch_data': self._tx_fetch_data,
-            'Tx_modify_data': self._tx_modiry_data,
-            'Tx_write_data': self._tx_write_data,
-
-            # Absolute Addressing
-            'T2_abs_addr_mode': self._t2_abs_addr_mode,
-            'T3_jsr_op': self._t3_jsr_op,
-            'T4_jsr_op': self._t4_jsr_op,
-            'T5_jsr_op': self._t5_jsr_op,
-
-            # Absolute, X or Y Addressing
-            'T2_absi_addr_mode': self._t2_absi_addr_mode,
-
-            # Indirect Addressing (JMP Operation)
-            'T2_ind_addr_mode': self._t2_ind_addr_mode,
-            'T3_ind_addr_mode': self._t3_ind_addr_mode,
-            'T4_ind_addr_mode': self._t4_ind_addr_mode,
-
-            # Indirect, X Addressing
-            'T2_indx_addr_mode': self._t2_indx_addr_mode,
-            'T3_indx_addr_mode': self._t3_indx_addr_mode,
-            'T4_indx_addr_mode': self._t4_indx_addr_mode,
-
-            # Indirect, Y Addressing
-            'T2_indy_addr_mode': self._t2_indy_addr_mode,
-            'T3_indy_addr_mode': self._t3_indy_addr_mode,
-
-            # Relative Addressing (Branch Operations)
-            'T2_rel_addr_mode': self._t2_rel_addr_mode,
-            'T3_rel_addr_mode': self._t3_rel_addr_mode,
-
-            # Zero Page, X or Y Addressing
-            'T2_zpgi_addr_mode': self._t2_zpgi_addr_mode,
-
-            # Implied Addressing
-            'T2_brk_op': self._t2_brk_op,
-            'T3_brk_op': self._t3_brk_op,
-            'T4_brk_op': self._t4_brk_op,
-            'T5_brk_op': self._t5_brk_op,
-            'T6_brk_op': self._t6_brk_op,
-
-            'T2_plr_op': self._t2_plr_op,
-            'T2_phr_op': self._t2_phr_op,
-
-            'T2_rti_op': self._t2_rti_op,
-            'T3_rti_op': self._t3_rti_op,
-            'T4_rti_op': self._t4_rti_op,
-            'T5_rti_op': self._t5_rti_op,
-
-            'T2_rts_op': self._t2_rts_op,
-            'T3_rts_op': self._t3_rts_op,
-            'T4_rts_op': self._t4_rts_op,
-            'T5_rts_op': self._t5_rts_op,
-        }[self._state](instr, flag)
+        self._state = self._functions[self._state](instr, flag)
+        self._select()
+
+    def _select(self):
+        """Resolve the source signals into the multiplexer selectors"""
+        self.db_sel = DB_SELECTOR[self.db_src]
+        self.pcl_sel = PCL_SELECTOR[self.pcl_src]
+        self.pch_sel = PCH_SELECTOR[self.pch_src]
+        self.reg_sel = REG_SELECTOR[self.reg_src]
+        self.p_sel = P_SELECTOR[self.p_src]
+        self.alu_sel_a = ALU_A_SELECTOR[self.alu_src_a]
+        self.alu_sel_b = ALU_B_SELECTOR[self.alu_src_b]
+        self.abl_sel = ABL_SELECTOR[self.abl_src]
+        self.abh_sel = ABH_SELECTOR[self.abh_src]
 
     def _execute_control(self):
-        a_m = 'a' if self._addr_mode == 'acc' else 'm'
-        return {
-            # op     A   Out  Control
-            'ADC': ('a', 'a', 'adc'),
-            'AND': ('a', 'a', 'and'),
-            'ASL': (a_m, a_m, 'asl'),
-            'BIT': ('a', 'a', 'bit'),
-            'CMP': ('a', 'a', 'cmp'),
-            'CPX': ('x', 'x', 'cmp'),
-            'CPY': ('y', 'y', 'cmp'),
-            'DEC': ('t', 't', 'dec'),
-            'DEX': ('x', 'x', 'dec'),
-            'DEY': ('y', 'y', 'dec'),
-            'EOR': ('a', 'a', 'eor'),
-            'INC': ('t', 't', 'inc'),
-            'INX': ('x', 'x', 'inc'),
-            'INY': ('y', 'y', 'inc'),
-            'LDA': ('t', 'a', 'tha'),
-            'LDX': ('t', 'x', 'tha'),
-            'LDY': ('t', 'y', 'tha'),
-            'LSR': (a_m, a_m, 'lsr'),
-            'ORA': ('a', 'a', 'ora'),
-            'PLA': ('t', 'a', 'tha'),
-            'PLP': ('t', 'p', 'tha'),
-            'ROL': (a_m, a_m, 'rol'),
-            'ROR': (a_m, a_m, 'ror'),
-            'SBC': ('a', 'a', 'sbc'),
-            'TAX': ('a', 'x', 'tha'),
-            'TAY': ('a', 'y', 'tha'),
-            'TSX': ('s', 'x', 'tha'),
-            'TXA': ('x', 'a', 'tha'),
-            'TXS': ('x', 's', 'tha'),
-            'TYA': ('y', 'a', 'tha'),
-        }.get(self._op_name, ('-', '-', 'tha'))
+        return self._opcode[5]
 
     @property
     def _is_rmw_type(self):
-        return self._op_name in ['ASL', 'DEC', 'INC', 'LSR', 'ROL', 'ROR']
+        return self._props & RMW != 0
 
     @property
     def _is_str_type(self):
-        return self._op_name in ['STA', 'STX', 'STY']
+        return self._props & STORE != 0
 
     def _t0_fetch_opcode(self, instr, flag):
         # Instruction Register
@@ -213,12 +441,7 @@ class Controller(object):
         self.reg_src = 'alu'
 
         # Change Processor Status Register
-        flag_op = {
-            'CLC': (0x01, 'clr'), 'SEC': (0x01, 'set'),
-            'CLI': (0x04, 'clr'), 'SEI': (0x04, 'set'),
-            'CLD': (0x08, 'clr'), 'SED': (0x08, 'set'),
-            'CLV': (0x40, 'clr'),
-        }.get(self._op_name, (0x00, None))
+        flag_op = self._opcode[6]
         self.p_mask = flag_op[0]
 
         if alu_dst == 'p':
@@ -233,29 +456,23 @@ class Controller(object):
         self.abh_we = True
 
         # Next state
-        next_state = 'T1_fetch_operand'
+        next_state = T1_FETCH_OPERAND
         return next_state
 
     def _t1_fetch_operand(self, instr, flag):
         # Decode instruction
-        decoded = self._decoder(instr)
-        self._instr = instr
-        self._op_name = decoded[0]
-        self._addr_mode = decoded[1]
+        self._decode(instr)
+        props = self._props
 
         # Is branch?
-        is_branch = {
-            'BCC': flag['C'] == 0, 'BCS': flag['C'] == 1,
-            'BNE': flag['Z'] == 0, 'BEQ': flag['Z'] == 1,
-            'BVC': flag['V'] == 0, 'BVS': flag['V'] == 1,
-            'BPL': flag['N'] == 0, 'BMI': flag['N'] == 1,
-        }.get(self._op_name, False)
+        mask, value = self._opcode[3]
+        is_branch = props & BRANCH != 0 and flag.data & mask == value
 
         # Program Counter
-        self.pcadder_ctrl = {
-            'impl': 'nop',
-            'rel': 'add' if is_branch else 'inc',
-        }.get(self._addr_mode, 'inc')
+        if self._mode == _IMPL:
+            self.pcadder_ctrl = 'nop'
+        else:
+            self.pcadder_ctrl = 'add' if is_branch else 'inc'
         self.pcl_we = True
         self.pcl_src = 'padr'
         self.pch_we = True
@@ -271,11 +488,10 @@ class Controller(object):
         # Address Bus (fetch data from the address at next cycle)
         self.abl_we = True
         self.abh_we = True
-        if self._addr_mode in ['indx', 'indy', 'zpg', 'zpgx', 'zpgy']:
+        if props & ZERO_PAGE:
             self.abl_src = 'm'
             self.abh_src = '0'
-        elif self._op_name in ['PHP', 'PHA', 'PLP', 'PLA',
-                               'JSR', 'BRK', 'RTI', 'RTS']:
+        elif props & STACK:
             self.abl_src = 's'
             self.abh_src = '1'
         else:
@@ -283,26 +499,11 @@ class Controller(object):
             self.abh_src = 'pch'
 
         # Next state
-        next_state = {
-            'acc': 'T0_fetch_opcode',
-            'imm': 'T0_fetch_opcode',
-            'abs': 'T2_abs_addr_mode',
-            'absx': 'T2_absi_addr_mode',
-            'absy': 'T2_absi_addr_mode',
-            'ind': 'T2_ind_addr_mode',
-            'indx': 'T2_indx_addr_mode',
-            'indy': 'T2_indy_addr_mode',
-            'zpg': 'Tx_write_data' if self._is_str_type else 'Tx_fetch_data',
-            'zpgx': 'T2_zpgi_addr_mode',
-            'zpgy': 'T2_zpgi_addr_mode',
-            'rel': 'T2_rel_addr_mode' if is_branch else 'T0_fetch_opcode',
-            'impl': {
-                'BRK': 'T2_brk_op',
-                'PLA': 'T2_plr_op', 'PLP': 'T2_plr_op',
-                'PHA': 'T2_phr_op', 'PHP': 'T2_phr_op',
-                'RTI': 'T2_rti_op', 'RTS': 'T2_rts_op',
-            }.get(self._op_name, 'T0_fetch_opcode'),
-        }[self._addr_mode]
+        next_state = self._opcode[4]
+        if next_state is None:
+            raise KeyError(instr)
+        if is_branch:
+            next_state = T2_REL_ADDR_MODE
 
         return next_state
 
@@ -324,7 +525,7 @@ class Controller(object):
             # - ADH + C, ADL
             self.abh_we = True
             self.abh_src = 'alu'
-        elif self._op_name in ['STA', 'STX', 'STY']:
+        elif self._is_str_type:
             self.abl_we = False
             self.abh_we = False
         else:
@@ -335,11 +536,11 @@ class Controller(object):
 
         # Next state
         if flag['C'] or self._is_rmw_type:
-            next_state = 'Tx_fetch_data'
+            next_state = TX_FETCH_DATA
         elif self._is_str_type:
-            next_state = 'Tx_write_data'
+            next_state = TX_WRITE_DATA
         else:
-            next_state = 'T0_fetch_opcode'
+            next_state = T0_FETCH_OPCODE
         return next_state
 
     def _tx_fetch_data(self, instr, flag):
@@ -358,11 +559,11 @@ class Controller(object):
             self.abh_src = 'pch'
 
         # Next state
-        next_state = 'Tx_modify_data' if self._is_rmw_type else \
-                     'T0_fetch_opcode'
+        next_state = TX_MODIFY_DATA if self._is_rmw_type else \
+                     T0_FETCH_OPCODE
         return next_state
 
-    def _tx_modiry_data(self, instr, flag):
+    def _tx_modify_data(self, instr, flag):
         self.r_w = 'w'
 
         # Execute
@@ -378,14 +579,14 @@ class Controller(object):
         self.reg_src = 'alu'
 
         # Next state
-        next_state = 'Tx_write_data'
+        next_state = TX_WRITE_DATA
         return next_state
 
     def _tx_write_data(self, instr, flag):
         # Data Bus
         self.r_w = 'w'
-        if self._op_name in ['STA', 'STX', 'STY']:
-            self.db_src = {'STA': 'a', 'STX': 'x', 'STY': 'y'}[self._op_name]
+        if self._is_str_type:
+            self.db_src = _STORE_SOURCE[self._op]
         else:
             self.db_src = 't'
 
@@ -396,12 +597,12 @@ class Controller(object):
         self.abh_src = 'pch'
 
         # Next state
-        next_state = 'T0_fetch_opcode'
+        next_state = T0_FETCH_OPCODE
         return next_state
 
     def _t2_abs_addr_mode(self, instr, flag):
         # Program Counter
-        self.pcadder_ctrl = 'nop' if self._op_name == 'JSR' else 'inc'
+        self.pcadder_ctrl = 'nop' if self._op == _JSR else 'inc'
 
         # Input Data Latch (ADH)
         self.dl_we = True
@@ -409,7 +610,7 @@ class Controller(object):
         # Program Counter
         self.pcl_we = True
         self.pch_we = True
-        if self._op_name == 'JMP':
+        if self._op == _JMP:
             self.pcl_src = 't'
             self.pch_src = 'm'
         else:
@@ -417,7 +618,7 @@ class Controller(object):
             self.pch_src = 'padr'
 
         # Address Bus (fetch data from the address at next cycle)
-        if self._op_name != 'JSR':
+        if self._op != _JSR:
             # - ADH, ADL
             self.abl_we = True
             self.abl_src = 't'
@@ -425,14 +626,14 @@ class Controller(object):
             self.abh_src = 'm'
 
         # Next state
-        if self._op_name == 'JMP':
-            next_state = 'T0_fetch_opcode'
-        elif self._op_name == 'JSR':
-            next_state = 'T3_jsr_op'
+        if self._op == _JMP:
+            next_state = T0_FETCH_OPCODE
+        elif self._op == _JSR:
+            next_state = T3_JSR_OP
         elif self._is_str_type:
-            next_state = 'Tx_write_data'
+            next_state = TX_WRITE_DATA
         else:
-            next_state = 'Tx_fetch_data'
+            next_state = TX_FETCH_DATA
         return next_state
 
     def _t3_jsr_op(self, instr, flag):
@@ -458,7 +659,7 @@ class Controller(object):
         self.abl_src = 'alu'
 
         # Next state
-        next_state = 'T4_jsr_op'
+        next_state = T4_JSR_OP
         return next_state
 
     def _t4_jsr_op(self, instr, flag):
@@ -486,7 +687,7 @@ class Controller(object):
         self.abh_src = 'pch'
 
         # Next state
-        next_state = 'T5_jsr_op'
+        next_state = T5_JSR_OP
         return next_state
 
     def _t5_jsr_op(self, instr, flag):
@@ -507,7 +708,7 @@ class Controller(object):
         self.abh_src = 'm'
 
         # Next state
-        next_state = 'T0_fetch_opcode'
+        next_state = T0_FETCH_OPCODE
         return next_state
 
     def _t2_absi_addr_mode(self, instr, flag):
@@ -522,7 +723,7 @@ class Controller(object):
         self.dl_we = True
 
         # Execute BAL + index register
-        self.alu_src_a = 'x' if self._addr_mode == 'absx' else 'y'
+        self.alu_src_a = 'x' if self._mode == _ABSX else 'y'
         self.alu_src_b = 't'
         self.alu_ctrl = 'adc'
 
@@ -538,7 +739,7 @@ class Controller(object):
         self.abh_src = 'm'
 
         # Next state
-        next_state = 'Tx_fetch_data_c0'
+        next_state = TX_FETCH_DATA_C0
         return next_state
 
     def _t2_ind_addr_mode(self, instr, flag):
@@ -560,7 +761,7 @@ class Controller(object):
         self.abh_src = 'm'
 
         # Next state
-        next_state = 'T3_ind_addr_mode'
+        next_state = T3_IND_ADDR_MODE
         return next_state
 
     def _t3_ind_addr_mode(self, instr, flag):
@@ -582,7 +783,7 @@ class Controller(object):
         self.abl_src = 'alu'
 
         # Next state
-        next_state = 'T4_ind_addr_mode'
+        next_state = T4_IND_ADDR_MODE
         return next_state
 
     def _t4_ind_addr_mode(self, instr, flag):
@@ -603,7 +804,7 @@ class Controller(object):
         self.abh_src = 'm'
 
         # Next state
-        next_state = 'T0_fetch_opcode'
+        next_state = T0_FETCH_OPCODE
         return next_state
 
     def _t2_indx_addr_mode(self, instr, flag):
@@ -622,7 +823,7 @@ class Controller(object):
         self.abl_src = 'alu'
 
         # Next state
-        next_state = 'T3_indx_addr_mode'
+        next_state = T3_INDX_ADDR_MODE
         return next_state
 
     def _t3_indx_addr_mode(self, instr, flag):
@@ -644,7 +845,7 @@ class Controller(object):
         self.abl_src = 'alu'
 
         # Next state
-        next_state = 'T4_indx_addr_mode'
+        next_state = T4_INDX_ADDR_MODE
         return next_state
 
     def _t4_indx_addr_mode(self, instr, flag):
@@ -659,7 +860,7 @@ class Controller(object):
         self.abh_src = 'm'
 
         # Next state
-        next_state = 'Tx_write_data' if self._is_str_type else 'Tx_fetch_data'
+        next_state = TX_WRITE_DATA if self._is_str_type else TX_FETCH_DATA
         return next_state
 
     def _t2_indy_addr_mode(self, instr, flag):
@@ -681,7 +882,7 @@ class Controller(object):
         self.abl_src = 'alu'
 
         # Next state
-        next_state = 'T3_indy_addr_mode'
+        next_state = T3_INDY_ADDR_MODE
         return next_state
 
     def _t3_indy_addr_mode(self, instr, flag):
@@ -705,7 +906,7 @@ class Controller(object):
         self.abh_src = 'm'
 
         # Next state
-        next_state = 'Tx_fetch_data_c0'
+        next_state = TX_FETCH_DATA_C0
         return next_state
 
     def _t2_rel_addr_mode(self, instr, flag):
@@ -723,19 +924,19 @@ class Controller(object):
 
         # Next state
         if flag['PCC']:
-            next_state = 'T3_rel_addr_mode'
+            next_state = T3_REL_ADDR_MODE
         else:
-            next_state = 'T0_fetch_opcode'
+            next_state = T0_FETCH_OPCODE
         return next_state
 
     def _t3_rel_addr_mode(self, instr, flag):
         # Next state
-        next_state = 'T0_fetch_opcode'
+        next_state = T0_FETCH_OPCODE
         return next_state
 
     def _t2_zpgi_addr_mode(self, instr, flag):
         # Execute BAL + index register
-        self.alu_src_a = 'x' if self._addr_mode == 'zpgx' else 'y'
+        self.alu_src_a = 'x' if self._mode == _ZPGX else 'y'
         self.alu_src_b = 'm'
         self.alu_ctrl = 'adc'
 
@@ -745,7 +946,7 @@ class Controller(object):
         self.abl_src = 'alu'
 
         # Next state
-        next_state = 'Tx_write_data' if self._is_str_type else 'Tx_fetch_data'
+        next_state = TX_WRITE_DATA if self._is_str_type else TX_FETCH_DATA
         return next_state
 
     def _t2_brk_op(self, instr, flag):
@@ -768,7 +969,7 @@ class Controller(object):
         self.abl_src = 'alu'
 
         # Next state
-        next_state = 'T3_brk_op'
+        next_state = T3_BRK_OP
         return next_state
 
     def _t3_brk_op(self, instr, flag):
@@ -791,7 +992,7 @@ class Controller(object):
         self.abl_src = 'alu'
 
         # Next state
-        next_state = 'T4_brk_op'
+        next_state = T4_BRK_OP
         return next_state
 
     def _t4_brk_op(self, instr, flag):
@@ -816,7 +1017,7 @@ class Controller(object):
         self.abh_src = 'ff'
 
         # Next state
-        next_state = 'T5_brk_op'
+        next_state = T5_BRK_OP
         return next_state
 
     def _t5_brk_op(self, instr, flag):
@@ -833,7 +1034,7 @@ class Controller(object):
         self.abl_src = 'ff'
 
         # Next state
-        next_state = 'T6_brk_op'
+        next_state = T6_BRK_OP
         return next_state
 
     def _t6_brk_op(self, instr, flag):
@@ -854,7 +1055,7 @@ class Controller(object):
         self.abh_src = 'm'
 
         # Next state
-        next_state = 'T0_fetch_opcode'
+        next_state = T0_FETCH_OPCODE
         return next_state
 
     def _t2_plr_op(self, instr, flag):
@@ -876,12 +1077,12 @@ class Controller(object):
         self.abl_src = 'alu'
 
         # Next state
-        next_state = 'Tx_fetch_data'
+        next_state = TX_FETCH_DATA
         return next_state
 
     def _t2_phr_op(self, instr, flag):
         self.r_w = 'w'
-        self.db_src = 'a' if self._op_name == 'PHA' else 'p'
+        self.db_src = 'a' if self._op == _PHA else 'p'
 
         # Input Data latch
         self.dl_we = True
@@ -906,7 +1107,7 @@ class Controller(object):
         self.abh_src = 'pch'
 
         # Next state
-        next_state = 'T0_fetch_opcode'
+        next_state = T0_FETCH_OPCODE
         return next_state
 
     def _t2_rti_op(self, instr, flag):
@@ -928,7 +1129,7 @@ class Controller(object):
         self.abl_src = 'alu'
 
         # Next state
-        next_state = 'T3_rti_op'
+        next_state = T3_RTI_OP
         return next_state
 
     def _t3_rti_op(self, instr, flag):
@@ -953,7 +1154,7 @@ class Controller(object):
         self.abl_src = 'alu'
 
         # Next state
-        next_state = 'T4_rti_op'
+        next_state = T4_RTI_OP
         return next_state
 
     def _t4_rti_op(self, instr, flag):
@@ -982,7 +1183,7 @@ class Controller(object):
         self.abl_src = 'alu'
 
         # Next state
-        next_state = 'T5_rti_op'
+        next_state = T5_RTI_OP
         return next_state
 
     def _t5_rti_op(self, instr, flag):
@@ -1001,7 +1202,7 @@ class Controller(object):
         self.abh_src = 'm'
 
         # Next state
-        next_state = 'T0_fetch_opcode'
+        next_state = T0_FETCH_OPCODE
         return next_state
 
     def _t2_rts_op(self, instr, flag):
@@ -1023,7 +1224,7 @@ class Controller(object):
         self.abl_src = 'alu'
 
         # Next state
-        next_state = 'T3_rts_op'
+        next_state = T3_RTS_OP
         return next_state
 
     def _t3_rts_op(self, instr, flag):
@@ -1052,7 +1253,7 @@ class Controller(object):
         self.abl_src = 'alu'
 
         # Next state
-        next_state = 'T4_rts_op'
+        next_state = T4_RTS_OP
         return next_state
 
     def _t4_rts_op(self, instr, flag):
@@ -1071,7 +1272,7 @@ class Controller(object):
         self.abh_src = 'pch'
 
         # Next state
-        next_state = 'T5_rts_op'
+        next_state = T5_RTS_OP
         return next_state
 
     def _t5_rts_op(self, instr, flag):
@@ -1088,5 +1289,5 @@ class Controller(object):
         self.abl_src = 'pcl'
 
         # Next state
-        next_state = 'T0_fetch_opcode'
+        next_state = T0_FETCH_OPCODE
         return next_state
@@ -1,4 +1,4 @@
-from mc6502.alu import ALU
+from mc6502.alu import ALU, TableALU
 from mc6502.flag import Flag
 
 
@@ -17,6 +17,44 @@ class Register(object):
         return 'Register {}'.format(hex(self.data))
 
 
+# Inputs of the multiplexers, a selector is the index of this tuple
+MUX_INPUTS = (
+    'data', 'a', 'x', 'y', 's', 't', 'p', 'pcl', 'pch', 'dl',
+    'alu', 'palu', 'pset', 'pclr', 'padrl', 'padrh',
+    '00', '01', 'fe', 'ff',
+)
+
+
+def _selector(table):
+    return dict((src, MUX_INPUTS.index(mux_in))
+                for src, mux_in in table.items())
+
+
+# Controller signal to selector for each multiplexer, resolved by the
+# controller into its `SELECTORS`
+DB_SELECTOR = _selector({
+    'm': 'data', 'a': 'a', 'x': 'x', 'y': 'y', 't': 't', 'p': 'p',
+    'pcl': 'pcl', 'pch': 'pch',
+})
+PCL_SELECTOR = _selector({'m': 'dl', 't': 't', 'padr': 'padrl'})
+PCH_SELECTOR = _selector({'m': 'dl', 'padr': 'padrh'})
+ALU_A_SELECTOR = _selector({
+    'a': 'a', 'x': 'x', 'y': 'y', 's': 's', 't': 't', 'm': '00', '-': '00',
+})
+ALU_B_SELECTOR = _selector({'m': 'dl', 't': 't', '1': '00', '-': '00'})
+REG_SELECTOR = _selector({'m': 'dl', 'alu': 'alu'})
+P_SELECTOR = _selector({
+    'm': 'dl', 'set': 'pset', 'clr': 'pclr', 'alu': 'palu',
+})
+ABL_SELECTOR = _selector({
+    'm': 'dl', 's': 's', 't': 't', 'pcl': 'pcl', 'alu': 'alu',
+    'fe': 'fe', 'ff': 'ff',
+})
+ABH_SELECTOR = _selector({
+    'm': 'dl', 'pch': 'pch', 'alu': 'alu', '0': '00', '1': '01', 'ff': 'ff',
+})
+
+
 class PCAdder(object):
 
     def __init__(self):
@@ -44,7 +82,7 @@ class PCAdder(object):
 
 class Datapath(object):
 
-    def __init__(self):
+    def __init__(self, lut=False):
         # Address Bus
         self.abl = Register()
         self.abh = Register()
@@ -69,12 +107,27 @@ class Datapath(object):
         self.p = Register(0x00) # Processor Status Registe
 
         # ALU
-        self.alu = ALU()
-        self._alu_out = 0 # for debug
+        self.alu = TableALU() if lut else ALU()
+        self._alu_out = Register() # for debug
 
         # Adder for PC
         self.pcadder = PCAdder()
 
+        # Multiplexer inputs in the order of MUX_INPUTS
+        self._data = Register()
+        self._palu = Register()
+        self._pset = Register()
+        self._pclr = Register()
+        self._padrl = Register()
+        self._padrh = Register()
+        self._mux = [
+            self._data, self.a, self.x, self.y, self.s, self.t, self.p,
+            self.pcl, self.pch, self.dl,
+            self._alu_out, self._palu, self._pset, self._pclr,
+            self._padrl, self._padrh,
+            Register(0x00), Register(0x01), Register(0xfe), Register(0xff),
+        ]
+
     @property
     def ab(self):
         return (self.abh.data << 8) | self.abl.data
@@ -98,107 +151,63 @@ class Datapath(object):
             'S=0x{:02x}'.format(self.s.data),
             'P=0x{:02x}'.format(self.p.data),
             'T=0x{:02x}'.format(self.t.data),
-            'ALUOut=0x{:02x}'.format(self._alu_out),
+            'ALUOut=0x{:02x}'.format(self._alu_out.data),
         ]
         return ' '.join(fmt)
 
     def __call__(self, data, controller, dbe=True):
+        mux = self._mux
+
         # Data Bus
-        db_src = {
-            'm': data,
-            'a': self.a.data,
-            'x': self.x.data,
-            'y': self.y.data,
-            't': self.t.data,
-            'p': self.p.data,
-            'pcl': self.pcl.data,
-            'pch': self.pch.data,
-        }.get(controller.db_src, None)
+        self._data.data = data
         if dbe:
-            self.db(db_src)
-        self.dl(self.db.data, controller.dl_we)
+            self.db(mux[controller.db_sel].data)
+        if controller.dl_we:
+            self.dl.data = self.db.data
 
         # Instruction Register
-        self.ir(data, controller.ir_we)
+        if controller.ir_we:
+            self.ir(data)
 
         # Program Counter Increment/Add
-        pcl_add, pch_add = self.pcadder(
+        self._padrl.data, self._padrh.data = self.pcadder(
             self.pcl.data, self.pch.data, data, controller.pcadder_ctrl)
 
         # Program Counter
-        pcl_src = {
-            'm': self.dl.data,
-            't': self.t.data,
-            'padr': pcl_add,
-        }.get(controller.pcl_src, None)
-        self.pcl(pcl_src, controller.pcl_we)
-
-        pch_src = {
-            'm': self.dl.data,
-            'padr': pch_add,
-        }.get(controller.pch_src, None)
-        self.pch(pch_src, controller.pch_we)
+        if controller.pcl_we:
+            self.pcl(mux[controller.pcl_sel].data)
+        if controller.pch_we:
+            self.pch(mux[controller.pch_sel].data)
 
         # ALU
-        alu_src_a = {
-            'a': self.a.data,
-            'x': self.x.data,
-            'y': self.y.data,
-            's': self.s.data,
-            't': self.t.data,
-        }.get(controller.alu_src_a, 0x00)
-
-        alu_src_b = {
-            'm': self.dl.data,
-            't': self.t.data,
-        }.get(controller.alu_src_b, 0x00)
-
-        alu_out, flag_alu = self.alu(
-            alu_src_a, alu_src_b, Flag(self.p.data), controller.alu_ctrl)
-        self._alu_out = alu_out # for debug
+        self._alu_out.data, self._palu.data = self.alu.execute(
+            mux[controller.alu_sel_a].data,
+            mux[controller.alu_sel_b].data,
+            self.p.data, controller.alu_ctrl)
 
         # Registers
-        reg_src = {
-            'm': self.dl.data,
-            'alu': alu_out,
-        }.get(controller.reg_src, None)
-        self.a(reg_src, controller.a_we) # Accumulator
-        self.x(reg_src, controller.x_we) # Index X Register
-        self.y(reg_src, controller.y_we) # Index Y Register
-        self.s(reg_src, controller.s_we) # Stack Point Register
-        self.t(reg_src, controller.t_we) # Temporary Register
+        reg_src = mux[controller.reg_sel].data
+        if controller.a_we:
+            self.a(reg_src) # Accumulator
+        if controller.x_we:
+            self.x(reg_src) # Index X Register
+        if controller.y_we:
+            self.y(reg_src) # Index Y Register
+        if controller.s_we:
+            self.s(reg_src) # Stack Point Register
+        if controller.t_we:
+            self.t(reg_src) # Temporary Register
 
         # Processor Status Register
-        p_src = {
-            'm': self.dl.data,
-            'set': self.p.data | controller.p_mask,
-            'clr': self.p.data & ~controller.p_mask,
-            'alu': flag_alu.data,
-        }.get(controller.p_src, self.p.data)
-        self.p(p_src, True)
+        self._pset.data = self.p.data | controller.p_mask
+        self._pclr.data = self.p.data & ~controller.p_mask
+        self.p(mux[controller.p_sel].data)
 
         # Address Bus
         str_ab = self.ab
-
-        abl_src = {
-            'm': self.dl.data,
-            's': self.s.data,
-            't': self.t.data,
-            'pcl': self.pcl.data,
-            'alu': alu_out,
-            'fe': 0xfe,
-            'ff': 0xff,
-        }.get(controller.abl_src, None)
-        self.abl(abl_src, controller.abl_we)
-
-        abh_src = {
-            'm': self.dl.data,
-            'pch': self.pch.data,
-            'alu': alu_out,
-            '0': 0x00,
-            '1': 0x01,
-            'ff': 0xff,
-        }.get(controller.abh_src, None)
-        self.abh(abh_src, controller.abh_we)
+        if controller.abl_we:
+            self.abl(mux[controller.abl_sel].data)
+        if controller.abh_we:
+            self.abh(mux[controller.abh_sel].data)
 
         return self.db.data, str_ab if controller.r_w == 'w' else self.ab
@@ -0,0 +1,417 @@
+from mc6502.controller import execute_control, OPCODES, OP_NAMES, \
+    ADDR_MODES, WRITE_STATES, T1_FETCH_OPERAND
+from mc6502.fusion import fused_handler
+from mc6502.icache import InstructionCache
+from mc6502.mpu import IdleLoop, MPU, skippable, stalled
+
+# The longest instruction (BRK) takes 7 cycles
+MAX_CYCLES = 7
+
+# Upper limit of instructions in a fused sequence
+MAX_FUSION = 4
+
+# Opcode sequences fused by default, found in copy and clear loops
+FUSED = (
+    (0xa9, 0x85),           # LDA #imm, STA zpg
+    (0xca, 0xd0),           # DEX, BNE
+    (0xc8, 0xc0, 0xd0),     # INY, CPY #imm, BNE
+    (0x18, 0x69),           # CLC, ADC #imm
+    (0xb1, 0x9d),           # LDA (zp),Y, STA abs,X
+)
+
+
+class FastMPU(MPU):
+    """Instruction level MPU
+
+    FastMPU shares the controller and the datapath with the cycle accurate
+    MPU, so both `__call__` (one cycle) and `step` (one instruction) can be
+    used on the same object. `step` runs the whole instruction functionally
+    and leaves the MPU at the instruction boundary (T1_fetch_operand) with
+    the same registers and memory as the cycle accurate MPU.
+
+    The operands are taken from an `InstructionCache` decoded by PC, so
+    `flush` it after writes bypassing `Memory.__call__`.
+
+    `run` executes the opcode sequences given to `fuse` by handlers
+    generated for them, keeping the registers in local variables between
+    the instructions.
+    Devices still see `cycles` of the beginning of each instruction, and
+    no sequence is fused while `until`, `stall` or the idle loop skipping
+    look at the instruction boundaries.
+    """
+
+    def __init__(self, precompiled=False, lut=False, idle=False):
+        super(FastMPU, self).__init__(precompiled=precompiled, lut=lut,
+                                      idle=idle)
+        self._alu = self.datapath.alu
+        self._operands = ()
+
+        mode_table = {
+            'acc': self._acc, 'imm': self._imm, 'impl': self._impl,
+            'zpg': self._zpg, 'zpgx': self._zpgi, 'zpgy': self._zpgi,
+            'abs': self._abs, 'absx': self._absi, 'absy': self._absi,
+            'ind': self._ind, 'indx': self._indx, 'indy': self._indy,
+            'rel': self._rel,
+        }
+        # Indexed by opcode, None for the illegal ones
+        self._table = []
+        for decoded in OPCODES:
+            op_name, addr_mode = OP_NAMES[decoded[0]], ADDR_MODES[decoded[1]]
+            self._table.append(None if op_name is None else (
+                op_name, addr_mode, mode_table[addr_mode],
+                decoded[5], decoded[6]))
+        self.icache = InstructionCache(self._table)
+        self.fuse(FUSED)
+
+    def fuse(self, sequences):
+        """Run each opcode sequence of `sequences` as one handler from now
+        on, replacing the former ones"""
+        # Trie of the next opcodes
+        trie = {}
+        for sequence in sequences:
+            assert 2 <= len(sequence) <= MAX_FUSION and \
+                all(self._table[opcode] is not None for opcode in sequence), \
+                'can not fuse {}'.format(sequence)
+            node = trie
+            for opcode in sequence:
+                node = node.setdefault(opcode, {})
+        self._fusion = dict(
+            (opcode, fused_handler(self._table, opcode, children))
+            for opcode, children in trie.items())
+
+    def step(self, memory):
+        """Execute one instruction and return the number of cycles"""
+        return self._step(memory, 1)[0]
+
+    def _step(self, memory, limit):
+        """Execute one instruction, or up to `limit` instructions of a fused
+        sequence, and return tuple (cycles, instructions)"""
+        # Run the cycle accurate MPU up to the instruction boundary
+        cycles = 0
+        while self.controller._state != T1_FETCH_OPERAND:
+            data = 0x00 if self.controller._state in WRITE_STATES else \
+                memory(self.address)
+            data, addr = self(data)
+            if self.r_w == 'w':
+                memory(addr, data, True)
+            cycles += 1
+
+        self._load()
+        opcode = self._ir
+        icache = self.icache
+        if memory is not icache.memory:
+            icache.attach(memory)
+        entry = icache.entries.get(self._pc)
+        if entry is None or entry[0] != opcode:
+            if self._table[opcode] is None:
+                raise KeyError(opcode)
+            entry = icache(self._pc, opcode)
+        fused = self._fusion.get(opcode) if limit > 1 else None
+        if fused is not None:
+            cycles, ninstrs, opcode = fused(self, memory, entry, limit, cycles)
+            self._store(opcode)
+            return cycles, ninstrs
+
+        _, self._operands, _, _, handler = entry
+        op_name, addr_mode, mode, execute, flag_op = handler
+        cycles += mode(memory, op_name, addr_mode)
+        self._execute(execute, flag_op)
+        self._fetch(memory)
+        self.cycles += cycles
+        self._store(opcode)
+        return cycles, 1
+
+    def run(self, memory, cycles=None, until=None, instructions=None):
+        """Run the MPU on memory and return tuple (cycles, instructions)
+
+        Same as `MPU.run`, but whole instructions are executed by `step`
+        while the cycle budget allows; the rest runs cycle by cycle. Devices
+        see `cycles` of the beginning of the instruction in `step`, and RDY
+        is sampled at the instruction boundaries. Idle loops are skipped
+        only if `skippable(until)`.
+        """
+        controller = self.controller
+        idle = IdleLoop(self, memory) if self._idle and skippable(until) \
+            else None
+        stall = self.stall
+        fuse = until is None and stall is None and idle is None
+        ncycles = ninstrs = 0
+        while instructions is None or ninstrs < instructions:
+            if stall is not None and controller._state == T1_FETCH_OPERAND:
+                halted = stalled(stall, ncycles, cycles)
+                if halted:
+                    ncycles += halted
+                    self.cycles += halted
+                    continue
+            remain = None if cycles is None else cycles - ncycles
+            if controller._state != T1_FETCH_OPERAND or \
+               (remain is not None and remain < MAX_CYCLES):
+                c, n = super(FastMPU, self).run(
+                    memory, remain, instructions=1)
+                ncycles += c
+                ninstrs += n
+                if not n:
+                    break
+            else:
+                limit = 1
+                if fuse:
+                    limit = MAX_FUSION
+                    if remain is not None:
+                        limit = min(limit, remain // MAX_CYCLES)
+                    if instructions is not None:
+                        limit = min(limit, instructions - ninstrs)
+                c, n = self._step(memory, limit)
+                ncycles += c
+                ninstrs += n
+            if idle is not None:
+                skip = idle(ncycles, ninstrs, cycles, instructions)
+                ncycles += skip[0]
+                ninstrs += skip[1]
+                self.cycles += skip[0]
+            if until is not None and until(self):
+                break
+        return ncycles, ninstrs
+
+    def restore(self, blob, memory=None):
+        """Restore the MPU state and the memory, dropping the decoded
+        instructions"""
+        super(FastMPU, self).restore(blob, memory)
+        self.flush()
+
+    def flush(self):
+        """Drop all decoded instructions"""
+        self.icache.flush()
+
+    def _load(self):
+        dp = self.datapath
+        self._a = dp.a.data
+        self._x = dp.x.data
+        self._y = dp.y.data
+        self._s = dp.s.data
+        self._p = dp.p.data
+        self._t = dp.t.data
+        self._ir = dp.ir.data
+        self._pc = dp.pc
+        self._ab = None
+
+    def _store(self, opcode):
+        dp = self.datapath
+        dp.a(self._a)
+        dp.x(self._x)
+        dp.y(self._y)
+        dp.s(self._s)
+        dp.p(self._p)
+        dp.t(self._t)
+        dp.ir(self._ir)
+        dp.pcl(self._pc & 0xff)
+        dp.pch(self._pc >> 8)
+        dp.abl(self._pc & 0xff)
+        dp.abh(self._pc >> 8)
+
+        self.controller._decode(opcode)
+
+    def _fetch(self, memory):
+        """T0: fetch next opcode"""
+        self._ir = memory(self._pc if self._ab is None else self._ab)
+        self._pc = (self._pc + 1) & 0xffff
+
+    def _execute(self, execute, flag_op):
+        """T0: execute the instruction with the fetched data"""
+        src, dst, ctrl = execute
+        a = {
+            'a': self._a, 'x': self._x, 'y': self._y,
+            's': self._s, 't': self._t,
+        }.get(src, 0x00)
+        ret, p = self._alu.execute(a, self._t, self._p, ctrl)
+
+        if dst == 'a':
+            self._a = ret
+        elif dst == 'x':
+            self._x = ret
+        elif dst == 'y':
+            self._y = ret
+        elif dst == 's':
+            self._s = ret
+
+        if dst == 'p':
+            self._p = self._t
+        elif flag_op[1] == 'set':
+            self._p = self._p | flag_op[0]
+        elif flag_op[1] == 'clr':
+            self._p = self._p & ~flag_op[0]
+        else:
+            self._p = p
+
+    def _alu_op(self, a, b, ctrl):
+        """ALU operation updating Processor Status Register"""
+        ret, self._p = self._alu.execute(a, b, self._p, ctrl)
+        return ret
+
+    def _operand(self, memory):
+        """T1: fetch operand and increment PC"""
+        self._t = self._operands[0]
+        self._pc = (self._pc + 1) & 0xffff
+        return self._t
+
+    def _access(self, memory, op_name, addr):
+        """Tx: fetch, modify and write data at the effective address"""
+        if op_name in ['STA', 'STX', 'STY']:
+            data = {'STA': self._a, 'STX': self._x, 'STY': self._y}[op_name]
+            memory(addr, data, True)
+            return 1
+        self._t = memory(addr)
+        if op_name not in ['ASL', 'DEC', 'INC', 'LSR', 'ROL', 'ROR']:
+            return 1
+        src, dst, ctrl = execute_control(op_name, None)
+        assert src == 't' and dst == 't'
+        memory(addr, self._t, True)
+        self._t = self._alu_op(self._t, self._t, ctrl)
+        memory(addr, self._t, True)
+        return 3
+
+    def _index_carry(self, memory, op_name, bah, adl):
+        """Tx_fetch_data_c0: add carry to the base address high"""
+        carry = self._p & 0x01
+        adh = self._alu_op(bah, 0x00, 'adc')
+        if carry or op_name in ['ASL', 'DEC', 'INC', 'LSR', 'ROL', 'ROR']:
+            addr = (adh << 8) | adl
+            if op_name in ['STA', 'STX', 'STY']:
+                # Stores are not written after the page crossing
+                self._t = memory(addr)
+                return 2
+            return 1 + self._access(memory, op_name, addr)
+        addr = (bah << 8) | adl
+        if op_name in ['STA', 'STX', 'STY']:
+            return 1 + self._access(memory, op_name, addr)
+        self._t = memory(addr)
+        return 1
+
+    def _acc(self, memory, op_name, addr_mode):
+        self._operand(memory)
+        return 2
+
+    def _imm(self, memory, op_name, addr_mode):
+        self._operand(memory)
+        return 2
+
+    def _impl(self, memory, op_name, addr_mode):
+        self._t = memory(self._pc)
+        stack = 0x0100 | self._s
+        if op_name in ['PHA', 'PHP']:
+            memory(stack, self._a if op_name == 'PHA' else self._p, True)
+            self._s = (self._s - 1) & 0xff
+            return 3
+        elif op_name in ['PLA', 'PLP']:
+            self._s = (self._s + 1) & 0xff
+            self._t = memory(0x0100 | self._s)
+            return 4
+        elif op_name == 'BRK':
+            memory(stack, self._pc >> 8, True)
+            self._s = self._alu_op(self._s, 0x00, 'dec')
+            memory(0x0100 | self._s, self._pc & 0xff, True)
+            self._s = self._alu_op(self._s, 0x00, 'dec')
+            memory(0x0100 | self._s, self._p, True)
+            self._s = self._alu_op(self._s, 0x00, 'dec')
+            self._t = memory(0xfffe)
+            self._pc = (memory(0xffff) << 8) | self._t
+            return 7
+        elif op_name == 'RTI':
+            self._s = (self._s + 1) & 0xff
+            self._p = memory(0x0100 | self._s)
+            self._s = (self._s + 1) & 0xff
+            pcl = memory(0x0100 | self._s)
+            self._s = (self._s + 1) & 0xff
+            self._pc = (memory(0x0100 | self._s) << 8) | pcl
+            return 6
+        elif op_name == 'RTS':
+            self._s = (self._s + 1) & 0xff
+            pcl = memory(0x0100 | self._s)
+            self._s = (self._s + 1) & 0xff
+            pch = memory(0x0100 | self._s)
+            self._pc = (((pch << 8) | pcl) + 1) & 0xffff
+            # Address bus high is not updated by the increment
+            self._ab = (pch << 8) | (self._pc & 0xff)
+            return 6
+        return 2
+
+    def _zpg(self, memory, op_name, addr_mode):
+        adl = self._operand(memory)
+        return 2 + self._access(memory, op_name, adl)
+
+    def _zpgi(self, memory, op_name, addr_mode):
+        bal = self._operand(memory)
+        index = self._y if addr_mode == 'zpgy' else self._x
+        adl = self._alu_op(index, bal, 'adc')
+        return 3 + self._access(memory, op_name, adl)
+
+    def _abs(self, memory, op_name, addr_mode):
+        adl = self._operand(memory)
+        if op_name == 'JSR':
+            memory(0x0100 | self._s, self._pc >> 8, True)
+            self._s = (self._s - 1) & 0xff
+            memory(0x0100 | self._s, self._pc & 0xff, True)
+            self._s = (self._s - 1) & 0xff
+            # ADH is read after the pushes which may overwrite it
+            self._pc = (memory(self._pc) << 8) | adl
+            return 6
+        adh = self._operands[1]
+        self._pc = (self._pc + 1) & 0xffff
+        if op_name == 'JMP':
+            self._pc = (adh << 8) | adl
+            return 3
+        return 3 + self._access(memory, op_name, (adh << 8) | adl)
+
+    def _absi(self, memory, op_name, addr_mode):
+        bal = self._operand(memory)
+        bah = self._operands[1]
+        self._pc = (self._pc + 1) & 0xffff
+        index = self._y if addr_mode == 'absy' else self._x
+        adl = self._alu_op(index, bal, 'adc')
+        return 3 + self._index_carry(memory, op_name, bah, adl)
+
+    def _ind(self, memory, op_name, addr_mode):
+        ial = self._operand(memory)
+        iah = self._operands[1]
+        self._pc = (self._pc + 1) & 0xffff
+        adl = memory((iah << 8) | ial)
+        ial = self._alu_op(ial, 0x00, 'inc')
+        adh = memory((iah << 8) | ial)
+        self._t = adl
+        self._pc = (adh << 8) | adl
+        return 5
+
+    def _indx(self, memory, op_name, addr_mode):
+        bal = self._operand(memory)
+        zpa = self._alu_op(self._x, bal, 'adc')
+        adl = memory(zpa)
+        zpa = self._alu_op(zpa, 0x00, 'inc')
+        adh = memory(zpa)
+        return 5 + self._access(memory, op_name, (adh << 8) | adl)
+
+    def _indy(self, memory, op_name, addr_mode):
+        ial = self._operand(memory)
+        bal = memory(ial)
+        ial = self._alu_op(ial, 0x00, 'inc')
+        bah = memory(ial)
+        adl = self._alu_op(self._y, bal, 'adc')
+        return 4 + self._index_carry(memory, op_name, bah, adl)
+
+    def _rel(self, memory, op_name, addr_mode):
+        p = self._p
+        is_branch = {
+            'BCC': not (p & 0x01), 'BCS': p & 0x01,
+            'BNE': not (p & 0x02), 'BEQ': p & 0x02,
+            'BVC': not (p & 0x40), 'BVS': p & 0x40,
+            'BPL': not (p & 0x80), 'BMI': p & 0x80,
+        }.get(op_name, False)
+        offset = self._operands[0]
+        self._t = offset
+        if not is_branch:
+            self._pc = (self._pc + 1) & 0xffff
+            return 2
+        # Relative address is added to PCL and carried to PCH in next cycle
+        dst = (self._pc & 0xff) + 1 + offset
+        pch = (self._pc >> 8) + (dst >> 8)
+        assert pch <= 0xff, 'out of range byte data %s' % hex(pch)
+        self._pc = (pch << 8) | (dst & 0xff)
+        return 3 + (dst >> 8)
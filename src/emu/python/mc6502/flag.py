@@ -1,24 +1,32 @@
-from collections import OrderedDict
+# Bit position of each flag in the Processor Status Register
+# PCC is not a part of the register but the carry of PC adder
+BIT = {'C': 0, 'Z': 1, 'I': 2, 'D': 3, 'B': 4, '-': 5, 'V': 6, 'N': 7,
+       'PCC': 8}
+
+C = 0x01
+Z = 0x02
+I = 0x04
+D = 0x08
+B = 0x10
+V = 0x40
+N = 0x80
+PCC = 0x100
 
 
 class Flag(object):
 
     def __init__(self, data):
-        self.flag = OrderedDict()
-        for i, k in enumerate(['C', 'Z', 'I', 'D', 'B', '-', 'V', 'N']):
-            self.flag[k] = (data >> i) & 0x01
+        self.data = data
 
     def __getitem__(self, key):
-        return self.flag[key]
+        return (self.data >> BIT[key]) & 0x01
 
     def __setitem__(self, key, value):
-        self.flag[key] = value != 0
+        if value != 0:
+            self.data |= 1 << BIT[key]
+        else:
+            self.data &= ~(1 << BIT[key])
 
     def __str__(self):
-        return ' '.join(['{}={:d}'.format(k, v)
-                         for k, v in reversed(self.flag.items())])
-
-    @property
-    def data(self):
-        ret = [(v & 0x01) << i for i, v in enumerate(self.flag.values())]
-        return reduce(lambda x, y: x | y, ret)
+        return ' '.join(['{}={:d}'.format(k, self[k])
+                         for k in ['N', 'V', '-', 'B', 'D', 'I', 'Z', 'C']])
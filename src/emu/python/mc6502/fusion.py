@@ -0,0 +1,232 @@
+from mc6502.controller import execute_control
+
+STR_OPS = ('STA', 'STX', 'STY')
+RMW_OPS = ('ASL', 'DEC', 'INC', 'LSR', 'ROL', 'ROR')
+BRANCHES = {
+    # op     mask  taken if set
+    'BCC': (0x01, False), 'BCS': (0x01, True),
+    'BNE': (0x02, False), 'BEQ': (0x02, True),
+    'BVC': (0x40, False), 'BVS': (0x40, True),
+    'BPL': (0x80, False), 'BMI': (0x80, True),
+}
+
+# Instructions a fused handler leaves to the handlers of FastMPU
+GENERIC_OPS = ('BRK', 'JSR', 'PHA', 'PHP', 'PLA', 'PLP', 'RTI', 'RTS')
+
+
+class _Source(object):
+    """Python source of a fused handler"""
+
+    def __init__(self):
+        self.lines = []
+
+    def emit(self, line, indent):
+        self.lines.append('    ' * indent + line)
+
+
+def _inlined(op_name, addr_mode):
+    """Return True if the instruction is written out in the handler"""
+    if op_name in GENERIC_OPS or addr_mode == 'ind':
+        return False
+    return not (op_name in RMW_OPS and addr_mode != 'acc' and
+                execute_control(op_name, None)[:2] != ('t', 't'))
+
+
+def _access(src, op_name, indent):
+    """Tx: fetch, modify and write data at `w`, return the cycles"""
+    if op_name in STR_OPS:
+        src.emit('memory(w, {}, True)'.format(op_name[-1].lower()), indent)
+        return 1
+    src.emit('t = memory(w)', indent)
+    if op_name not in RMW_OPS:
+        return 1
+    ctrl = execute_control(op_name, None)[2]
+    src.emit('memory(w, t, True)', indent)
+    src.emit('t, p = alu(t, t, p, {!r})'.format(ctrl), indent)
+    src.emit('memory(w, t, True)', indent)
+    return 3
+
+
+def _index_carry(src, op_name, indent):
+    """Tx_fetch_data_c0: add carry to the base address high `bah`"""
+    src.emit('carry = p & 0x01', indent)
+    src.emit('adh, p = alu(bah, 0x00, p, {!r})'.format('adc'), indent)
+    inner = indent
+    if op_name not in RMW_OPS:
+        src.emit('if carry:', indent)
+        inner += 1
+    src.emit('w = (adh << 8) | adl', inner)
+    if op_name in STR_OPS:
+        # Stores are not written after the page crossing
+        src.emit('t = memory(w)', inner)
+        src.emit('k += 2', inner)
+    else:
+        src.emit('k += {}'.format(1 + _access(src, op_name, inner)), inner)
+    if op_name in RMW_OPS:
+        return
+    src.emit('else:', indent)
+    src.emit('w = (bah << 8) | adl', inner)
+    if op_name in STR_OPS:
+        src.emit('k += {}'.format(1 + _access(src, op_name, inner)), inner)
+    else:
+        src.emit('t = memory(w)', inner)
+        src.emit('k += 1', inner)
+
+
+def _generic(src, indent):
+    """Run the instruction of `entry` by the handlers of FastMPU"""
+    src.emit('mpu._a, mpu._x, mpu._y, mpu._s, mpu._p, mpu._t, mpu._pc = '
+             'a, x, y, s, p, t, pc', indent)
+    src.emit('mpu._operands, mpu._ab = entry[1], None', indent)
+    src.emit('op_name, addr_mode, mode, execute, flag_op = entry[4]', indent)
+    src.emit('k += mode(memory, op_name, addr_mode)', indent)
+    src.emit('mpu._execute(execute, flag_op)', indent)
+    src.emit('mpu._fetch(memory)', indent)
+    src.emit('a, x, y, s, p, t = '
+             'mpu._a, mpu._x, mpu._y, mpu._s, mpu._p, mpu._t', indent)
+    src.emit('ir, pc = mpu._ir, mpu._pc', indent)
+
+
+def _execute(src, execute, flag_op, indent):
+    """T0: execute the instruction with the fetched data"""
+    a, dst, ctrl = execute
+    a = a if a in ['a', 'x', 'y', 's', 't'] else '0x00'
+    if ctrl == 'tha':
+        src.emit('r, q = {}, p'.format(a), indent)
+    else:
+        src.emit('r, q = alu({}, t, p, {!r})'.format(a, ctrl), indent)
+    if dst in ['a', 'x', 'y', 's']:
+        src.emit('{} = r'.format(dst), indent)
+    if dst == 'p':
+        src.emit('p = t', indent)
+    elif flag_op[1] == 'set':
+        src.emit('p |= {}'.format(flag_op[0]), indent)
+    elif flag_op[1] == 'clr':
+        src.emit('p &= ~{}'.format(flag_op[0]), indent)
+    else:
+        src.emit('p = q', indent)
+
+
+def _instruction(src, op_name, addr_mode, execute, flag_op, indent):
+    """Emit the instruction of `entry` up to the fetch of the next opcode
+    at T0, adding its cycles to `k`"""
+    if not _inlined(op_name, addr_mode):
+        _generic(src, indent)
+        return
+    index = 'y' if addr_mode in ['zpgy', 'absy'] else 'x'
+    src.emit('t = entry[1][0]' if addr_mode != 'impl' else 't = memory(pc)',
+             indent)
+    if addr_mode in ['acc', 'imm', 'zpg', 'zpgx', 'zpgy', 'indx', 'indy']:
+        src.emit('pc = (pc + 1) & 0xffff', indent)
+    elif addr_mode in ['abs', 'absx', 'absy']:
+        src.emit('pc = (pc + 2) & 0xffff', indent)
+
+    if addr_mode in ['acc', 'imm', 'impl']:
+        cycles = 2
+    elif addr_mode == 'zpg':
+        src.emit('w = t', indent)
+        cycles = 2 + _access(src, op_name, indent)
+    elif addr_mode in ['zpgx', 'zpgy']:
+        src.emit('w, p = alu({}, t, p, {!r})'.format(index, 'adc'), indent)
+        cycles = 3 + _access(src, op_name, indent)
+    elif addr_mode == 'abs' and op_name == 'JMP':
+        src.emit('pc = entry[2]', indent)
+        cycles = 3
+    elif addr_mode == 'abs':
+        src.emit('w = entry[2]', indent)
+        cycles = 3 + _access(src, op_name, indent)
+    elif addr_mode in ['absx', 'absy']:
+        src.emit('adl, p = alu({}, t, p, {!r})'.format(index, 'adc'), indent)
+        src.emit('bah = entry[1][1]', indent)
+        _index_carry(src, op_name, indent)
+        cycles = 3
+    elif addr_mode == 'indx':
+        src.emit('zpa, p = alu(x, t, p, {!r})'.format('adc'), indent)
+        src.emit('adl = memory(zpa)', indent)
+        src.emit('zpa, p = alu(zpa, 0x00, p, {!r})'.format('inc'), indent)
+        src.emit('w = (memory(zpa) << 8) | adl', indent)
+        cycles = 5 + _access(src, op_name, indent)
+    elif addr_mode == 'indy':
+        src.emit('bal = memory(t)', indent)
+        src.emit('ial, p = alu(t, 0x00, p, {!r})'.format('inc'), indent)
+        src.emit('bah = memory(ial)', indent)
+        src.emit('adl, p = alu(y, bal, p, {!r})'.format('adc'), indent)
+        _index_carry(src, op_name, indent)
+        cycles = 4
+    elif addr_mode == 'rel' and op_name in BRANCHES:
+        mask, is_set = BRANCHES[op_name]
+        src.emit('if p & {} {} 0:'.format(mask, '!=' if is_set else '=='),
+                 indent)
+        # Relative address is added to PCL and carried to PCH
+        src.emit('dst = (pc & 0xff) + 1 + t', indent + 1)
+        src.emit('pch = (pc >> 8) + (dst >> 8)', indent + 1)
+        src.emit("assert pch <= 0xff, "
+                 "'out of range byte data %s' % hex(pch)", indent + 1)
+        src.emit('pc = (pch << 8) | (dst & 0xff)', indent + 1)
+        src.emit('k += 3 + (dst >> 8)', indent + 1)
+        src.emit('else:', indent)
+        src.emit('pc = (pc + 1) & 0xffff', indent + 1)
+        src.emit('k += 2', indent + 1)
+        cycles = 0
+    else:
+        src.emit('pc = (pc + 1) & 0xffff', indent)
+        cycles = 2
+    if cycles:
+        src.emit('k += {}'.format(cycles), indent)
+    _execute(src, execute, flag_op, indent)
+    src.emit('ir = memory(pc)', indent)
+    src.emit('pc = (pc + 1) & 0xffff', indent)
+
+
+def _node(src, table, opcode, children, indent):
+    op_name, addr_mode, _, execute, flag_op = table[opcode]
+    src.emit('# 0x{:02x} {} {}'.format(opcode, op_name, addr_mode), indent)
+    _instruction(src, op_name, addr_mode, execute, flag_op, indent)
+    src.emit('c += k', indent)
+    src.emit('mpu.cycles += k', indent)
+    src.emit('n += 1', indent)
+    src.emit('opcode = {}'.format(opcode), indent)
+    if not children:
+        return
+    src.emit('if n < limit:', indent)
+    for i, (following, grandchildren) in enumerate(sorted(children.items())):
+        src.emit('{} ir == {}:'.format('elif' if i else 'if', following),
+                 indent + 1)
+        src.emit('entry = entries.get(pc)', indent + 2)
+        src.emit('if entry is None or entry[0] != ir:', indent + 2)
+        src.emit('entry = icache(pc, ir)', indent + 3)
+        src.emit('k = 0', indent + 2)
+        _node(src, table, following, grandchildren, indent + 2)
+
+
+def fused_handler(table, opcode, children):
+    """Return the handler of the opcode sequences from `opcode` in the trie
+    `children` of the next opcodes
+
+    The handler `fused(mpu, memory, entry, limit, k)` runs from the
+    instruction cache entry of `opcode` at the instruction boundary with
+    `k` cycles already run, up to `limit` instructions while the fetched
+    opcodes follow the trie, and returns tuple (cycles, instructions, last
+    opcode). The registers are kept in local variables throughout, and
+    stack, JSR and indirect JMP instructions call the handlers of FastMPU.
+    """
+    src = _Source()
+    _node(src, table, opcode, children, 1)
+    lines = [
+        'def fused(mpu, memory, entry, limit, k):',
+        '    icache = mpu.icache',
+        '    entries = icache.entries',
+        '    alu = mpu._alu.execute',
+        '    a, x, y, s, p, t, pc = '
+        'mpu._a, mpu._x, mpu._y, mpu._s, mpu._p, mpu._t, mpu._pc',
+        '    c = n = 0',
+    ] + src.lines + [
+        '    mpu._a, mpu._x, mpu._y, mpu._s, mpu._p, mpu._t = '
+        'a, x, y, s, p, t',
+        '    mpu._ir, mpu._pc = ir, pc',
+        '    return c, n, opcode',
+    ]
+    namespace = {}
+    exec(compile('\n'.join(lines) + '\n', '<fused 0x{:02x}>'.format(opcode),
+                 'exec'), namespace)
+    return namespace['fused']
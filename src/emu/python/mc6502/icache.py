@@ -0,0 +1,89 @@
+from mc6502.decoder import InstructionDecoder
+
+# Number of bytes fetched by T1 and the following cycles
+OPERANDS = {
+    'acc': 1, 'imm': 1, 'impl': 0, 'zpg': 1, 'zpgx': 1, 'zpgy': 1,
+    'abs': 2, 'absx': 2, 'absy': 2, 'ind': 2, 'indx': 1, 'indy': 1,
+    'rel': 1,
+}
+
+
+def _decoded():
+    decoder = InstructionDecoder()
+    ret = []
+    for opcode in range(0x100):
+        _, addr_mode, cycles = decoder(opcode)
+        ret.append((OPERANDS.get(addr_mode, 0), cycles))
+    return tuple(ret)
+
+# Operand bytes and base number of cycles by opcode
+DECODED = _decoded()
+
+
+class InstructionCache(object):
+    """Instructions decoded by PC at the instruction boundary (T1), i.e.
+    the address of the first operand byte
+
+    An entry is tuple (opcode, operand bytes, operand, cycles, handler):
+    `operand` is the operand bytes as a little endian word (the base or
+    effective address of the addressing mode), `cycles` is the base number
+    of cycles of the decoder and `handler` is `table[opcode]` of the engine.
+    An entry is taken only for the same opcode, so an opcode fetched from
+    elsewhere (e.g. after RTS) is decoded again.
+
+    The operand bytes are watched in the memory and a write into them drops
+    the entry, so code in ROM or never rewritten is decoded once. Operands
+    in a device page are decoded at every call and never kept. Writes
+    bypassing `Memory.__call__` are not seen, so `flush` after them.
+    """
+
+    def __init__(self, table=None):
+        self.table = table
+        self.entries = {}
+        self.memory = None
+        self._watched = {}
+
+    def attach(self, memory):
+        """Drop all entries and decode from `memory` from now on"""
+        self.flush()
+        self.memory = memory
+
+    def flush(self):
+        """Drop all entries"""
+        if self.memory is not None:
+            self.memory.unwatch(callback=self._invalidate)
+        self.entries = {}
+        self._watched = {}
+
+    def __call__(self, pc, opcode):
+        """Return the entry of `opcode` with the operands at `pc`"""
+        entry = self.entries.get(pc)
+        if entry is None or entry[0] != opcode:
+            entry = self._decode(pc, opcode)
+        return entry
+
+    def _decode(self, pc, opcode):
+        memory = self.memory
+        length, cycles = DECODED[opcode]
+        addresses = [(pc + i) & 0xffff for i in range(length)]
+        operands = tuple(memory(address) for address in addresses)
+        operand = None
+        if operands:
+            operand = operands[0] | (operands[1] << 8 if length == 2 else 0)
+        handler = None if self.table is None else self.table[opcode]
+        entry = (opcode, operands, operand, cycles, handler)
+
+        backing = [memory.backing(address) for address in addresses]
+        if None in backing:
+            return entry
+        for address in backing:
+            memory.watch(address, address + 1, self._invalidate)
+            self._watched.setdefault(address, set()).add(pc)
+        self.entries[pc] = entry
+        return entry
+
+    def _invalidate(self, address):
+        """Drop the entries decoded from the written address"""
+        for pc in self._watched.pop(address, ()):
+            self.entries.pop(pc, None)
+        self.memory.unwatch(address, address + 1, self._invalidate)
@@ -1,25 +1,169 @@
+import mmap
+import weakref
+
+
+def _key(callback):
+    """Return the watch key of `callback`, by the identity of the object of
+    a method"""
+    obj = getattr(callback, '__self__', None)
+    if obj is None:
+        return callback
+    return id(obj), getattr(callback, '__func__', callback.__name__)
+
+
 class Memory(object):
+    """Byte addressable memory backed by a bytearray
+
+    `filename` is a hex text image ('#' rows are comments) and `binfile` is
+    a raw binary image; both are loaded from address 0x0000.
+    """
 
-    def __init__(self, data=None, filename=None, size=0xffff):
-        self._data = [0 for _ in range(size + 1)]
+    # Reads return what was written last, see `IdleLoop`
+    volatile = False
+
+    def __init__(self, data=None, filename=None, size=0xffff, binfile=None):
+        self._size = size
+        self._data = bytearray(size + 1)
+        self._watch = None
+        self._watcher = None
+        # Watch key -> [target, watched addresses], address -> watch keys
+        self._watchers = {}
+        self._watched = {}
         if data:
-            for i, d in enumerate(data):
-                self._data[i] = d
+            self._data[:len(data)] = bytearray(data)
         if filename:
-            with open(filename, 'r') as f:
-                pc = 0
-                for row in f:
-                    if row[0] == '#':
-                        continue
-                    row = row.replace('\n', '').split(' ')
-                    for byte in row:
-                        assert pc < size
-                        self._data[pc] = int(byte, 16)
-                        pc += 1
+            self.load_hex(filename)
+        if binfile:
+            self.load_bin(binfile)
 
     def __call__(self, address, data=None, we=False):
-        if data and we:
+        if we and data is not None:
             assert 0x00 <= data < 0x100, \
                 'data: 0x{:x} address: 0x{:x}'.format(data, address)
             self._data[address] = data
+            if self._watch is not None and self._watch[address]:
+                self._watcher(address)
         return self._data[address]
+
+    def __len__(self):
+        return len(self._data)
+
+    def load_hex(self, filename, address=0x0000):
+        """Load hex text image and return the number of loaded bytes"""
+        pc = address
+        with open(filename, 'r') as f:
+            for row in f:
+                if row[0] == '#':
+                    continue
+                data = bytearray.fromhex(row.strip())
+                assert pc + len(data) <= self._size, \
+                    'out of range address 0x{:x}'.format(pc + len(data))
+                self._data[pc:pc + len(data)] = data
+                pc += len(data)
+        return pc - address
+
+    def load_bin(self, filename, address=0x0000):
+        """Load raw binary image and return the number of loaded bytes"""
+        with open(filename, 'rb') as f:
+            return f.readinto(memoryview(self._data)[address:])
+
+    def map_bin(self, filename, address=0x0000):
+        """Copy raw binary image through mmap and return the number of
+        loaded bytes"""
+        with open(filename, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                size = min(len(mm), len(self._data) - address)
+                self._data[address:address + size] = mm[:size]
+            finally:
+                mm.close()
+        return size
+
+    def backing(self, address):
+        """Return the index of `address` in the backing bytearray, or None
+        if a device answers it"""
+        return address
+
+    def watch(self, start, stop, callback):
+        """Call `callback(address)` on writes into [start, stop) of the
+        backing bytearray
+
+        Only writes through `__call__` are watched. Each callback keeps its
+        own ranges. A bound method is held by a weak reference, and its
+        ranges are unwatched once its object is gone.
+        """
+        if self._watch is None:
+            self._watch = bytearray(len(self._data))
+            self._watcher = self._notify
+        key = _key(callback)
+        watcher = self._watchers.get(key)
+        if watcher is None:
+            target = callback
+            if hasattr(callback, '__func__') and \
+               callback.__self__ is not None:
+                ref = weakref.ref(callback.__self__,
+                                  lambda ref: self._release(key))
+                target = (ref, callback.__func__)
+            watcher = self._watchers[key] = [target, set()]
+        watched = self._watched
+        for address in range(start, stop):
+            watched.setdefault(address, set()).add(key)
+        watcher[1].update(range(start, stop))
+        self._watch[start:stop] = b'\x01' * len(self._watch[start:stop])
+
+    def unwatch(self, start=0x0000, stop=None, callback=None):
+        """Stop watching writes into [start, stop) by `callback`, or by all
+        callbacks if None"""
+        if self._watch is None:
+            return
+        stop = len(self._data) if stop is None else stop
+        if callback is None:
+            keys = list(self._watchers)
+        else:
+            keys = [_key(callback)]
+        for key in keys:
+            self._release(key, start, stop)
+
+    def _release(self, key, start=0x0000, stop=None):
+        watcher = self._watchers.get(key)
+        if watcher is None:
+            return
+        addresses = watcher[1]
+        if stop is None:
+            hit = list(addresses)
+        elif stop - start <= len(addresses):
+            hit = [a for a in range(start, stop) if a in addresses]
+        else:
+            hit = [a for a in addresses if start <= a < stop]
+        watched = self._watched
+        for address in hit:
+            addresses.discard(address)
+            keys = watched[address]
+            keys.discard(key)
+            if not keys:
+                del watched[address]
+                self._watch[address] = 0
+        if not addresses:
+            del self._watchers[key]
+
+    def _notify(self, address):
+        for key in list(self._watched.get(address, ())):
+            watcher = self._watchers.get(key)
+            if watcher is None or address not in watcher[1]:
+                continue
+            target = watcher[0]
+            if isinstance(target, tuple):
+                obj = target[0]()
+                if obj is not None:
+                    target[1](obj, address)
+            else:
+                target(address)
+
+    def view(self, start=0x0000, stop=None):
+        """Return zero-copy memoryview of the memory"""
+        return memoryview(self._data)[start:stop]
+
+    def array(self, start=0x0000, stop=None):
+        """Return zero-copy NumPy uint8 array of the memory"""
+        import numpy
+        return numpy.frombuffer(self._data, dtype=numpy.uint8)[start:stop]
@@ -1,12 +1,126 @@
-from mc6502.controller import Controller
+import struct
+
+from mc6502.controller import Controller, OP_NAMES, ADDR_MODES, \
+    WRITE_STATES, T1_FETCH_OPERAND, T4_BRK_OP, T5_BRK_OP
 from mc6502.datapath import Datapath
+from mc6502.decoder import InstructionDecoder
+from mc6502.flag import Flag, I
+
+# Snapshot layout: magic, version, controller (state, instruction, op name,
+# addressing mode, read/write), datapath registers, PCAdder carry and memory
+# size, followed by the memory
+SNAPSHOT_MAGIC = b'M6502'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_REGISTERS = (
+    'abl', 'abh', 'db', 'dl', 'ir', 'pcl', 'pch',
+    'a', 'x', 'y', 's', 't', 'p', '_alu_out',
+)
+SNAPSHOT = struct.Struct(
+    '<5sB' + 'B' * 5 + 'B' * len(SNAPSHOT_REGISTERS) + 'BI')
+
+
+def _index(names, name):
+    return 0xff if name is None else names.index(name)
+
+
+def _writes():
+    decoder = InstructionDecoder()
+    stores = ['STA', 'STX', 'STY', 'STZ', 'PHA', 'PHP', 'PHX', 'PHY',
+              'JSR', 'BRK', 'TRB', 'TSB']
+    rmws = ['ASL', 'LSR', 'ROL', 'ROR', 'INC', 'DEC']
+    ret = [False] * 0x100
+    for opcode, (op_name, addr_mode, _) in decoder.table.items():
+        ret[opcode] = op_name in stores or \
+            (op_name in rmws and addr_mode != 'acc')
+    return tuple(ret)
+
+# Opcodes which may write the memory
+WRITES = _writes()
+
+# Number of instruction boundaries searched for a repeated state
+IDLE_WINDOW = 256
+
+# Interrupt vectors, BRK shares the one of IRQ
+NMI_VECTOR = 0xfffa
+IRQ_VECTOR = 0xfffe
+
+
+def stalled(stall, ncycles, cycles):
+    """Return the cycles halted by RDY from now within the budget"""
+    count = stall()
+    if cycles is not None and count > cycles - ncycles:
+        return cycles - ncycles
+    return count
+
+
+def skippable(until):
+    """Return True if idle loops may be skipped with the stop condition
+    `until`, which is None or marked by a true `idle` attribute as changed
+    only by the memory accesses of the MPU"""
+    return until is None or getattr(until, 'idle', False)
+
+
+class IdleLoop(object):
+    """Detector of loops whose state provably does not change
+
+    The MPU state is compared at the instruction boundaries since the last
+    write. The same state seen twice without any write in between repeats
+    forever, so whole periods of the loop can be skipped. Memories whose
+    reads can change by themselves set `volatile` and are never skipped,
+    and loops reading the device pages counted by `Bus.device_reads` are
+    not skipped either.
+    """
+
+    def __init__(self, mpu, memory):
+        self._mpu = mpu
+        self._memory = memory
+        self._seen = {}
+        self._volatile = getattr(memory, 'volatile', True)
+        self._reads = getattr(memory, 'device_reads', 0)
+
+    def __call__(self, ncycles, ninstrs, cycles, instructions):
+        """Return tuple (cycles, instructions) to skip at this instruction
+        boundary within the budget"""
+        seen = self._seen
+        reads = getattr(self._memory, 'device_reads', 0)
+        if self._volatile or WRITES[self._mpu.controller._instr] or \
+           reads != self._reads:
+            self._reads = reads
+            seen.clear()
+            return 0, 0
+        state = self._mpu.snapshot()
+        if state not in seen:
+            if len(seen) >= IDLE_WINDOW:
+                seen.clear()
+            seen[state] = ncycles, ninstrs
+            return 0, 0
+
+        pcycles, pinstrs = seen.pop(state)
+        pcycles, pinstrs = ncycles - pcycles, ninstrs - pinstrs
+        seen.clear()
+        periods = []
+        if cycles is not None:
+            periods.append((cycles - ncycles) // pcycles)
+        if instructions is not None:
+            periods.append((instructions - ninstrs) // pinstrs)
+        if not periods:
+            return 0, 0
+        return min(periods) * pcycles, min(periods) * pinstrs
 
 
 class MPU(object):
 
-    def __init__(self):
-        self.controller = Controller()
-        self.datapath = Datapath()
+    def __init__(self, precompiled=False, lut=False, idle=False):
+        self.controller = Controller(precompiled=precompiled)
+        self.datapath = Datapath(lut=lut)
+        self._idle = idle
+        # Cycles run since the construction, the clock of the devices
+        self.cycles = 0
+        # Callable returning the number of cycles RDY stays low from the
+        # current one, such as `TIA.stall`
+        self.stall = None
+        # Vector of the interrupt entry in progress
+        self._vector = None
 
     @property
     def address(self):
@@ -18,9 +132,201 @@ class MPU(object):
 
     def __call__(self, data, dbe=True, rdy=True,
                  res_n=True, irq_n=True, nmi_n=True):
-        flag = self.datapath.flag
-        flag['PCC'] = self.datapath.pcadder.carry
-        self.controller(self.datapath.ir.data, flag,
+        if not rdy and self.controller._state not in WRITE_STATES:
+            # RDY low halts read cycles, the same cycle is run again
+            self.controller.r_w = 'r'
+            return data, self.address
+        dp = self.datapath
+        flag = Flag(dp.p.data | (dp.pcadder.carry << 8))
+        self.controller(dp.ir.data, flag,
                         rdy=rdy, res_n=res_n, irq_n=irq_n, nmi_n=nmi_n)
         data, addr = self.datapath(data, self.controller, dbe=dbe)
         return data, addr
+
+    def run(self, memory, cycles=None, until=None, instructions=None):
+        """Run the MPU on memory and return tuple (cycles, instructions)
+
+        Stop after `cycles` cycles, after `instructions` instruction
+        boundaries, or at the first instruction boundary where
+        `until(mpu)` is true, whichever comes first. With `idle`, loops
+        repeating the same state skip ahead within the budget as if they
+        had run, unless `until` is given since it is not evaluated at the
+        skipped boundaries; see `skippable` for the exception. The memory
+        is not read in write cycles, and read cycles halted by `stall` are
+        skipped at once without any access.
+        """
+        controller, datapath = self.controller, self.datapath
+        p, ir, abl, abh, pcadder = \
+            datapath.p, datapath.ir, datapath.abl, datapath.abh, \
+            datapath.pcadder
+        idle = IdleLoop(self, memory) if self._idle and skippable(until) \
+            else None
+        stall = self.stall
+
+        ncycles = ninstrs = 0
+        while cycles is None or ncycles < cycles:
+            if stall is not None and controller._state not in WRITE_STATES:
+                halted = stalled(stall, ncycles, cycles)
+                if halted:
+                    ncycles += halted
+                    self.cycles += halted
+                    continue
+            data = 0x00 if controller._state in WRITE_STATES else \
+                memory((abh.data << 8) | abl.data)
+            controller(ir.data, Flag(p.data | (pcadder.carry << 8)))
+            data, addr = datapath(data, controller)
+            if controller.r_w == 'w':
+                memory(addr, data, True)
+            ncycles += 1
+            self.cycles += 1
+
+            if controller._state != T1_FETCH_OPERAND:
+                continue
+            ninstrs += 1
+            if idle is not None:
+                skip = idle(ncycles, ninstrs, cycles, instructions)
+                ncycles += skip[0]
+                ninstrs += skip[1]
+                self.cycles += skip[0]
+            if instructions is not None and ninstrs >= instructions:
+                break
+            if until is not None and until(self):
+                break
+        return ncycles, ninstrs
+
+    def run_probed(self, probe, memory, cycles=None, until=None,
+                   instructions=None):
+        """Same as `run` cycle by cycle, calling `probe` after each cycle
+
+        `probe(count, state, pc, ir, address, data, write)` is given the
+        controller state, PC and IR at the beginning of the cycle and the
+        bus access. Halted cycles are given at once with their `count`, the
+        halted read address and None as data. Idle loops are not skipped.
+        `Profile` and `Tracer` install this as `run` of one instance, so
+        `run` itself never checks for a probe.
+        """
+        controller, datapath = self.controller, self.datapath
+        p, ir, abl, abh, pcl, pch, pcadder = \
+            datapath.p, datapath.ir, datapath.abl, datapath.abh, \
+            datapath.pcl, datapath.pch, datapath.pcadder
+        stall = self.stall
+
+        ncycles = ninstrs = 0
+        while cycles is None or ncycles < cycles:
+            state = controller._state
+            address = (abh.data << 8) | abl.data
+            pc, opcode = (pch.data << 8) | pcl.data, ir.data
+            if stall is not None and state not in WRITE_STATES:
+                halted = stalled(stall, ncycles, cycles)
+                if halted:
+                    probe(halted, state, pc, opcode, address, None, False)
+                    ncycles += halted
+                    self.cycles += halted
+                    continue
+            data = 0x00 if state in WRITE_STATES else memory(address)
+            controller(opcode, Flag(p.data | (pcadder.carry << 8)))
+            wdata, addr = datapath(data, controller)
+            if controller.r_w == 'w':
+                memory(addr, wdata, True)
+                probe(1, state, pc, opcode, addr, wdata, True)
+            else:
+                probe(1, state, pc, opcode, address, data, False)
+            ncycles += 1
+            self.cycles += 1
+
+            if controller._state != T1_FETCH_OPERAND:
+                continue
+            ninstrs += 1
+            if instructions is not None and ninstrs >= instructions:
+                break
+            if until is not None and until(self):
+                break
+        return ncycles, ninstrs
+
+    def interrupt(self, nmi=False):
+        """Replace the instruction at the boundary by the BRK sequence of
+        NMI or IRQ, which `enter` runs
+
+        The return address is the replaced instruction.
+        """
+        dp = self.datapath
+        pc = (dp.pc - 1) & 0xffff
+        dp.pcl(pc & 0xff)
+        dp.pch(pc >> 8)
+        dp.ir(0x00)
+        self._vector = NMI_VECTOR if nmi else IRQ_VECTOR
+
+    @property
+    def entering(self):
+        return self._vector is not None
+
+    def enter(self, memory, cycles=None):
+        """Run the interrupt entry up to the instruction boundary of the
+        handler or for `cycles` cycles and return the number of cycles
+
+        The cycles are the ones of BRK, except that I is set once P is
+        pushed and the vector is the one of the interrupt.
+        """
+        controller, dp = self.controller, self.datapath
+        ncycles = 0
+        while self._vector is not None and (cycles is None or
+                                            ncycles < cycles):
+            state = controller._state
+            data = 0x00 if state in WRITE_STATES else memory(dp.ab)
+            data, addr = self(data)
+            if controller.r_w == 'w':
+                memory(addr, data, True)
+            ncycles += 1
+            self.cycles += 1
+
+            if state == T4_BRK_OP:
+                dp.p(dp.p.data | I)
+                dp.abl(self._vector & 0xff)
+            elif state == T5_BRK_OP:
+                dp.abl((self._vector + 1) & 0xff)
+            elif controller._state == T1_FETCH_OPERAND:
+                self._vector = None
+        return ncycles
+
+    def step_instruction(self, memory):
+        """Run up to the next instruction boundary and return the number of
+        cycles"""
+        return self.run(memory, instructions=1)[0]
+
+    def snapshot(self, memory=None):
+        """Return bytes of the MPU state followed by the memory"""
+        controller, dp = self.controller, self.datapath
+        header = SNAPSHOT.pack(*(
+            [SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+             controller._state, controller._instr,
+             _index(OP_NAMES, controller._op_name),
+             _index(ADDR_MODES, controller._addr_mode),
+             controller.r_w == 'w'] +
+            [getattr(dp, name).data for name in SNAPSHOT_REGISTERS] +
+            [dp.pcadder.carry, 0 if memory is None else len(memory)]))
+        if memory is None:
+            return header
+        return header + bytes(memory._data)
+
+    def restore(self, blob, memory=None):
+        """Restore the MPU state and the memory from `snapshot` bytes"""
+        fields = SNAPSHOT.unpack_from(blob)
+        assert fields[:2] == (SNAPSHOT_MAGIC, SNAPSHOT_VERSION), \
+            'unknown snapshot {}'.format(fields[:2])
+        controller, dp = self.controller, self.datapath
+        # The op name and the addressing mode follow the instruction
+        state, instr, _, _, write = fields[2:7]
+        controller._state = state
+        controller._decode(instr)
+        controller.r_w = 'w' if write else 'r'
+
+        registers = fields[7:7 + len(SNAPSHOT_REGISTERS)]
+        for name, data in zip(SNAPSHOT_REGISTERS, registers):
+            getattr(dp, name).data = data
+        dp.pcadder.carry, size = fields[-2:]
+
+        if memory is not None:
+            assert size == len(memory), \
+                'memory size 0x{:x} of snapshot is not 0x{:x}'.format(
+                    size, len(memory))
+            memory._data[:] = memoryview(blob)[SNAPSHOT.size:]
@@ -0,0 +1,89 @@
+import functools
+
+from mc6502.controller import STATES, T1_FETCH_OPERAND
+from mc6502.decoder import InstructionDecoder
+
+
+class Profile(object):
+    """Cycles per controller state, instructions retired per opcode and per
+    pair of consecutive opcodes, and memory accesses per page
+
+    `attach` replaces `run` of one MPU instance by `MPU.run_probed` and
+    `detach` brings back the class loop, so an MPU which is not profiled
+    pays nothing. Engines running whole instructions are profiled cycle by
+    cycle while attached.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._states = [0] * len(STATES)
+        self.opcodes = [0] * 0x100
+        # Indexed by the previous opcode << 8 | the opcode
+        self.pairs = [0] * 0x10000
+        self._previous = None
+        self.reads = [0] * 0x100
+        self.writes = [0] * 0x100
+
+    @property
+    def states(self):
+        """Cycles by state name"""
+        return dict(zip(STATES, self._states))
+
+    def attach(self, mpu):
+        """Count the cycles run by `mpu` from now on"""
+        controller = mpu.controller
+
+        def probe(count, state, pc, ir, address, data, write):
+            self._states[state] += count
+            if data is None:
+                return
+            if write:
+                self.writes[address >> 8] += 1
+            else:
+                self.reads[address >> 8] += 1
+            if controller._state != T1_FETCH_OPERAND:
+                return
+            instr = controller._instr
+            self.opcodes[instr] += 1
+            if self._previous is not None:
+                self.pairs[self._previous << 8 | instr] += 1
+            self._previous = instr
+        mpu.run = functools.partial(mpu.run_probed, probe)
+
+    def detach(self, mpu):
+        mpu.__dict__.pop('run', None)
+
+    def fusions(self, top=8):
+        """Return the `top` hottest opcode pairs for `FastMPU.fuse`"""
+        hot = sorted((i for i, count in enumerate(self.pairs) if count),
+                     key=lambda i: -self.pairs[i])[:top]
+        return [(i >> 8, i & 0xff) for i in hot]
+
+    def report(self, top=10):
+        """Return the `top` hottest states, opcodes, opcode pairs and pages
+        as text"""
+        decoder = InstructionDecoder()
+
+        def hottest(counts, label):
+            total = sum(counts.values()) or 1
+            rows = sorted(counts.items(), key=lambda kv: -kv[1])[:top]
+            return ['{:24} {:10} {:6.1%}'.format(label(key), count,
+                                                 float(count) / total)
+                    for key, count in rows if count]
+
+        def name(opcode):
+            op_name, addr_mode, _ = decoder(opcode)
+            return '0x{:02x} {} {}'.format(opcode, op_name, addr_mode)
+
+        lines = ['# States'] + hottest(self.states, str)
+        lines += ['# Opcodes'] + hottest(dict(enumerate(self.opcodes)), name)
+        lines += ['# Pairs'] + hottest(
+            dict((i, count) for i, count in enumerate(self.pairs) if count),
+            lambda i: '{} {}'.format(name(i >> 8), name(i & 0xff)))
+        lines += ['# Reads'] + hottest(dict(enumerate(self.reads)),
+                                       '0x{:02x}xx'.format)
+        lines += ['# Writes'] + hottest(dict(enumerate(self.writes)),
+                                        '0x{:02x}xx'.format)
+        return '\n'.join(lines)
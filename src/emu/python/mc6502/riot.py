@@ -0,0 +1,188 @@
+RAM_SIZE = 0x80
+
+# Interval timer pre-scale of A[1:0] as shift: 1T, 8T, 64T and 1024T
+PRESCALE_SHIFT = (0, 3, 6, 10)
+
+
+def _decode(address, write):
+    """Return the register selected by the address (src/rtl/mm6532)"""
+    a = address & 0x7f
+    if not address & 0x200:
+        return 'ram'
+    if a & 0x04 == 0:
+        return ('dra', 'ddra', 'drb', 'ddrb')[a & 0x03]
+    if write:
+        return 'tim' if a & 0x10 else 'edc'
+    return 'irq' if a & 0x01 else 'tim'
+
+
+class RIOT(object):
+    """MM6532 RAM-I/O-Timer as a `Bus` device
+
+    Matches src/rtl/mm6532 at the cycles given by `clock()`: an access in
+    cycle t returns the output of the state after t clock edges and takes
+    effect at edge t + 1. The interval timer is not ticked; INTIM and the
+    interrupt flag are computed from the cycle, the value and the
+    pre-scale of the last timer write. Edges without an access are taken
+    as read cycles. RS_N is address bit 9 as in the VCS, so RAM is at
+    0x00-0x7f and the registers are at 0x200-0x27f of the device.
+
+    With a `Scheduler`, an event is registered at the next cycle IRQ_N may
+    go low by the timer or the registers, and kept while that cycle does
+    not change. RAM accesses leave it as it is. Changes of PA7 by `pa_in`
+    are up to the caller.
+    """
+
+    def __init__(self, clock=None, scheduler=None):
+        self._clock = clock if clock is not None else lambda: 0
+        self._scheduler = scheduler
+        self._event = None
+        self.pa_in = 0x00
+        self.pb_in = 0x00
+        self.reset()
+
+    def reset(self):
+        now = self._clock()
+        self.ram = bytearray(RAM_SIZE)
+        self.dra = self.ddra = self.drb = self.ddrb = 0x00
+
+        # Timer as loaded at edge `_start` with OUT and pre-scale shift
+        self._start, self._out, self._shift = now, 0x00, 0
+        # Timer interrupt flag after the edge `_irq_edge`
+        self._irq, self._irq_edge = False, now
+        self.tim_irq_en = False
+
+        # PA7 interrupt flag after the edge `_pa7_edge`
+        self._pa7_irq, self._pa7_edge = False, now
+        self.pa7_irq_mode = False
+        self.pa7_irq_en = False
+
+    @property
+    def pa(self):
+        return (self.pa_in & ~self.ddra | self.dra & self.ddra) & 0xff
+
+    @property
+    def pb(self):
+        return (self.pb_in & ~self.ddrb | self.drb & self.ddrb) & 0xff
+
+    @property
+    def pa_out(self):
+        return self.dra & self.ddra
+
+    @property
+    def pb_out(self):
+        return self.drb & self.ddrb
+
+    @property
+    def irq_n(self):
+        now = self._clock()
+        return not ((self._tim_irq(now) and self.tim_irq_en) or
+                    (self._pa7(now) and self.pa7_irq_en))
+
+    def _timer(self, t):
+        """Return tuple (OUT, INTERRUPT) in cycle t"""
+        k = t - self._start
+        underflow = (self._out + 1) << self._shift
+        if k < underflow:
+            return self._out - (k >> self._shift), k + 1 == underflow
+        # Counting by 1T after the underflow
+        out = (0xff - (k - underflow)) & 0xff
+        return out, out == 0
+
+    def _tim_irq_edge(self):
+        """Return the edge from which the timer sets the interrupt flag"""
+        # First cycle from `_irq_edge` whose INTERRUPT sets the flag
+        first = ((self._out + 1) << self._shift) - 1
+        k = self._irq_edge - self._start
+        if k > first:
+            k = first + -(-(k - first) // 0x100) * 0x100
+        else:
+            k = first
+        return self._start + k + 1
+
+    def _tim_irq(self, t):
+        """Return the timer interrupt flag after the edge t"""
+        if self._irq or t <= self._irq_edge:
+            return self._irq
+        return self._tim_irq_edge() <= t
+
+    def _pa7(self, t):
+        """Return the PA7 interrupt flag after the edge t"""
+        if t == self._pa7_edge:
+            return self._pa7_irq
+        return bool(self.pa & 0x80) == self.pa7_irq_mode
+
+    def peek(self, address, write=False):
+        """Return the data output at `address` without any side effect"""
+        now = self._clock()
+        reg = _decode(address, write)
+        if reg == 'ram':
+            return self.ram[address & 0x7f]
+        if reg in ('dra', 'drb'):
+            return self.pa if reg == 'dra' else self.pb
+        if reg in ('ddra', 'ddrb'):
+            return getattr(self, reg)
+        if reg == 'tim':
+            out = self._timer(now)[0]
+            return ~out & 0xff if self._tim_irq(now) else out
+        if reg == 'irq':
+            return (self._tim_irq(now) and self.tim_irq_en) << 7 | \
+                (self._pa7(now) and self.pa7_irq_en) << 6
+        return 0x00
+
+    def _edge(self, t, address, reg, data):
+        # Registers at the edge t + 1 by the access in the cycle t
+        write = data is not None
+        interrupt = self._timer(t)[1]
+        irq = self._tim_irq(t)
+        if interrupt and not write:
+            irq = True
+        elif reg == 'tim':
+            irq = False
+        self._irq, self._irq_edge = irq, t + 1
+        self._pa7_irq = reg != 'irq' and \
+            bool(self.pa & 0x80) == self.pa7_irq_mode
+        self._pa7_edge = t + 1
+        if reg == 'tim':
+            self.tim_irq_en = bool(address & 0x08)
+        if write:
+            self._write(address, reg, data, t)
+        if self._scheduler is not None and reg != 'ram':
+            self._schedule(t)
+
+    def _write(self, address, reg, data, t):
+        if reg == 'ram':
+            self.ram[address & 0x7f] = data
+        elif reg in ('dra', 'ddra', 'drb', 'ddrb'):
+            setattr(self, reg, data)
+        elif reg == 'tim':
+            self._start = t + 1
+            self._out = (data - 1) & 0xff
+            self._shift = PRESCALE_SHIFT[address & 0x03]
+        elif reg == 'edc':
+            self.pa7_irq_mode = bool(address & 0x01)
+            self.pa7_irq_en = bool(address & 0x02)
+
+    def _schedule(self, t):
+        # IRQ_N goes low at the edge t + 1 or when the timer sets the flag
+        if (self._irq and self.tim_irq_en) or \
+           (self._pa7_irq and self.pa7_irq_en):
+            edge = t + 1
+        elif self.tim_irq_en:
+            edge = self._tim_irq_edge()
+        else:
+            edge = None
+        if self._event is not None:
+            if self._event[0] == edge:
+                return
+            self._scheduler.cancel(self._event)
+        self._event = None if edge is None else \
+            self._scheduler.schedule(edge)
+
+    def read(self, address):
+        data = self.peek(address)
+        self._edge(self._clock(), address, _decode(address, False), None)
+        return data
+
+    def write(self, address, data):
+        self._edge(self._clock(), address, _decode(address, True), data)
@@ -0,0 +1,126 @@
+import heapq
+import itertools
+
+from mc6502.controller import T1_FETCH_OPERAND
+from mc6502.flag import I
+from mc6502.mpu import skippable
+
+
+class Scheduler(object):
+    """Min-heap of device events keyed by the absolute cycle of
+    `MPU.cycles`
+
+    `run` runs the MPU uninterrupted up to the next event, calls the events
+    due and samples the interrupt lines only then: `irq_n()` and `nmi_n()`
+    return the levels of IRQ_N and NMI_N, so a device registers an event
+    at every cycle its line may go low, as `RIOT` does with a scheduler.
+    An event registered by an access before the current deadline stops the
+    run at the next instruction boundary.
+    IRQ is taken while it is low and I is clear, NMI on its falling edge,
+    both at an instruction boundary through `MPU.interrupt`.
+    With `idle`, an idle loop is skipped up to the next event.
+    """
+
+    def __init__(self, irq_n=None, nmi_n=None):
+        self.irq_n = irq_n
+        self.nmi_n = nmi_n
+        self._events = []
+        self._order = itertools.count()
+        self._nmi_level = True
+        self._nmi = False
+        # The current run stops at the boundary after an earlier event
+        self._horizon = None
+        self._preempted = False
+
+    def schedule(self, cycle, callback=None):
+        """Call `callback(cycle)` once the MPU reaches `cycle` and return
+        the event for `cancel`"""
+        event = [cycle, next(self._order), callback, True]
+        heapq.heappush(self._events, event)
+        if self._horizon is not None and cycle < self._horizon:
+            self._preempted = True
+        return event
+
+    def cancel(self, event):
+        event[3] = False
+
+    @property
+    def deadline(self):
+        """Return the cycle of the next event or None"""
+        events = self._events
+        while events and not events[0][3]:
+            heapq.heappop(events)
+        return events[0][0] if events else None
+
+    def fire(self, now):
+        """Call the events due at the cycle `now`"""
+        events = self._events
+        while events and events[0][0] <= now:
+            cycle, _, callback, active = heapq.heappop(events)
+            if active and callback is not None:
+                callback(cycle)
+
+    def _sample(self):
+        """Return tuple (NMI, IRQ) pending at the current cycle"""
+        if self.nmi_n is not None:
+            level = bool(self.nmi_n())
+            if self._nmi_level and not level:
+                self._nmi = True
+            self._nmi_level = level
+        irq = self.irq_n is not None and not self.irq_n()
+        return self._nmi, irq
+
+    def run(self, mpu, memory, cycles=None, until=None, instructions=None):
+        """Run `mpu` as `MPU.run` and return tuple (cycles, instructions)
+
+        The entry of an interrupt counts the cycles but no instruction.
+        """
+        controller = mpu.controller
+        stopped = []
+
+        def check(mpu):
+            if until is not None and until(mpu):
+                stopped.append(True)
+                return True
+            return self._preempted
+        # Events are only registered before the deadline by the device
+        # accesses, which keep idle loops from being skipped
+        check.idle = skippable(until)
+
+        ncycles = ninstrs = 0
+        while (cycles is None or ncycles < cycles) and \
+              (instructions is None or ninstrs < instructions):
+            remain = None if cycles is None else cycles - ncycles
+            if mpu.entering:
+                ncycles += mpu.enter(memory, remain)
+                continue
+
+            self.fire(mpu.cycles)
+            nmi, irq = self._sample()
+            masked = irq and mpu.datapath.p.data & I
+            boundary = controller._state == T1_FETCH_OPERAND
+            if boundary and (nmi or (irq and not masked)):
+                self._nmi = False if nmi else self._nmi
+                mpu.interrupt(nmi=nmi)
+                continue
+
+            # Up to the next event, or to the next boundary while an
+            # interrupt waits for it or IRQ waits for I
+            budget = remain
+            deadline = self.deadline
+            if deadline is not None:
+                budget = max(deadline - mpu.cycles, 1) if budget is None \
+                    else min(budget, max(deadline - mpu.cycles, 1))
+            count = None if instructions is None else instructions - ninstrs
+            if nmi or irq:
+                count = 1
+            self._horizon = float('inf') if budget is None else \
+                mpu.cycles + budget
+            self._preempted = False
+            c, n = mpu.run(memory, budget, check, count)
+            self._horizon = None
+            ncycles += c
+            ninstrs += n
+            if stopped:
+                break
+        return ncycles, ninstrs
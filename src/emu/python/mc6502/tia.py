@@ -0,0 +1,384 @@
+import numpy
+
+# Color clocks
+LINE = 228
+HBLANK = 68
+HSYNC = (20, 36)
+WIDTH = LINE - HBLANK
+LINES = 262
+CCLK_PER_MCLK = 3
+
+# Write addresses
+VSYNC, VBLANK, WSYNC, RSYNC = 0x00, 0x01, 0x02, 0x03
+RESP0, RESP1, RESM0, RESM1, RESBL = 0x10, 0x11, 0x12, 0x13, 0x14
+HMOVE, HMCLR, CXCLR = 0x2a, 0x2b, 0x2c
+
+# Registers loaded from the data bus as (name, bit) or (name, None) for
+# all 8 bits
+REGISTERS = {
+    0x00: ('vsync', 0x02), 0x01: ('vblank', None),
+    0x04: ('nusiz0', None), 0x05: ('nusiz1', None),
+    0x06: ('colup0', None), 0x07: ('colup1', None),
+    0x08: ('colupf', None), 0x09: ('colubk', None),
+    0x0a: ('ctrlpf', None), 0x0b: ('refp0', 0x08), 0x0c: ('refp1', 0x08),
+    0x0d: ('pf0', None), 0x0e: ('pf1', None), 0x0f: ('pf2', None),
+    0x15: ('audc0', None), 0x16: ('audc1', None),
+    0x17: ('audf0', None), 0x18: ('audf1', None),
+    0x19: ('audv0', None), 0x1a: ('audv1', None),
+    0x1b: ('grp0', None), 0x1c: ('grp1', None),
+    0x1d: ('enam0', 0x02), 0x1e: ('enam1', 0x02), 0x1f: ('enabl', 0x02),
+    0x20: ('hmp0', None), 0x21: ('hmp1', None), 0x22: ('hmm0', None),
+    0x23: ('hmm1', None), 0x24: ('hmbl', None),
+    0x25: ('vdelp0', 0x01), 0x26: ('vdelp1', 0x01), 0x27: ('vdelbl', 0x01),
+    0x28: ('resmp0', 0x02), 0x29: ('resmp1', 0x02),
+}
+STATE = sorted(name for name, _ in REGISTERS.values()) + [
+    'posp0', 'posp1', 'posm0', 'posm1', 'posbl',
+    'grp0d', 'grp1d', 'enabld', 'cxclr', 'cxr']
+
+# Position strobes as (position, offset in the horizontal blank)
+RESETS = {RESP0: ('posp0', 3), RESP1: ('posp1', 3), RESM0: ('posm0', 2),
+          RESM1: ('posm1', 2), RESBL: ('posbl', 2)}
+MOTIONS = (('posp0', 'hmp0'), ('posp1', 'hmp1'), ('posm0', 'hmm0'),
+           ('posm1', 'hmm1'), ('posbl', 'hmbl'))
+
+# Object bits of the per pixel code
+P0, P1, M0, M1, BL, PF = 0x01, 0x02, 0x04, 0x08, 0x10, 0x20
+
+# Collision latch bits of CXR in the order of tia1a.v
+COLLISIONS = (
+    (M0, P0), (M0, P1), (M1, P1), (M1, P0), (P0, BL), (P0, PF), (P1, BL),
+    (P1, PF), (M0, BL), (M0, PF), (M1, BL), (M1, PF), (BL, PF), (M0, M1),
+    (P0, P1))
+
+# objPixelOn.v: copies of NUSIZx[2:0] as bits of the 8 pixel index
+COPIES = (0x001, 0x005, 0x011, 0x015, 0x101, 0x003, 0x111, 0x00f)
+# Missile and ball width of NUSIZx[5:4] and CTRLPF[5:4] as mask
+WIDTHS = (0x01, 0x03, 0x0f, 0xff)
+
+REVERSE8 = [int('{:08b}'.format(x)[::-1], 2) for x in range(0x100)]
+
+_PIXELS = numpy.arange(WIDTH)
+# Playfield bit for each pixel, normal and reflected right half
+_PF_BITS = (numpy.where(_PIXELS < WIDTH // 2, _PIXELS >> 2,
+                        (_PIXELS >> 2) - 20),
+            numpy.where(_PIXELS < WIDTH // 2, _PIXELS >> 2,
+                        39 - (_PIXELS >> 2)))
+_RIGHT = (_PIXELS >= WIDTH // 2).astype(numpy.intp)
+
+_CACHE_SIZE = 0x1000
+
+
+def _tables():
+    codes = numpy.arange(0x40)
+    cx = numpy.zeros(0x40, dtype=numpy.int64)
+    for bit, (a, b) in enumerate(COLLISIONS):
+        cx[(codes & a != 0) & (codes & b != 0)] |= 1 << bit
+
+    # Color of COLUBK, COLUP0, COLUP1, COLUPF and the playfield color
+    # (COLUPF or the score colors) in the priorities of CTRLPF[2]
+    def source(code, priority):
+        order = [(BL, 3), (PF, 4), (P0 | M0, 1), (P1 | M1, 2)] if priority \
+            else [(P0 | M0, 1), (P1 | M1, 2), (BL, 3), (PF, 4)]
+        for mask, color in order:
+            if code & mask:
+                return color
+        return 0
+    sources = numpy.array([[source(code, priority) for code in range(0x40)]
+                           for priority in [False, True]], dtype=numpy.intp)
+    return cx, sources
+
+_CX, _SOURCES = _tables()
+
+_rows = {}
+
+def _object_row(pos, gr, siz):
+    """Return pixels of an object as objPixelOn.v over the visible line"""
+    key = (pos, gr, siz)
+    row = _rows.get(key)
+    if row is None:
+        index = (_PIXELS - pos - 1) & 0xff
+        on = (COPIES[siz] >> (index >> 3)) & 1
+        select = index >> {5: 1, 7: 2}.get(siz, 0) & 0x07
+        on &= (gr >> select) & 1
+        on &= (_PIXELS > pos) & (_PIXELS <= pos + 72)
+        if len(_rows) >= _CACHE_SIZE:
+            _rows.clear()
+        row = _rows[key] = on.astype(numpy.uint8)
+    return row
+
+
+class TIA(object):
+    """TIA-1A following src/rtl/tia1a, rendering on demand
+
+    Writes are only queued with the color clock of their MCLK edge. The
+    queue is replayed when a read, an output or a frame needs the state,
+    and the pixels between two writes are drawn a scanline span at a time
+    from per object masks. `clock()` is the color clock, 3 times the 6507
+    cycles, and an access at the clock c is the one latched at the MCLK
+    edge after c. Frames are the visible 160 pixels of each line counted
+    in blocks of 262 lines, as the screen dump of sim_tia1a.cpp.
+    """
+
+    def __init__(self, clock=None, on_frame=None):
+        self._clock = clock if clock is not None else lambda: 0
+        self.on_frame = on_frame
+        self.inpt = 0x00
+        self.screen = numpy.zeros((LINES, WIDTH), dtype=numpy.uint8)
+        self.reset()
+
+    def reset(self):
+        now = self._clock()
+        for name in STATE:
+            setattr(self, name, 0)
+        self.d_out = 0x00
+        self._ilatch = 0x0
+        self._writes = []
+
+        # Rendered up to the edge `_edge` with hcount 0 at `_origin`
+        self._edge = self._origin = now
+        self._delayed = None
+        self._pending = 0
+        self._lines = {}
+        self.frames = 0
+        self._pixel = 0
+
+        # Horizontal count and WSYNC as of the latest writes
+        self._line = self._line_prev = now
+        self._wsync = (now, now)
+
+    # Outputs
+
+    def _hcount(self, edge):
+        if edge > self._line:
+            return (edge - self._line) % LINE
+        if edge >= self._line - (CCLK_PER_MCLK - 1):
+            return 0
+        return (edge - self._line_prev) % LINE
+
+    @property
+    def hblank(self):
+        return self._hcount(self._clock()) < HBLANK
+
+    @property
+    def hsync(self):
+        return HSYNC[0] <= self._hcount(self._clock()) < HSYNC[1]
+
+    @property
+    def rdy(self):
+        start, release = self._wsync
+        return not start <= self._clock() < release
+
+    def stall(self):
+        """Return the number of 6507 cycles RDY stays low from now, for
+        `MPU.stall`"""
+        now = self._clock()
+        start, release = self._wsync
+        if not start <= now < release:
+            return 0
+        return -(-(release - now) // CCLK_PER_MCLK)
+
+    @property
+    def colu(self):
+        """Return the color-luminance output of the current pixel"""
+        now = self._clock()
+        self._catch_up(now)
+        hcount = self._hcount(now)
+        if hcount < HBLANK:
+            return 0x00
+        px = hcount - HBLANK
+        return int(self._colors(self._line_code(), px, px + 1)[0])
+
+    def update(self):
+        """Render up to the current clock"""
+        self._catch_up(self._clock())
+
+    # Bus
+
+    def _mclk(self):
+        now = self._clock()
+        return now - now % CCLK_PER_MCLK + CCLK_PER_MCLK
+
+    def read(self, address):
+        edge = self._mclk()
+        self._catch_up(edge - 1)
+        a = address & 0x3f
+        if a < 0x06:
+            data = (self.cxr >> (2 * a) & 0x03) << 6
+        elif a == 0x06:
+            data = (self.cxr >> 12 & 0x01) << 7
+        elif a == 0x07:
+            data = (self.cxr >> 13 & 0x03) << 6
+        elif a < 0x0c:
+            data = 0x00 if self.vblank & 0x80 else \
+                (self.inpt >> (a - 0x08) & 0x01) << 7
+        elif a < 0x0e:
+            inptl = self._ilatch if self.vblank & 0x40 else self.inpt >> 4
+            data = (inptl >> (a - 0x0c) & 0x01) << 7
+        else:
+            data = 0x00
+        self.d_out = data
+        return data
+
+    def write(self, address, data):
+        edge = self._mclk()
+        a = address & 0x3f
+        if a == WSYNC:
+            # RDY is low from the first color clock of the access up to
+            # the one after the next hcount 0
+            self._wsync = (edge - (CCLK_PER_MCLK - 1),
+                           edge + (-self._hcount(edge)) % LINE + 1)
+            return
+        if a == RSYNC:
+            # hcount is held at 0 for all color clocks of the access
+            self._line_prev, self._line = self._line, edge
+            edge -= CCLK_PER_MCLK - 1
+            start, release = self._wsync
+            self._wsync = (start, max(start, min(release, edge + 1)))
+        elif a == VBLANK and data & 0x40:
+            self._ilatch = self.inpt >> 4 & 0x03
+        self._writes.append((edge, a, data))
+
+    # Rendering
+
+    def _catch_up(self, edge):
+        count = 0
+        for write in self._writes:
+            if write[0] > edge:
+                break
+            self._advance(write[0] - 1)
+            self._apply(*write)
+            count += 1
+        del self._writes[:count]
+        self._advance(edge)
+
+    def _apply(self, edge, a, data):
+        if a in REGISTERS:
+            name, bit = REGISTERS[a]
+            setattr(self, name, data if bit is None else int(data & bit != 0))
+        elif a in RESETS:
+            name, offset = RESETS[a]
+            hcount = (self._edge - self._origin) % LINE
+            setattr(self, name, offset if hcount < HBLANK else
+                    hcount - HBLANK)
+        elif a == HMOVE:
+            for pos, hm in MOTIONS:
+                motion = getattr(self, hm) >> 4 | (0xf0 if getattr(
+                    self, hm) & 0x80 else 0x00)
+                setattr(self, pos, (getattr(self, pos) - motion & 0xff) %
+                        WIDTH)
+        elif a == HMCLR:
+            for _, hm in MOTIONS:
+                setattr(self, hm, 0)
+        elif a == CXCLR:
+            # Latches are held clear from the next color clock
+            self.cxclr = 1
+        elif a == RSYNC:
+            if not self.cxclr:
+                self.cxr |= self._pending
+            self._pending = 0
+            self._edge = self._origin = edge + CCLK_PER_MCLK - 1
+            self._delay()
+
+    def _delay(self):
+        # GRP0D, GRP1D and ENABLD are loaded at the edge after hcount 0
+        if self._delayed != self._edge:
+            self.grp0d, self.grp1d, self.enabld = \
+                self.grp0, self.grp1, self.enabl
+            self._delayed = self._edge
+
+    def _advance(self, edge):
+        while self._edge < edge:
+            hcount = (self._edge - self._origin) % LINE
+            if hcount == 0:
+                self._delay()
+            stop = min(edge, self._edge + LINE - hcount)
+            self._render(hcount, stop - self._edge)
+            self._edge = stop
+        if (self._edge - self._origin) % LINE == 0:
+            self._delay()
+
+    def _line_code(self):
+        """Return objects of each visible pixel as P0|P1|M0|M1|BL|PF"""
+        refp0, refp1 = self.refp0, self.refp1
+        grp0 = self.grp0d if self.vdelp0 else self.grp0
+        grp1 = self.grp1d if self.vdelp1 else self.grp1
+        posm0 = self.posp0 if self.resmp0 else self.posm0
+        posm1 = self.posp1 if self.resmp1 else self.posm1
+        key = (self.posp0, REVERSE8[grp0] if refp0 else grp0,
+               self.posp1, REVERSE8[grp1] if refp1 else grp1,
+               self.nusiz0, self.nusiz1, posm0 if self.enam0 else None,
+               posm1 if self.enam1 else None,
+               self.posbl if (self.enabld if self.vdelbl else self.enabl)
+               else None,
+               self.ctrlpf & 0x31, self.pf0 >> 4, self.pf1, self.pf2)
+        code = self._lines.get(key)
+        if code is not None:
+            return code
+
+        posp0, gr0, posp1, gr1, nusiz0, nusiz1, posm0, posm1, posbl, \
+            ctrlpf, _, _, _ = key
+        code = _object_row(posp0, gr0, nusiz0 & 0x07) | \
+            _object_row(posp1, gr1, nusiz1 & 0x07) << 1
+        if posm0 is not None:
+            code |= _object_row(posm0, WIDTHS[nusiz0 >> 4 & 0x03],
+                                nusiz0 & 0x07) << 2
+        if posm1 is not None:
+            code |= _object_row(posm1, WIDTHS[nusiz1 >> 4 & 0x03],
+                                nusiz1 & 0x07) << 3
+        if posbl is not None:
+            code |= _object_row(posbl, WIDTHS[ctrlpf >> 4 & 0x03], 0) << 4
+        pf = self.pf2 << 12 | REVERSE8[self.pf1] << 4 | self.pf0 >> 4
+        code |= ((pf >> _PF_BITS[ctrlpf & 0x01] & 1) << 5).astype(
+            numpy.uint8)
+        if len(self._lines) >= _CACHE_SIZE:
+            self._lines.clear()
+        self._lines[key] = code
+        return code
+
+    def _colors(self, code, start, stop):
+        score = self.ctrlpf & 0x02
+        palette = numpy.array([
+            [self.colubk, self.colup0, self.colup1, self.colupf,
+             self.colup0 if score else self.colupf],
+            [self.colubk, self.colup0, self.colup1, self.colupf,
+             self.colup1 if score else self.colupf]], dtype=numpy.uint8)
+        sources = _SOURCES[1 if self.ctrlpf & 0x04 else 0][code[start:stop]]
+        return palette[_RIGHT[start:stop], sources] & 0xfe
+
+    def _render(self, hcount, count):
+        # Color clocks from hcount + 1 on with the current registers
+        start = max(hcount + 1, HBLANK)
+        stop = min(hcount + count, LINE - 1) + 1
+        pending = self._pending
+        self._pending = 0
+        if self.cxclr:
+            self.cxr = pending = 0
+        if start >= stop:
+            self.cxr |= pending
+            return
+
+        code = self._line_code()
+        start, stop = start - HBLANK, stop - HBLANK
+        if not self.cxclr:
+            cx = _CX[code[start:stop]]
+            if stop + HBLANK - hcount - 1 == count:
+                # Collisions of the last color clock are latched later
+                self._pending = int(cx[-1])
+                cx = cx[:-1]
+            self.cxr |= pending | int(numpy.bitwise_or.reduce(cx)) \
+                if len(cx) else pending
+        self._draw(self._colors(code, start, stop))
+
+    def _draw(self, colors):
+        screen = self.screen.reshape(-1)
+        while len(colors):
+            count = min(len(colors), len(screen) - self._pixel)
+            screen[self._pixel:self._pixel + count] = colors[:count]
+            colors = colors[count:]
+            self._pixel += count
+            if self._pixel == len(screen):
+                self._pixel = 0
+                self.frames += 1
+                if self.on_frame is not None:
+                    self.on_frame(self.screen)
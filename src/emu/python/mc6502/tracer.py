@@ -0,0 +1,138 @@
+import array
+import functools
+import struct
+import sys
+
+from mc6502.controller import STATES
+from mc6502.decoder import InstructionDecoder
+
+# Dump layout: magic, version, number of records and cycle of the first
+# record, followed by each field of the records in chronological order
+TRACE_MAGIC = b'M6502T'
+TRACE_VERSION = 1
+TRACE = struct.Struct('<6sBIQ')
+
+# Record fields and their array type codes; the cycle of a record is not
+# stored since the records are consecutive cycles
+FIELDS = (
+    ('address', 'H'), ('data', 'B'), ('write', 'B'),
+    ('pc', 'H'), ('state', 'B'), ('ir', 'B'),
+)
+
+
+def _tobytes(a):
+    if sys.byteorder != 'little':
+        a = array.array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes() if hasattr(a, 'tobytes') else a.tostring()
+
+
+def _frombytes(typecode, data):
+    a = array.array(typecode)
+    if hasattr(a, 'frombytes'):
+        a.frombytes(data)
+    else:
+        a.fromstring(data)
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a
+
+
+class Tracer(object):
+    """Ring buffer of the last `size` bus cycles
+
+    Each record holds the bus address, the data read or written, the
+    read/write signal, PC, the index of the controller state in `STATES`
+    and the instruction register. Cycles halted by RDY hold the address,
+    PC and state of the halted read with no data. `attach` and `detach`
+    swap the run loop of one MPU instance as `Profile` does.
+    """
+
+    def __init__(self, size=0x100000):
+        self.size = size
+        self.clear()
+
+    def clear(self):
+        for name, typecode in FIELDS:
+            setattr(self, name, array.array(typecode, [0]) * self.size)
+        self.cycles = 0
+        self.head = 0
+
+    def __len__(self):
+        return min(self.cycles, self.size)
+
+    def attach(self, mpu):
+        """Record the cycles run by `mpu` from now on"""
+        mpu.run = functools.partial(mpu.run_probed, self._record)
+
+    def detach(self, mpu):
+        mpu.__dict__.pop('run', None)
+
+    def _record(self, count, state, pc, ir, address, data, write):
+        # Probe of `MPU.run_probed`, halted cycles have no data
+        size, head = self.size, self.head
+        n = min(count, size)
+        index = (head + count - n) % size
+        for _ in range(n):
+            self.address[index], self.data[index], self.write[index] = \
+                address, data or 0x00, write
+            self.pc[index], self.state[index], self.ir[index] = \
+                pc, state, ir
+            index += 1
+            if index == size:
+                index = 0
+        self.head = index
+        self.cycles += count
+
+    def _order(self, a):
+        # Field array in chronological order
+        if self.cycles < self.size:
+            return a[:self.cycles]
+        return a[self.head:] + a[:self.head]
+
+    def records(self):
+        """Yield tuples (cycle, address, data, write, pc, state, ir) from
+        the oldest record"""
+        start = self.cycles - len(self)
+        fields = [self._order(getattr(self, name)) for name, _ in FIELDS]
+        for i, record in enumerate(zip(*fields)):
+            yield (start + i,) + record
+
+    def lines(self):
+        """Yield the records in the text format of the controller and the
+        datapath"""
+        decoder = InstructionDecoder()
+        for cycle, address, data, write, pc, state, ir in self.records():
+            yield '{:10} OPCODE={}(0x{:02x}) STATE={} RW={} ' \
+                'PC=0x{:04x} AB=0x{:04x} DB=0x{:02x}'.format(
+                    cycle, decoder(ir)[0], ir, STATES[state],
+                    'w' if write else 'r', pc, address, data)
+
+    def dump(self, filename):
+        """Write the records into a binary file"""
+        with open(filename, 'wb') as f:
+            f.write(TRACE.pack(TRACE_MAGIC, TRACE_VERSION, len(self),
+                               self.cycles - len(self)))
+            for name, _ in FIELDS:
+                f.write(_tobytes(self._order(getattr(self, name))))
+
+    @classmethod
+    def load(cls, filename):
+        """Return a tracer holding the records of a `dump` file"""
+        with open(filename, 'rb') as f:
+            magic, version, count, start = TRACE.unpack(f.read(TRACE.size))
+            assert (magic, version) == (TRACE_MAGIC, TRACE_VERSION), \
+                'unknown trace {}'.format((magic, version))
+            tracer = cls(max(count, 1))
+            for name, typecode in FIELDS:
+                itemsize = array.array(typecode).itemsize
+                data = _frombytes(typecode, f.read(count * itemsize))
+                getattr(tracer, name)[:count] = data
+        if count:
+            tracer.cycles = start + count
+        return tracer
+
+
+if __name__ == '__main__':
+    for line in Tracer.load(sys.argv[1]).lines():
+        print(line)
@@ -0,0 +1,484 @@
+import numpy
+
+from mc6502.alu import TableALU, LUT_LAYOUT, LUT_AC, LUT_AB, LUT_ABCD
+from mc6502.controller import execute_control, FLAG_OPERATION, \
+    T1_FETCH_OPERAND
+from mc6502.decoder import InstructionDecoder
+
+# Faults stopping a lane, in the same exceptions as the cycle accurate MPU
+FAULT_NONE, FAULT_ILLEGAL, FAULT_ASSERT = 0, 1, 2
+FAULTS = {FAULT_ILLEGAL: KeyError, FAULT_ASSERT: AssertionError}
+
+MODES = (
+    'acc', 'imm', 'impl', 'zpg', 'zpgx', 'zpgy', 'abs', 'absx', 'absy',
+    'ind', 'indx', 'indy', 'rel',
+)
+CTRLS = tuple(ctrl for ctrl, _, _ in LUT_LAYOUT)
+REGS = ('-', 'a', 'x', 'y', 's', 't', 'p')
+
+STR_OPS = ('STA', 'STX', 'STY')
+RMW_OPS = ('ASL', 'DEC', 'INC', 'LSR', 'ROL', 'ROR')
+BRANCHES = {
+    # op     mask  taken if set
+    'BCC': (0x01, False), 'BCS': (0x01, True),
+    'BNE': (0x02, False), 'BEQ': (0x02, True),
+    'BVC': (0x40, False), 'BVS': (0x40, True),
+    'BPL': (0x80, False), 'BMI': (0x80, True),
+}
+
+
+def _opcode_table():
+    """Return dict of per opcode arrays indexed by the opcode"""
+    decoder = InstructionDecoder()
+    names = decoder.name
+    table = dict((key, numpy.zeros(0x100, dtype=numpy.int64)) for key in [
+        'legal', 'op', 'mode', 'src', 'dst', 'ctrl', 'p_mask', 'p_set',
+        'p_clr', 'str', 'rmw', 'shift', 'rmw_ctrl', 'branch_mask',
+        'branch_set', 'index'])
+    table['names'] = names
+    for opcode in range(0x100):
+        op_name, addr_mode, _ = decoder(opcode)
+        if op_name is None:
+            continue
+        src, dst, ctrl = execute_control(op_name, addr_mode)
+        mask, operation = FLAG_OPERATION.get(op_name, (0x00, None))
+        rmw_src, rmw_dst, rmw_ctrl = execute_control(op_name, None)
+        branch_mask, branch_set = BRANCHES.get(op_name, (0x00, False))
+        row = {
+            'legal': 1, 'op': names.index(op_name),
+            'mode': MODES.index(addr_mode),
+            'src': REGS.index(src) if src in REGS else 0,
+            'dst': REGS.index(dst) if dst in REGS else 0,
+            'ctrl': CTRLS.index(ctrl), 'p_mask': mask,
+            'p_set': operation == 'set', 'p_clr': operation == 'clr',
+            'str': REGS.index(op_name[-1].lower()) if op_name in STR_OPS
+            else 0,
+            'rmw': op_name in RMW_OPS,
+            'shift': op_name in RMW_OPS and
+            not (rmw_src == 't' and rmw_dst == 't'),
+            'rmw_ctrl': CTRLS.index(rmw_ctrl),
+            'branch_mask': branch_mask, 'branch_set': branch_set,
+            'index': REGS.index('y') if addr_mode in ['zpgy', 'absy']
+            else REGS.index('x'),
+        }
+        for key, value in row.items():
+            table[key][opcode] = value
+    return table
+
+
+class VectorMPU(object):
+    """Instruction level MPU running many independent lanes at once
+
+    Each lane has its own registers and 64KiB memory held in NumPy arrays,
+    and `step` advances every running lane by one instruction with the
+    same results and cycles as `FastMPU.step` (and so as the cycle
+    accurate MPU). A lane stopped by an illegal opcode or an assertion of
+    the MPU keeps its fault code in `fault` and is not advanced any more.
+
+    Lanes are loaded from and saved to an MPU at an instruction boundary
+    (controller state T1_fetch_operand).
+    """
+
+    _opcodes = None
+
+    def __init__(self, lanes, cache=None):
+        self.lanes = lanes
+        zeros = lambda: numpy.zeros(lanes, dtype=numpy.int64)
+        self.a, self.x, self.y, self.s = zeros(), zeros(), zeros(), zeros()
+        self.p, self.t, self.ir, self.pc = zeros(), zeros(), zeros(), zeros()
+        self.cycles = zeros()
+        self.instructions = zeros()
+        self.fault = numpy.zeros(lanes, dtype=numpy.int8)
+        self.memory = numpy.zeros((lanes, 0x10000), dtype=numpy.uint8)
+
+        if VectorMPU._opcodes is None:
+            VectorMPU._opcodes = _opcode_table()
+        self._op = VectorMPU._opcodes
+
+        # ALU tables of TableALU concatenated in the order of LUT_LAYOUT
+        lut = TableALU(cache=cache)._lut
+        offset, rets, flags = 0, [], []
+        self._alu_offset = numpy.zeros(len(CTRLS), dtype=numpy.int64)
+        self._alu_layout = numpy.zeros(len(CTRLS), dtype=numpy.int64)
+        self._alu_mask = numpy.zeros(len(CTRLS), dtype=numpy.int64)
+        for c, ctrl in enumerate(CTRLS):
+            layout, ret, flag, mask = lut[ctrl]
+            self._alu_offset[c] = offset
+            self._alu_layout[c] = layout
+            self._alu_mask[c] = mask
+            rets.append(numpy.frombuffer(bytes(ret), dtype=numpy.uint8))
+            flags.append(numpy.frombuffer(bytes(flag), dtype=numpy.uint8))
+            offset += len(ret)
+        self._alu_ret = numpy.concatenate(rets).astype(numpy.int64)
+        self._alu_flag = numpy.concatenate(flags).astype(numpy.int64)
+
+        self._modes = [
+            self._acc, self._imm, self._impl, self._zpg, self._zpgi,
+            self._zpgi, self._abs, self._absi, self._absi, self._ind,
+            self._indx, self._indy, self._rel,
+        ]
+
+    def load(self, lane, mpu, memory):
+        """Copy registers of `mpu` and `memory` into the lane"""
+        assert mpu.controller._state == T1_FETCH_OPERAND, \
+            'MPU is not at an instruction boundary'
+        dp = mpu.datapath
+        self.a[lane], self.x[lane], self.y[lane] = \
+            dp.a.data, dp.x.data, dp.y.data
+        self.s[lane], self.p[lane], self.t[lane] = \
+            dp.s.data, dp.p.data, dp.t.data
+        self.ir[lane], self.pc[lane] = dp.ir.data, dp.pc
+        self.memory[lane] = memory.array()
+        self.fault[lane] = FAULT_NONE
+
+    def save(self, lane, mpu, memory):
+        """Copy the lane into registers of `mpu` and `memory`"""
+        dp = mpu.datapath
+        dp.a(int(self.a[lane]))
+        dp.x(int(self.x[lane]))
+        dp.y(int(self.y[lane]))
+        dp.s(int(self.s[lane]))
+        dp.p(int(self.p[lane]))
+        dp.t(int(self.t[lane]))
+        dp.ir(int(self.ir[lane]))
+        pc = int(self.pc[lane])
+        dp.pcl(pc & 0xff)
+        dp.pch(pc >> 8)
+        dp.abl(pc & 0xff)
+        dp.abh(pc >> 8)
+        memory.array()[:] = self.memory[lane]
+        if hasattr(mpu, 'flush'):
+            # Decoded instructions do not see the copy
+            mpu.flush()
+
+        opcode = int(self.ir[lane])
+        controller = mpu.controller
+        controller._state = T1_FETCH_OPERAND
+        controller._decode(opcode)
+
+    def step(self):
+        """Execute one instruction on every running lane and return the
+        array of the number of cycles"""
+        op = self._op
+        self._cycle = numpy.zeros(self.lanes, dtype=numpy.int64)
+        self._ab = numpy.zeros(self.lanes, dtype=numpy.int64)
+        self._rts = numpy.zeros(self.lanes, dtype=bool)
+
+        running = self.fault == FAULT_NONE
+        illegal = running & (op['legal'][self.ir] == 0)
+        self.fault[illegal] = FAULT_ILLEGAL
+        running &= ~illegal
+
+        mode = op['mode'][self.ir]
+        for m, handler in enumerate(self._modes):
+            lanes = numpy.nonzero(running & (mode == m))[0]
+            if len(lanes):
+                self._cycle[lanes] += handler(lanes)
+
+        lanes = numpy.nonzero(running & (self.fault == FAULT_NONE))[0]
+        self._execute(lanes)
+        self._fetch(lanes)
+        self._cycle[self.fault != FAULT_NONE] = 0
+        self.cycles += self._cycle
+        self.instructions[lanes] += 1
+        return self._cycle
+
+    def run(self, instructions):
+        """Execute instructions on every running lane and return the array
+        of the number of cycles"""
+        cycles = numpy.zeros(self.lanes, dtype=numpy.int64)
+        for _ in range(instructions):
+            cycles += self.step()
+        return cycles
+
+    # Memory and ALU of lanes
+
+    def _read(self, lanes, addr):
+        return self.memory[lanes, addr].astype(numpy.int64)
+
+    def _write(self, lanes, addr, data):
+        self.memory[lanes, addr] = data
+
+    def _alu(self, ctrl, a, b, p):
+        """Return tuple (result, Processor Status Register); `ctrl` is an
+        index of CTRLS or an array of them"""
+        layout = self._alu_layout[ctrl]
+        i = a + numpy.where(layout >= LUT_AB, b << 8, 0)
+        i += numpy.where(layout == LUT_AC, (p & 0x01) << 8, 0)
+        i += numpy.where(layout == LUT_ABCD,
+                         ((p & 0x01) << 16) | ((p & 0x08) << 14), 0)
+        i += self._alu_offset[ctrl]
+        p = (p & ~self._alu_mask[ctrl]) | self._alu_flag[i]
+        return self._alu_ret[i], p
+
+    def _alu_op(self, lanes, a, b, ctrl):
+        """ALU operation updating Processor Status Register"""
+        ret, self.p[lanes] = self._alu(CTRLS.index(ctrl), a, b,
+                                       self.p[lanes])
+        return ret
+
+    def _reg(self, lanes, reg):
+        """Return values of the register index `reg` per lane"""
+        ret = numpy.zeros(len(lanes), dtype=numpy.int64)
+        for r, name in enumerate(REGS):
+            if r == 0:
+                continue
+            select = reg == r
+            if select.any():
+                ret[select] = getattr(self, name)[lanes[select]]
+        return ret
+
+    # Instruction steps
+
+    def _fetch(self, lanes):
+        """T0: fetch next opcode"""
+        addr = numpy.where(
+            self._rts[lanes], self._ab[lanes], self.pc[lanes])
+        self.ir[lanes] = self._read(lanes, addr)
+        self.pc[lanes] = (self.pc[lanes] + 1) & 0xffff
+
+    def _execute(self, lanes):
+        """T0: execute the instruction with the fetched data"""
+        op, ir = self._op, self.ir[lanes]
+        dst = op['dst'][ir]
+        a = self._reg(lanes, op['src'][ir])
+        ret, p = self._alu(op['ctrl'][ir], a, self.t[lanes], self.p[lanes])
+        for name in ['a', 'x', 'y', 's']:
+            select = dst == REGS.index(name)
+            getattr(self, name)[lanes[select]] = ret[select]
+
+        mask = op['p_mask'][ir]
+        p = numpy.where(op['p_set'][ir] == 1, self.p[lanes] | mask, p)
+        p = numpy.where(op['p_clr'][ir] == 1, self.p[lanes] & ~mask, p)
+        p = numpy.where(dst == REGS.index('p'), self.t[lanes], p)
+        self.p[lanes] = p
+
+    def _operand(self, lanes):
+        """T1: fetch operand and increment PC"""
+        self.t[lanes] = self._read(lanes, self.pc[lanes])
+        self.pc[lanes] = (self.pc[lanes] + 1) & 0xffff
+        return self.t[lanes]
+
+    def _access(self, lanes, addr):
+        """Tx: fetch, modify and write data at the effective address"""
+        op, ir = self._op, self.ir[lanes]
+        cycles = numpy.ones(len(lanes), dtype=numpy.int64)
+        store = op['str'][ir] != 0
+        if store.any():
+            ls = lanes[store]
+            self._write(ls, addr[store], self._reg(ls, op['str'][ir][store]))
+        load = ~store
+        if not load.any():
+            return cycles
+        lanes, addr, ir = lanes[load], addr[load], ir[load]
+        self.t[lanes] = self._read(lanes, addr)
+
+        shift = op['shift'][ir] == 1
+        self.fault[lanes[shift]] = FAULT_ASSERT
+        rmw = (op['rmw'][ir] == 1) & ~shift
+        if rmw.any():
+            lr, ar = lanes[rmw], addr[rmw]
+            self._write(lr, ar, self.t[lr])
+            self.t[lr], self.p[lr] = self._alu(
+                op['rmw_ctrl'][ir[rmw]], self.t[lr], self.t[lr], self.p[lr])
+            self._write(lr, ar, self.t[lr])
+            cycles[numpy.nonzero(load)[0][rmw]] = 3
+        return cycles
+
+    def _index_carry(self, lanes, bah, adl):
+        """Tx_fetch_data_c0: add carry to the base address high"""
+        op, ir = self._op, self.ir[lanes]
+        carry = self.p[lanes] & 0x01
+        adh = self._alu_op(lanes, bah, 0x00, 'adc')
+        store = op['str'][ir] != 0
+        cross = (carry == 1) | (op['rmw'][ir] == 1)
+        cycles = numpy.ones(len(lanes), dtype=numpy.int64)
+
+        # Stores are not written after the page crossing
+        select = cross & store
+        ls = lanes[select]
+        self.t[ls] = self._read(ls, (adh[select] << 8) | adl[select])
+        cycles[select] = 2
+
+        select = cross & ~store
+        if select.any():
+            cycles[select] = 1 + self._access(
+                lanes[select], (adh[select] << 8) | adl[select])
+
+        select = ~cross & store
+        if select.any():
+            cycles[select] = 1 + self._access(
+                lanes[select], (bah[select] << 8) | adl[select])
+
+        select = ~cross & ~store
+        ls = lanes[select]
+        self.t[ls] = self._read(ls, (bah[select] << 8) | adl[select])
+        return cycles
+
+    def _select(self, lanes, names):
+        """Return boolean array of lanes executing one of `names`"""
+        ops = [self._op['names'].index(name) for name in names]
+        return numpy.isin(self._op['op'][self.ir[lanes]], ops)
+
+    # Addressing modes
+
+    def _acc(self, lanes):
+        self._operand(lanes)
+        return 2
+
+    def _imm(self, lanes):
+        self._operand(lanes)
+        return 2
+
+    def _impl(self, lanes):
+        self.t[lanes] = self._read(lanes, self.pc[lanes])
+        cycles = numpy.full(len(lanes), 2, dtype=numpy.int64)
+
+        select = self._select(lanes, ['PHA', 'PHP'])
+        if select.any():
+            ls = lanes[select]
+            pha = self._select(ls, ['PHA'])
+            self._write(ls, 0x0100 | self.s[ls],
+                        numpy.where(pha, self.a[ls], self.p[ls]))
+            self.s[ls] = (self.s[ls] - 1) & 0xff
+            cycles[select] = 3
+
+        select = self._select(lanes, ['PLA', 'PLP'])
+        if select.any():
+            ls = lanes[select]
+            self.s[ls] = (self.s[ls] + 1) & 0xff
+            self.t[ls] = self._read(ls, 0x0100 | self.s[ls])
+            cycles[select] = 4
+
+        select = self._select(lanes, ['BRK'])
+        if select.any():
+            ls = lanes[select]
+            self._write(ls, 0x0100 | self.s[ls], self.pc[ls] >> 8)
+            self.s[ls] = self._alu_op(ls, self.s[ls], 0x00, 'dec')
+            self._write(ls, 0x0100 | self.s[ls], self.pc[ls] & 0xff)
+            self.s[ls] = self._alu_op(ls, self.s[ls], 0x00, 'dec')
+            self._write(ls, 0x0100 | self.s[ls], self.p[ls])
+            self.s[ls] = self._alu_op(ls, self.s[ls], 0x00, 'dec')
+            vector = numpy.full(len(ls), 0xfffe, dtype=numpy.int64)
+            self.t[ls] = self._read(ls, vector)
+            self.pc[ls] = (self._read(ls, vector + 1) << 8) | self.t[ls]
+            cycles[select] = 7
+
+        select = self._select(lanes, ['RTI'])
+        if select.any():
+            ls = lanes[select]
+            self.s[ls] = (self.s[ls] + 1) & 0xff
+            self.p[ls] = self._read(ls, 0x0100 | self.s[ls])
+            self.s[ls] = (self.s[ls] + 1) & 0xff
+            pcl = self._read(ls, 0x0100 | self.s[ls])
+            self.s[ls] = (self.s[ls] + 1) & 0xff
+            self.pc[ls] = (self._read(ls, 0x0100 | self.s[ls]) << 8) | pcl
+            cycles[select] = 6
+
+        select = self._select(lanes, ['RTS'])
+        if select.any():
+            ls = lanes[select]
+            self.s[ls] = (self.s[ls] + 1) & 0xff
+            pcl = self._read(ls, 0x0100 | self.s[ls])
+            self.s[ls] = (self.s[ls] + 1) & 0xff
+            pch = self._read(ls, 0x0100 | self.s[ls])
+            self.pc[ls] = (((pch << 8) | pcl) + 1) & 0xffff
+            # Address bus high is not updated by the increment
+            self._ab[ls] = (pch << 8) | (self.pc[ls] & 0xff)
+            self._rts[ls] = True
+            cycles[select] = 6
+        return cycles
+
+    def _zpg(self, lanes):
+        adl = self._operand(lanes)
+        return 2 + self._access(lanes, adl)
+
+    def _zpgi(self, lanes):
+        bal = self._operand(lanes)
+        index = self._reg(lanes, self._op['index'][self.ir[lanes]])
+        adl = self._alu_op(lanes, index, bal, 'adc')
+        return 3 + self._access(lanes, adl)
+
+    def _abs(self, lanes):
+        adl = self._operand(lanes)
+        cycles = numpy.zeros(len(lanes), dtype=numpy.int64)
+
+        select = self._select(lanes, ['JSR'])
+        if select.any():
+            ls = lanes[select]
+            self._write(ls, 0x0100 | self.s[ls], self.pc[ls] >> 8)
+            self.s[ls] = (self.s[ls] - 1) & 0xff
+            self._write(ls, 0x0100 | self.s[ls], self.pc[ls] & 0xff)
+            self.s[ls] = (self.s[ls] - 1) & 0xff
+            self.pc[ls] = (self._read(ls, self.pc[ls]) << 8) | adl[select]
+            cycles[select] = 6
+
+        rest = ~select
+        ls, adl = lanes[rest], adl[rest]
+        adh = self._read(ls, self.pc[ls])
+        self.pc[ls] = (self.pc[ls] + 1) & 0xffff
+
+        jmp = self._select(ls, ['JMP'])
+        self.pc[ls[jmp]] = (adh[jmp] << 8) | adl[jmp]
+        sub = numpy.nonzero(rest)[0]
+        cycles[sub[jmp]] = 3
+        if (~jmp).any():
+            cycles[sub[~jmp]] = 3 + self._access(
+                ls[~jmp], (adh[~jmp] << 8) | adl[~jmp])
+        return cycles
+
+    def _absi(self, lanes):
+        bal = self._operand(lanes)
+        bah = self._read(lanes, self.pc[lanes])
+        self.pc[lanes] = (self.pc[lanes] + 1) & 0xffff
+        index = self._reg(lanes, self._op['index'][self.ir[lanes]])
+        adl = self._alu_op(lanes, index, bal, 'adc')
+        return 3 + self._index_carry(lanes, bah, adl)
+
+    def _ind(self, lanes):
+        ial = self._operand(lanes)
+        iah = self._read(lanes, self.pc[lanes])
+        self.pc[lanes] = (self.pc[lanes] + 1) & 0xffff
+        adl = self._read(lanes, (iah << 8) | ial)
+        ial = self._alu_op(lanes, ial, 0x00, 'inc')
+        adh = self._read(lanes, (iah << 8) | ial)
+        self.t[lanes] = adl
+        self.pc[lanes] = (adh << 8) | adl
+        return 5
+
+    def _indx(self, lanes):
+        bal = self._operand(lanes)
+        zpa = self._alu_op(lanes, self.x[lanes], bal, 'adc')
+        adl = self._read(lanes, zpa)
+        zpa = self._alu_op(lanes, zpa, 0x00, 'inc')
+        adh = self._read(lanes, zpa)
+        return 5 + self._access(lanes, (adh << 8) | adl)
+
+    def _indy(self, lanes):
+        ial = self._operand(lanes)
+        bal = self._read(lanes, ial)
+        ial = self._alu_op(lanes, ial, 0x00, 'inc')
+        bah = self._read(lanes, ial)
+        adl = self._alu_op(lanes, self.y[lanes], bal, 'adc')
+        return 4 + self._index_carry(lanes, bah, adl)
+
+    def _rel(self, lanes):
+        op, ir = self._op, self.ir[lanes]
+        flag = (self.p[lanes] & op['branch_mask'][ir]) != 0
+        taken = (op['branch_mask'][ir] != 0) & \
+            (flag == (op['branch_set'][ir] == 1))
+        offset = self._read(lanes, self.pc[lanes])
+        self.t[lanes] = offset
+        cycles = numpy.full(len(lanes), 2, dtype=numpy.int64)
+
+        ls = lanes[~taken]
+        self.pc[ls] = (self.pc[ls] + 1) & 0xffff
+
+        # Relative address is added to PCL and carried to PCH in next cycle
+        ls, offset = lanes[taken], offset[taken]
+        dst = (self.pc[ls] & 0xff) + 1 + offset
+        pch = (self.pc[ls] >> 8) + (dst >> 8)
+        self.fault[ls[pch > 0xff]] = FAULT_ASSERT
+        self.pc[ls] = ((pch << 8) | (dst & 0xff)) & 0xffff
+        cycles[taken] = 3 + (dst >> 8)
+        return cycles
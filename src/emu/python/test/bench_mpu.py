@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import platform
+import subprocess
+import time
+
+from test_common import *
+from mc6502.decoder import InstructionDecoder
+from mc6502.fastmpu import FastMPU
+from mc6502.blockmpu import BlockMPU
+
+
+ENGINES = {
+    'mpu': (MPU, {}),
+    'precompiled': (MPU, {'precompiled': True}),
+    'lut': (MPU, {'precompiled': True, 'lut': True}),
+    'fast': (FastMPU, {}),
+    'block': (BlockMPU, {}),
+}
+
+# Benchmark programs are placed at ORIGIN and repeat the instruction under
+# test REPEAT times before jumping back
+ORIGIN = 0x0200
+REPEAT = 16
+
+# Operand bytes and index registers of each addressing mode; starred modes
+# cross the page boundary and '+d' modes run in decimal mode
+OPERANDS = {
+    'acc': ([], {}),
+    'impl': ([], {}),
+    'imm': ([0x11], {}),
+    'zpg': ([0x80], {}),
+    'zpgx': ([0x70], {'x': 0x10}),
+    'zpgy': ([0x70], {'y': 0x10}),
+    'abs': ([0x00, 0x03], {}),
+    'absx': ([0x00, 0x03], {'x': 0x10}),
+    'absx*': ([0xf8, 0x03], {'x': 0x10}),
+    'absy': ([0x00, 0x03], {'y': 0x10}),
+    'absy*': ([0xf8, 0x03], {'y': 0x10}),
+    'indx': ([0x80], {'x': 0x10}),
+    'indy': ([0xa0], {'y': 0x10}),
+    'indy*': ([0xa2], {'y': 0x10}),
+}
+
+# Zero page pointers for 'indx' ($90) and 'indy'/'indy*' ($a0/$a2)
+POINTERS = {0x0090: 0x00, 0x0091: 0x03, 0x00a0: 0x00, 0x00a1: 0x03,
+            0x00a2: 0xf8, 0x00a3: 0x03}
+
+# Flags making each branch taken
+TAKEN = {
+    'BCC': 0x00, 'BCS': 0x01, 'BEQ': 0x02, 'BNE': 0x00,
+    'BMI': 0x80, 'BPL': 0x00, 'BVC': 0x00, 'BVS': 0x40, 'BRA': 0x00,
+}
+
+
+def jmp(address):
+    return [0x4c, address & 0xff, address >> 8]
+
+def program(opcode, name, mode):
+    """Return list of (case, image, registers) benchmarking `opcode`"""
+    loop = jmp(ORIGIN)
+    if name in ['BRK', 'RTI']:
+        # BRK into a handler returning by RTI
+        mem = set_mem([], {0xfffe: 0x00, 0xffff: 0x04, 0x0400: 0x40})
+        mem[ORIGIN:ORIGIN + 5] = bytearray([0x00, 0xea] + loop)
+        return [(mode, mem, set_reg(pc=ORIGIN))]
+    if name in ['JSR', 'RTS']:
+        # JSR into a subroutine returning by RTS
+        mem = set_mem([], {0x0300: 0x60})
+        mem[ORIGIN:ORIGIN + 6] = bytearray([0x20, 0x00, 0x03] + loop)
+        return [(mode, mem, set_reg(pc=ORIGIN))]
+    if name == 'JMP':
+        # JMP onto itself
+        operand = [0x00, 0x04] if mode == 'ind' else [ORIGIN & 0xff,
+                                                      ORIGIN >> 8]
+        mem = set_mem([], {0x0400: ORIGIN & 0xff, 0x0401: ORIGIN >> 8})
+        mem[ORIGIN:ORIGIN + 3] = bytearray([opcode] + operand)
+        return [(mode, mem, set_reg(pc=ORIGIN))]
+
+    if mode == 'rel':
+        # Zero offset branches to the next instruction either way; 'rel*'
+        # is taken and spends the extra cycle
+        cases = [('rel', [0x00], {'p': TAKEN[name] ^ 0xc3}),
+                 ('rel*', [0x00], {'p': TAKEN[name]})]
+    else:
+        modes = [mode]
+        if mode in ['absx', 'absy', 'indy']:
+            modes.append(mode + '*')
+        cases = [(m, OPERANDS[m][0], OPERANDS[m][1]) for m in modes]
+        if name in ['ADC', 'SBC']:
+            cases += [(m + '+d', operand, dict(reg, p=0x08))
+                      for m, operand, reg in cases]
+
+    ret = []
+    for case, operand, reg in cases:
+        code = [opcode] + operand
+        mem = set_mem([], POINTERS)
+        mem[ORIGIN:ORIGIN + len(code) * REPEAT + 3] = \
+            bytearray(code * REPEAT + loop)
+        ret.append((case, mem, set_reg(pc=ORIGIN, **reg)))
+    return ret
+
+def bench(engine, opcode, name, mode, cycles):
+    """Return list of results of benchmarking `opcode` on `engine`"""
+    cls, kw = ENGINES[engine]
+    ret = []
+    for case, imem, reg in program(opcode, name, mode):
+        result = {'opcode': opcode, 'name': name, 'mode': case}
+        mem = Memory(imem)
+        mpu = cls(**kw)
+        load_reg(mpu, reg)
+        start = time.time()
+        try:
+            clk, instr = mpu.run(mem, cycles)
+        except Exception as e:
+            result['error'] = type(e).__name__
+            ret.append(result)
+            continue
+        elapsed = max(time.time() - start, 1e-9)
+        result.update({
+            'cycles': clk, 'instructions': instr, 'seconds': elapsed,
+            'cycles_per_sec': clk / elapsed,
+            'instructions_per_sec': instr / elapsed,
+        })
+        ret.append(result)
+    return ret
+
+def summarize(results):
+    """Return totals per addressing mode and over all results"""
+    ret = {}
+    for result in results:
+        if 'error' in result:
+            continue
+        for key in [result['mode'], 'total']:
+            total = ret.setdefault(key, {'cycles': 0, 'instructions': 0,
+                                         'seconds': 0.0})
+            for k in total:
+                total[k] += result[k]
+    for total in ret.values():
+        total['cycles_per_sec'] = total['cycles'] / total['seconds']
+        total['instructions_per_sec'] = \
+            total['instructions'] / total['seconds']
+    return ret
+
+def revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(engine, cycles, opcodes=None):
+    decoder = InstructionDecoder()
+    results = []
+    for opcode in sorted(decoder.table):
+        if opcodes and opcode not in opcodes:
+            continue
+        name, mode, _ = decoder.table[opcode]
+        results += bench(engine, opcode, name, mode, cycles)
+    return {
+        'engine': engine,
+        'python': platform.python_version(),
+        'revision': revision(),
+        'budget': cycles,
+        'results': results,
+        'summary': summarize(results),
+    }
+
+def report(data, baseline=None):
+    base = baseline['summary'] if baseline else {}
+    print('{} (python {}, {})'.format(data['engine'], data['python'],
+                                      data['revision']))
+    summary = data['summary']
+    for key in sorted(summary, key=lambda k: (k == 'total', k)):
+        total = summary[key]
+        line = '{:8} {:12.0f} cycles/s {:12.0f} instructions/s'.format(
+            key, total['cycles_per_sec'], total['instructions_per_sec'])
+        if key in base:
+            line += ' {:+7.1%}'.format(
+                total['cycles_per_sec'] / base[key]['cycles_per_sec'] - 1)
+        print(line)
+    errors = [r for r in data['results'] if 'error' in r]
+    for r in errors:
+        print('0x{:02x} {} {}: {}'.format(r['opcode'], r['name'], r['mode'],
+                                          r['error']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Measure MPU throughput on every opcode')
+    parser.add_argument('-e', '--engine', default='mpu',
+                        choices=sorted(ENGINES))
+    parser.add_argument('-c', '--cycles', type=int, default=10000,
+                        help='cycles per benchmark program')
+    parser.add_argument('-o', '--output', help='write results as JSON')
+    parser.add_argument('-b', '--baseline',
+                        help='compare with results written by -o')
+    parser.add_argument('opcodes', nargs='*', type=lambda s: int(s, 16),
+                        help='hex opcodes to benchmark (default: all)')
+    args = parser.parse_args()
+
+    data = run(args.engine, args.cycles, args.opcodes)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    report(data, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
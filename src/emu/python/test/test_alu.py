@@ -1,10 +1,10 @@
 #!/usr/bin/env python
 
-import os, sys
+import os, random, sys, tempfile
 sys.path.append(os.path.abspath(
     os.path.join(os.path.dirname(__file__), os.path.pardir)))
 
-from mc6502.alu import ALU
+from mc6502.alu import ALU, TableALU, LUT_LAYOUT, _lut_cache_path
 from mc6502.flag import Flag
 
 
@@ -168,7 +168,54 @@ def test_sbc():
     ret, flag = alu(0x05, 0x06, Flag(get_flag()), 'sbc')
     assert ret == 0xff and flag.data == get_flag(n=1, v=0, z=0, c=0)
 
+def test_flag():
+    flag = Flag(get_flag(n=1, c=1))
+    assert flag['N'] == 1 and flag['C'] == 1 and flag['Z'] == 0
+    flag['Z'] = 0x80
+    flag['N'] = False
+    assert flag.data == get_flag(z=1, c=1)
+    flag['PCC'] = 1
+    assert flag['PCC'] == 1 and flag.data == get_flag(z=1, c=1) | 0x100
+    assert str(Flag(get_flag(v=1, i=1))) == 'N=0 V=1 -=0 B=0 D=0 I=1 Z=0 C=0'
+
+def test_execute():
+    alu = ALU()
+    assert alu.execute(0xff, None, get_flag(n=1), 'inc') == \
+        (0x00, get_flag(z=1))
+    assert alu.execute(0x7f, 0x02, get_flag(c=0), 'adc') == \
+        (0x81, get_flag(n=1, v=1, z=0, c=0))
+    assert alu.execute(0x01, None, get_flag(n=1), 'lsr') == \
+        (0x00, get_flag(n=1, z=1, c=1))
+    assert alu.execute(0x33, 0x55, get_flag(i=1, d=1), 'cmp') == \
+        (0x33, get_flag(n=1, i=1, d=1, c=1))
+
+def test_table():
+    alu, lut = ALU(), TableALU()
+    assert lut(0xff, None, Flag(get_flag(n=1)), 'inc')[1].data == \
+        get_flag(z=1)
+    rand = random.Random(6502)
+    for ctrl, _, _ in LUT_LAYOUT:
+        for _ in range(2000):
+            a, b, p = rand.randrange(0x100), rand.randrange(0x100), \
+                rand.randrange(0x100)
+            assert alu.execute(a, b, p, ctrl) == lut.execute(a, b, p, ctrl)
+
+def test_table_cache():
+    directory = tempfile.mkdtemp()
+    path = _lut_cache_path(directory)
+    assert os.path.dirname(path) == directory
+    built = TableALU()._load(path)
+    assert os.path.getsize(path) > 0
+    loaded = TableALU()._load(path)
+    assert built == loaded
+    os.remove(path)
+    os.rmdir(directory)
+
 if __name__ == '__main__':
+    test_flag()
+    test_execute()
+    test_table()
+    test_table_cache()
     test_tha()
     test_inc()
     test_dec()
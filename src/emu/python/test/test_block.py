@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+import random
+
+from test_common import *
+from mc6502.decoder import InstructionDecoder
+from mc6502.fastmpu import FastMPU
+from mc6502.blockmpu import BlockMPU
+
+
+def compare(imem, reg, count, instructions=None, cycles=None):
+    # Run both MPUs by `count` chunks and compare at the end of each chunk
+    fmem, bmem = Memory(imem), Memory(imem)
+    fmpu, bmpu = FastMPU(), BlockMPU()
+    load_reg(fmpu, reg)
+    load_reg(bmpu, reg)
+    for i in range(count):
+        try:
+            fret = fmpu.run(fmem, cycles, instructions=instructions)
+        except Exception as e:
+            fret = type(e)
+        try:
+            bret = bmpu.run(bmem, cycles, instructions=instructions)
+        except Exception as e:
+            bret = type(e)
+        if fret != bret or save_reg(fmpu) != save_reg(bmpu) or \
+           save_mem(fmem) != save_mem(bmem):
+            return False
+        if not isinstance(fret, tuple):
+            # Both MPUs stopped by the same error (e.g. illegal opcode)
+            return True
+    return True
+
+def test_loop():
+    # LDX #$00, LDA #$01, CLC, ADC $10, STA $0300,X, INX, INY, STA $81,
+    # LDA $81, BNE, JMP $0002
+    imem = set_mem([0xa2, 0x00, 0xa9, 0x01, 0x18, 0x65, 0x10, 0x9d, 0x00,
+                    0x03, 0xe8, 0xc8, 0x85, 0x81, 0xa5, 0x81, 0xd0, 0x00,
+                    0x4c, 0x02, 0x00])
+    assert compare(imem, set_reg(pc=0x0000), 10, cycles=997)
+    assert compare(imem, set_reg(pc=0x0000, p=0x08), 10, instructions=101)
+
+    mem = Memory(imem)
+    mpu = BlockMPU()
+    load_reg(mpu, set_reg(pc=0x0000))
+    mpu.run(mem, 1000)
+    assert sorted(mpu._blocks) == \
+        [(0x0001, 0xa2), (0x0003, 0xa9), (0x0013, 0x4c)]
+
+def test_self_modifying():
+    # LDX #$00, INX, STX $0008, NOP, LDY #$00, JMP $0002
+    imem = set_mem([0xa2, 0x00, 0xe8, 0x8e, 0x08, 0x00, 0xea, 0xa0, 0x00,
+                    0x4c, 0x02, 0x00])
+    assert compare(imem, set_reg(pc=0x0000), 10, cycles=1000)
+
+    # Write into a translated block from outside of the MPU
+    # LDY #$00, JMP $0000
+    mem = Memory(set_mem([0xa0, 0x00, 0x4c, 0x00, 0x00]))
+    mpu = BlockMPU()
+    load_reg(mpu, set_reg(pc=0x0000))
+    mpu.run(mem, 1000)
+    assert (0x0001, 0xa0) in mpu._blocks
+    mem(0x0001, 0x55, True)
+    assert (0x0001, 0xa0) not in mpu._blocks
+    mpu.run(mem, 1000)
+    assert mpu.datapath.y.data == 0x55
+
+def test_random():
+    decoder = InstructionDecoder()
+    legal = [op for op in range(0x100) if decoder(op)[0]]
+    for seed in range(8):
+        random.seed(seed)
+        imem = bytearray(random.choice(legal) for _ in range(0x100)) * 0x100
+        reg = set_reg(pc=random.randrange(0x10000),
+                      a=random.randrange(0x100), x=random.randrange(0x100),
+                      y=random.randrange(0x100), s=random.randrange(0x100),
+                      p=random.randrange(0x100))
+        assert compare(imem, reg, 10, instructions=100)
+
+
+if __name__ == '__main__':
+    test_loop()
+    test_self_modifying()
+    test_random()
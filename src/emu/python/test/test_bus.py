@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+from test_common import *
+from mc6502.blockmpu import BlockMPU
+from mc6502.bus import Bus
+
+
+class Counter(object):
+    # Device whose register counts the reads and keeps the last write
+
+    def __init__(self):
+        self.reads = []
+        self.writes = []
+
+    def read(self, address):
+        self.reads.append(address)
+        return len(self.reads) & 0xff
+
+    def write(self, address, data):
+        self.writes.append((address, data))
+
+
+def test_map():
+    bus = Bus()
+    assert not bus.mapped and not bus.volatile
+    bus(0x0123, 0x55, True)
+    assert bus(0x0123) == 0x55
+
+    # 2 KiB RAM mirrored up to 0x2000
+    bus.map_ram(0x0800, 0x2000, base=0x0000, size=0x0800)
+    assert bus.mapped and not bus.volatile
+    assert bus(0x0923) == bus(0x1123) == bus(0x1923) == 0x55
+    bus(0x1fff, 0x66, True)
+    assert bus(0x07ff) == 0x66 and bus._data[0x1fff] == 0x00
+
+    # ROM
+    bus._data[0xf000] = 0x77
+    bus.map_ram(0xf000, 0x10000, rom=True)
+    bus(0xf000, 0x00, True)
+    assert bus(0xf000) == 0x77
+
+    # Device mirrored twice
+    device = Counter()
+    for start in [0x0200, 0x0300]:
+        bus.map_device(start, start + 0x100, device.read, device.write)
+    assert not bus.volatile
+    assert bus(0x0280) == 1 and bus(0x0380) == 2
+    bus(0x0381, 0x99, True)
+    assert device.reads == [0x0280, 0x0380]
+    assert device.writes == [(0x0381, 0x99)]
+    assert bus.device_reads == 2
+
+    bus.unmap()
+    assert not bus.mapped and not bus.volatile
+    assert bus(0x1fff) == 0x00
+
+def test_mpu():
+    # LDA $0280, STA $0281, STA $1100, JMP $0000
+    imem = set_mem([0xad, 0x80, 0x02, 0x8d, 0x81, 0x02, 0x8d, 0x00, 0x11,
+                    0x4c, 0x00, 0x00])
+    for cls in [MPU, BlockMPU]:
+        bus = Bus(imem)
+        bus.map_ram(0x1000, 0x2000, base=0x0000, size=0x1000)
+        device = Counter()
+        bus.map_device(0x0200, 0x0300, device.read, device.write)
+        mpu = cls()
+        load_reg(mpu, set_reg(pc=0x0000))
+        mpu.run(bus, 5000)
+
+        # One device read and write per loop
+        loops = len(device.writes)
+        assert device.reads == [0x0280] * len(device.reads)
+        assert loops - 1 <= len(device.reads) <= loops + 1
+        assert device.writes[:3] == [(0x0281, 1), (0x0281, 2), (0x0281, 3)]
+        # STA $1100 lands on the mirror at 0x0100
+        assert bus(0x0100) == device.writes[-1][1]
+
+
+if __name__ == '__main__':
+    test_map()
+    test_mpu()
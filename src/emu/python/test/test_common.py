@@ -7,9 +7,8 @@ from mc6502.mpu import MPU
 
 
 def set_mem(instr, mem_dict={}, size=0xffff):
-    ret = [0 for _ in range(size + 1)]
-    for i, ir in enumerate(instr):
-        ret[i] = ir
+    ret = bytearray(size + 1)
+    ret[:len(instr)] = bytearray(instr)
     for addr, data in mem_dict.items():
         ret[addr] = data
     return ret
@@ -45,7 +44,5 @@ def test_body(mem, reg, clk):
     mem = Memory(mem)
     mpu = MPU()
     load_reg(mpu, reg)
-    for c in range(clk + 1):
-        data, addr = mpu(mem(mpu.address))
-        mem(addr, data, mpu.r_w == 'w')
+    mpu.run(mem, cycles=clk + 1)
     return save_reg(mpu), save_mem(mem)
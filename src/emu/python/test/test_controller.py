@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+from test_common import *
+from mc6502.controller import SIGNALS, OPCODES, OP_NAMES, ADDR_MODES, \
+    RMW, STORE, STACK, ZERO_PAGE, BRANCH, STATES, T1_FETCH_OPERAND
+from mc6502.flag import Z
+
+
+def lockstep(imem, reg, clk):
+    imem = Memory(imem)
+    pmem = Memory(list(imem._data))
+    impu = MPU()
+    pmpu = MPU(precompiled=True)
+    load_reg(impu, reg)
+    load_reg(pmpu, reg)
+    for c in range(clk + 1):
+        idata, iaddr = impu(imem(impu.address))
+        imem(iaddr, idata, impu.r_w == 'w')
+        pdata, paddr = pmpu(pmem(pmpu.address))
+        pmem(paddr, pdata, pmpu.r_w == 'w')
+        for name in SIGNALS:
+            if getattr(impu.controller, name) != \
+               getattr(pmpu.controller, name):
+                return False
+        if impu.controller._state != pmpu.controller._state:
+            return False
+        if (idata, iaddr) != (pdata, paddr):
+            return False
+    return save_reg(impu) == save_reg(pmpu) and \
+        save_mem(imem) == save_mem(pmem)
+
+def test_branch():
+    for opcode in [0x10, 0x30, 0x50, 0x70, 0x90, 0xb0, 0xd0, 0xf0]:
+        for p in [0x00, 0xc3]:
+            imem = set_mem([], {0x0040: opcode, 0x0041: 0xe0, 0x0122: 0xea})
+            assert lockstep(imem, set_reg(pc=0x0040, p=p), 5)
+            imem = set_mem([opcode, 0x53], {0x0055: 0xea})
+            assert lockstep(imem, set_reg(pc=0x0000, p=p), 4)
+
+def test_page_crossing():
+    # LDA abs,X / LDA (zp),Y / STA abs,Y / INC abs,X
+    imem = set_mem([0xbd, 0xf0, 0x21, 0xb1, 0x67, 0x99, 0xf0, 0x21,
+                    0xfe, 0x44, 0x22],
+                   {0x0067: 0xf0, 0x0068: 0x21, 0x2255: 0x77})
+    assert lockstep(imem, set_reg(pc=0x0000, x=0x65, y=0x65), 30)
+    assert lockstep(imem, set_reg(pc=0x0000, x=0x11, y=0x11), 30)
+
+def test_subroutine():
+    # JSR / PHA / PHP / PLA / PLP / RTS / BRK / RTI
+    imem = set_mem([], {0x3366: 0x20, 0x3367: 0x55, 0x3368: 0x22,
+                        0x2255: 0x48, 0x2256: 0x08, 0x2257: 0x68,
+                        0x2258: 0x28, 0x2259: 0x60, 0x3369: 0x00,
+                        0xfffe: 0x00, 0xffff: 0x44, 0x4400: 0x40})
+    assert lockstep(imem, set_reg(pc=0x3366, a=0x77, p=0x81), 40)
+
+def test_reuse():
+    # The second run replays only the control words compiled by the first
+    imem = set_mem([0xa9, 0x77, 0x69, 0x11, 0x85, 0x55, 0xc6, 0x55])
+    assert lockstep(imem, set_reg(pc=0x0000), 15)
+    assert lockstep(imem, set_reg(pc=0x0000, p=0x09), 15)
+
+def test_opcodes():
+    def decoded(opcode):
+        op, mode, props, condition = OPCODES[opcode][:4]
+        return OP_NAMES[op], ADDR_MODES[mode], props, condition
+
+    assert decoded(0xfe) == ('INC', 'absx', RMW, (0x00, 0x00))
+    assert decoded(0x0a)[2] == RMW
+    assert decoded(0x91) == ('STA', 'indy', STORE | ZERO_PAGE, (0x00, 0x00))
+    assert decoded(0x20)[2] == STACK and decoded(0x68)[2] == STACK
+    assert decoded(0xd0) == ('BNE', 'rel', BRANCH, (Z, 0x00))
+    assert decoded(0x02) == (None, None, 0x00, (0x00, 0x00))
+    assert STATES[T1_FETCH_OPERAND] == 'T1_fetch_operand'
+
+if __name__ == '__main__':
+    test_branch()
+    test_page_crossing()
+    test_subroutine()
+    test_reuse()
+    test_opcodes()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+import random
+
+from test_common import *
+from mc6502.bus import Bus
+from mc6502.decoder import InstructionDecoder
+from mc6502.fastmpu import FastMPU
+
+
+def compare(imem, reg, count):
+    cmem, fmem = Memory(list(imem)), Memory(list(imem))
+    cmpu, fmpu = MPU(), FastMPU()
+    load_reg(cmpu, reg)
+    load_reg(fmpu, reg)
+    cmpu.step_instruction(cmem)
+    fmpu.step_instruction(fmem)
+    for i in range(count):
+        try:
+            cclk = cmpu.step_instruction(cmem)
+        except Exception as e:
+            cclk = type(e)
+        try:
+            fclk = fmpu.step(fmem)
+        except Exception as e:
+            fclk = type(e)
+        if cclk != fclk:
+            return False
+        if not isinstance(cclk, int):
+            # Both MPUs stopped by the same error (e.g. illegal opcode)
+            return True
+        if save_reg(cmpu) != save_reg(fmpu) or \
+           save_mem(cmem) != save_mem(fmem):
+            return False
+    return True
+
+def test_step():
+    # LDA #imm, SEC, ADC zpg, STA abs, INC zpg, NOP
+    imem = set_mem([0xa9, 0x77, 0x38, 0x65, 0x55, 0x8d, 0x44, 0x22,
+                    0xe6, 0x55, 0xea], {0x0055: 0x11})
+    fmem = Memory(imem)
+    fmpu = FastMPU()
+    load_reg(fmpu, set_reg(pc=0x0000))
+    assert [fmpu.step(fmem) for _ in range(6)] == [1+2, 2, 3, 4, 5, 2]
+    assert save_reg(fmpu) == set_reg(pc=0x000b+1, a=0x89, p=0x40)
+    assert save_mem(fmem)[0x2244] == 0x89 and save_mem(fmem)[0x0055] == 0x12
+
+def test_switch():
+    # Switch between the cycle accurate and the instruction level MPU
+    imem = set_mem([0xa2, 0x10, 0xe8, 0x8e, 0x00, 0x03, 0xe8, 0xea])
+    mem = Memory(imem)
+    mpu = FastMPU()
+    load_reg(mpu, set_reg(pc=0x0000))
+    assert mpu.step(mem) == 1 + 2
+    assert MPU.step_instruction(mpu, mem) == 2
+    assert mpu.step(mem) == 4
+    assert MPU.step_instruction(mpu, mem) == 2
+    assert save_reg(mpu) == set_reg(pc=0x0007+1, x=0x12)
+    assert save_mem(mem)[0x0300] == 0x11
+
+def test_addressing():
+    # Page crossing, branches, subroutines and interrupts
+    imem = set_mem([], {0x3366: 0x20, 0x3367: 0x55, 0x3368: 0x22,
+                        0x2255: 0xbd, 0x2256: 0xf0, 0x2257: 0x21,
+                        0x2258: 0xb1, 0x2259: 0x67, 0x225a: 0x91,
+                        0x225b: 0x67, 0x225c: 0xd0, 0x225d: 0xe0,
+                        0x233e: 0x00, 0x233f: 0xea, 0xfffe: 0x00,
+                        0xffff: 0x44, 0x4400: 0x6c, 0x4401: 0x10,
+                        0x4402: 0x44, 0x4410: 0x00, 0x4411: 0x45,
+                        0x4500: 0x40, 0x0067: 0xf0, 0x0068: 0x21})
+    assert compare(imem, set_reg(pc=0x3366, x=0x65, y=0x65), 10)
+    assert compare(imem, set_reg(pc=0x3366, x=0x11, y=0x11, p=0x09), 10)
+
+def test_run():
+    # INX, INY, JMP abs
+    imem = set_mem([0xe8, 0xc8, 0x4c, 0x00, 0x00])
+    for cycles in [0, 1, 5, 6, 23, 100]:
+        cmem, fmem = Memory(imem), Memory(imem)
+        cmpu, fmpu = MPU(), FastMPU()
+        load_reg(cmpu, set_reg(pc=0x0000))
+        load_reg(fmpu, set_reg(pc=0x0000))
+        assert cmpu.run(cmem, cycles) == fmpu.run(fmem, cycles)
+        assert save_reg(cmpu) == save_reg(fmpu)
+        assert cmpu.controller._state == fmpu.controller._state
+
+    until = lambda mpu: mpu.datapath.x.data == 0x80
+    for mpu in [MPU(), FastMPU()]:
+        mem = Memory(imem)
+        load_reg(mpu, set_reg(pc=0x0000))
+        assert mpu.run(mem, until=until) == \
+            (1 + 0x7f * 7 + 2, 1 + 0x7f * 3 + 1)
+        assert save_reg(mpu) == set_reg(pc=0x0002, x=0x80, y=0x7f, p=0x80)
+        assert mpu.run(mem, instructions=2) == (2 + 3, 2)
+
+def test_random():
+    decoder = InstructionDecoder()
+    legal = [op for op in range(0x100) if decoder(op)[0] and
+             not (decoder(op)[0] in ['ASL', 'LSR', 'ROL', 'ROR'] and
+                  decoder(op)[1] != 'acc')]
+    for seed in range(8):
+        random.seed(seed)
+        imem = [random.choice(legal) for _ in range(0x10000)]
+        reg = set_reg(pc=random.randrange(0x10000),
+                      a=random.randrange(0x100), x=random.randrange(0x100),
+                      y=random.randrange(0x100), s=random.randrange(0x100),
+                      p=random.randrange(0x100))
+        assert compare(imem, reg, 50)
+
+def test_fusion():
+    # LDA #$00, STA $10, DEX, BNE, INY, CPY #$10, BNE, CLC, ADC #$01,
+    # LDA ($80),Y, STA $0300,X, JMP $0000
+    imem = set_mem([0xa9, 0x00, 0x85, 0x10, 0xca, 0xd0, 0x00, 0xc8, 0xc0,
+                    0x10, 0xd0, 0x00, 0x18, 0x69, 0x01, 0xb1, 0x80, 0x9d,
+                    0x00, 0x03, 0x4c, 0x00, 0x00],
+                   {0x0080: 0x00, 0x0081: 0x02})
+    for cycles, instructions in [(1000, None), (997, None), (None, 301),
+                                 (23, 5)]:
+        cmem, fmem = Memory(imem), Memory(imem)
+        cmpu, fmpu = MPU(), FastMPU()
+        load_reg(cmpu, set_reg(pc=0x0000, x=0x03))
+        load_reg(fmpu, set_reg(pc=0x0000, x=0x03))
+        for _ in range(4):
+            assert cmpu.run(cmem, cycles, instructions=instructions) == \
+                fmpu.run(fmem, cycles, instructions=instructions)
+            assert save_reg(cmpu) == save_reg(fmpu)
+            assert save_mem(cmem) == save_mem(fmem)
+            assert cmpu.cycles == fmpu.cycles
+
+    # Devices see the cycle of each fused instruction
+    def run(fused):
+        writes = []
+        bus = Bus(imem)
+        bus.map_device(0x0300, 0x0400, lambda address: 0x00,
+                       lambda address, data: writes.append(mpu.cycles))
+        mpu = FastMPU()
+        mpu.fuse(fused)
+        load_reg(mpu, set_reg(pc=0x0000))
+        mpu.run(bus, 2000)
+        return writes, save_reg(mpu)
+    assert run([(0xb1, 0x9d, 0x4c)]) == run([])
+
+    # LDA #$42, STA $10, PHA, PLA runs in one generated handler
+    imem = set_mem([0xa9, 0x42, 0x85, 0x10, 0x48, 0x68, 0xea])
+    cmem, fmem = Memory(imem), Memory(imem)
+    cmpu, fmpu = FastMPU(), FastMPU()
+    cmpu.fuse([])
+    fmpu.fuse([(0xa9, 0x85, 0x48, 0x68)])
+    assert fmpu._fusion[0xa9].__code__.co_filename == '<fused 0xa9>'
+    load_reg(cmpu, set_reg(pc=0x0000, s=0xff))
+    load_reg(fmpu, set_reg(pc=0x0000, s=0xff))
+    cycles = sum(cmpu.step(cmem) for _ in range(4))
+    assert fmpu._step(fmem, 4) == (cycles, 4)
+    assert save_reg(cmpu) == save_reg(fmpu)
+    assert save_mem(cmem) == save_mem(fmem)
+    assert fmem(0x0010) == fmem(0x01ff) == 0x42
+
+if __name__ == '__main__':
+    test_step()
+    test_switch()
+    test_addressing()
+    test_run()
+    test_random()
+    test_fusion()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+import gc
+
+from test_common import *
+from mc6502.blockmpu import BlockMPU
+from mc6502.bus import Bus
+from mc6502.fastmpu import FastMPU
+
+
+def compare(cmem, fmem, reg, cycles):
+    # Cycle accurate MPU against FastMPU decoding through the cache
+    cmpu, fmpu = MPU(), FastMPU()
+    load_reg(cmpu, reg)
+    load_reg(fmpu, reg)
+    cmpu.run(cmem, cycles)
+    fmpu.run(fmem, cycles)
+    return save_reg(cmpu) == save_reg(fmpu) and \
+        save_mem(cmem) == save_mem(fmem)
+
+def count_decodes(mpu):
+    pcs = []
+    decode = mpu.icache._decode
+
+    def counted(pc, opcode):
+        pcs.append(pc)
+        return decode(pc, opcode)
+    mpu.icache._decode = counted
+    return pcs
+
+def test_self_modifying():
+    # LDA #$05, CLC, ADC #$01, STA $0001, JMP $0000
+    imem = set_mem([0xa9, 0x05, 0x18, 0x69, 0x01, 0x8d, 0x01, 0x00,
+                    0x4c, 0x00, 0x00])
+    assert compare(Memory(imem), Memory(imem), set_reg(pc=0x0000), 1000)
+
+    mem = Memory(imem)
+    mpu = FastMPU()
+    load_reg(mpu, set_reg(pc=0x0000))
+    mpu.run(mem, 1000)
+    assert save_reg(mpu)['a'] > 0x06
+
+    # Written from outside of the MPU: LDY #$00, JMP $0000
+    mem = Memory(set_mem([0xa0, 0x00, 0x4c, 0x00, 0x00]))
+    mpu = FastMPU()
+    load_reg(mpu, set_reg(pc=0x0000))
+    mpu.run(mem, 100)
+    mem(0x0001, 0x42, True)
+    mpu.run(mem, 100)
+    assert save_reg(mpu)['y'] == 0x42
+
+def test_rom():
+    # LDX #$00, INX, STX $0300, JMP $f002 in ROM decoded once
+    bus = Bus(set_mem([], {0xf000: 0xa2, 0xf001: 0x00, 0xf002: 0xe8,
+                           0xf003: 0x8e, 0xf004: 0x00, 0xf005: 0x03,
+                           0xf006: 0x4c, 0xf007: 0x02, 0xf008: 0xf0}))
+    bus.map_ram(0xf000, 0x10000, rom=True)
+    mpu = FastMPU()
+    load_reg(mpu, set_reg(pc=0xf000))
+    pcs = count_decodes(mpu)
+    mpu.run(bus, 2000)
+    bus(0xf001, 0x55, True)
+    mpu.run(bus, 2000)
+    assert sorted(pcs) == [0xf001, 0xf003, 0xf004, 0xf007]
+    assert bus(0x0300) == save_reg(mpu)['x']
+
+def test_mirror():
+    # Code at 0x1000 rewritten through its mirror at 0x3000
+    # LDA #$05, CLC, ADC #$01, STA $3001, JMP $1000
+    code = [0xa9, 0x05, 0x18, 0x69, 0x01, 0x8d, 0x01, 0x30, 0x4c, 0x00,
+            0x10]
+    mems = []
+    for _ in range(2):
+        bus = Bus(set_mem([], dict((0x1000 + i, data)
+                                   for i, data in enumerate(code))))
+        bus.map_ram(0x3000, 0x4000, base=0x1000)
+        mems.append(bus)
+    assert compare(mems[0], mems[1], set_reg(pc=0x1000), 1000)
+
+def test_snapshot():
+    # Restored memory drops the decoded instructions
+    imem = set_mem([0xa0, 0x00, 0x4c, 0x00, 0x00])
+    mem = Memory(imem)
+    mpu = FastMPU()
+    load_reg(mpu, set_reg(pc=0x0000))
+    mpu.run(mem, 100)
+    blob = mpu.snapshot(Memory(set_mem([0xa0, 0x33, 0x4c, 0x00, 0x00])))
+    mpu.restore(blob, mem)
+    mpu.run(mem, 100)
+    assert save_reg(mpu)['y'] == 0x33
+
+    # Each restore frees the place of the watch callback
+    for _ in range(20):
+        mpu.restore(blob, mem)
+        mpu.run(mem, 100)
+    assert len(mem._watchers) == 1
+
+def test_engines():
+    # More engines than before one after another on a memory
+    mem = Memory(set_mem([0xa0, 0x00, 0xc8, 0x8c, 0x01, 0x00, 0x4c, 0x00,
+                          0x00]))
+    for i in range(12):
+        mpu = FastMPU()
+        load_reg(mpu, set_reg(pc=0x0000))
+        mpu.run(mem, 100)
+        mpu.flush()
+    assert not mem._watchers and not any(mem._watch)
+
+    # Engines left running on the memory, and ones dropped or moved away
+    mpus = []
+    for cls in [FastMPU, BlockMPU] * 6:
+        mpu = cls()
+        load_reg(mpu, set_reg(pc=0x0000))
+        mpu.run(mem, 2000)
+        mpus.append(mpu)
+    mem(0x0001, 0x40, True)
+    for mpu in mpus:
+        mpu.run(mem, 100)
+        assert save_reg(mpu)['y'] > 0x40
+    for mpu in mpus[1:]:
+        mpu.run(Memory(), 10)
+    assert mem._watchers
+    del mpus[:], mpu
+    gc.collect()
+    assert not mem._watchers and not any(mem._watch)
+
+if __name__ == '__main__':
+    test_self_modifying()
+    test_rom()
+    test_mirror()
+    test_snapshot()
+    test_engines()
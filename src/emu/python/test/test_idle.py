@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+import time
+
+from test_common import *
+from mc6502.bus import Bus
+from mc6502.fastmpu import FastMPU
+
+
+# LDX #$10, DEX, BNE, JMP $0005, JMP $0002
+COUNTDOWN = set_mem([0xa2, 0x10, 0xca, 0xd0, 0x03, 0x4c, 0x05, 0x00, 0x4c,
+                     0x02, 0x00])
+
+def run(cls, imem, idle, **kw):
+    mem = Memory(imem)
+    mpu = cls(idle=idle)
+    load_reg(mpu, set_reg(pc=0x0000))
+    ret = mpu.run(mem, **kw)
+    return ret, save_reg(mpu), str(mpu.controller), save_mem(mem)
+
+def test_skip():
+    for cls in [MPU, FastMPU]:
+        for budget in [7, 50, 998, 999, 1000, 20001]:
+            assert run(cls, COUNTDOWN, False, cycles=budget) == \
+                run(cls, COUNTDOWN, True, cycles=budget)
+            assert run(cls, COUNTDOWN, False, instructions=budget) == \
+                run(cls, COUNTDOWN, True, instructions=budget)
+
+    # JMP * skips ahead
+    start = time.time()
+    ret, reg, _, _ = run(MPU, set_mem([0x4c, 0x00, 0x00]), True,
+                         cycles=10 ** 9)
+    assert ret == (10 ** 9, 333333334) and reg['pc'] == 0x0001
+    assert time.time() - start < 10
+
+def test_until():
+    # The stop condition is met in the middle of the idle loop
+    until = lambda mpu: mpu.cycles >= 5000
+    for cls in [MPU, FastMPU]:
+        for imem in [COUNTDOWN, set_mem([0x4c, 0x00, 0x00])]:
+            expected = run(cls, imem, False, cycles=10 ** 6, until=until)
+            assert expected[0][0] < 5010
+            assert run(cls, imem, True, cycles=10 ** 6, until=until) == \
+                expected
+
+def test_writes():
+    # LDA #$00, STA $0300, JMP $0002: a store in the loop is never skipped
+    imem = set_mem([0xa9, 0x00, 0x8d, 0x00, 0x03, 0x4c, 0x02, 0x00])
+    mem = Memory(imem)
+    mpu = MPU(idle=True)
+    writes = []
+    mem.watch(0x0300, 0x0301, writes.append)
+    mpu.run(mem, 700)
+    assert len(writes) == 100
+
+def test_volatile():
+    class Counted(Memory):
+        # Reads of the opcode of the loop
+        reads = 0
+
+        def __call__(self, address, data=None, we=False):
+            if address == 0x0000 and not we:
+                self.reads += 1
+            return super(Counted, self).__call__(address, data, we)
+
+    class Volatile(Counted):
+        volatile = True
+
+    # JMP $0000 is read at every iteration only on volatile memory
+    for cls in [MPU, FastMPU]:
+        for memory in [Volatile, Counted]:
+            mem = memory(set_mem([0x4c, 0x00, 0x00]))
+            mpu = cls(idle=True)
+            load_reg(mpu, set_reg(pc=0x0000))
+            assert mpu.run(mem, 1 + 300) == (1 + 300, 1 + 100)
+            if memory is Volatile:
+                assert mem.reads == 1 + 100
+            else:
+                assert mem.reads < 10
+
+def test_devices():
+    # JMP $0000 is skipped on a bus with a device, LDA $0280, JMP $0000
+    # reading it is not
+    for imem, reads in [(set_mem([0x4c, 0x00, 0x00]), 0),
+                        (set_mem([0xad, 0x80, 0x02, 0x4c, 0x00, 0x00]),
+                         1000)]:
+        for idle in [False, True]:
+            bus = Bus(imem)
+            device = []
+            bus.map_device(0x0200, 0x0300,
+                           lambda address: len(device.append(address) or
+                                               device) & 0xff)
+            mpu = FastMPU(idle=idle)
+            load_reg(mpu, set_reg(pc=0x0000))
+            mpu.run(bus, 1 + 7000)
+            assert len(device) == reads and bus.device_reads == reads
+            if not idle:
+                expected = save_reg(mpu)
+            assert save_reg(mpu) == expected
+
+    start = time.time()
+    bus = Bus(set_mem([0x4c, 0x00, 0x00]))
+    bus.map_device(0x0200, 0x0300, lambda address: 0x00)
+    mpu = MPU(idle=True)
+    load_reg(mpu, set_reg(pc=0x0000))
+    assert mpu.run(bus, 1 + 3 * 10 ** 8) == (1 + 3 * 10 ** 8, 1 + 10 ** 8)
+    assert time.time() - start < 10
+
+if __name__ == '__main__':
+    test_skip()
+    test_until()
+    test_writes()
+    test_volatile()
+    test_devices()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+import os, sys, tempfile
+sys.path.append(os.path.abspath(
+    os.path.join(os.path.dirname(__file__), os.path.pardir)))
+
+from mc6502.memory import Memory
+
+
+def write_file(data, mode='wb'):
+    fd, path = tempfile.mkstemp()
+    with os.fdopen(fd, mode) as f:
+        f.write(data)
+    return path
+
+def test_call():
+    mem = Memory([0x11, 0x22, 0x33])
+    assert len(mem) == 0x10000
+    assert mem(0x0001) == 0x22 and mem(0xffff) == 0x00
+    assert mem(0x0001, 0x44) == 0x22
+    assert mem(0x0001, 0x44, True) == 0x44
+    assert mem(0x0001, 0x00, True) == 0x00
+
+def test_size():
+    mem = Memory(size=0xff)
+    assert len(mem) == 0x100
+    try:
+        mem(0x0000, 0x100, True)
+        assert False
+    except AssertionError as e:
+        assert 'address: 0x0' in str(e)
+
+def test_load_hex():
+    path = write_file('# comment\n01 02 ff\n0a\n', 'w')
+    try:
+        mem = Memory(filename=path)
+        assert mem.view(0, 5).tobytes() == b'\x01\x02\xff\x0a\x00'
+        assert mem.load_hex(path, 0x1000) == 4
+        assert mem(0x1002) == 0xff
+    finally:
+        os.remove(path)
+
+def test_load_bin():
+    path = write_file(bytearray([0x4c, 0x00, 0xf0]))
+    try:
+        mem = Memory(binfile=path)
+        assert mem.view(0, 3).tobytes() == b'\x4c\x00\xf0'
+        assert mem.load_bin(path, 0xfffe) == 2
+        assert mem(0xfffe) == 0x4c and mem(0xffff) == 0x00
+        assert mem.map_bin(path, 0xf000) == 3
+        assert mem(0xf002) == 0xf0
+    finally:
+        os.remove(path)
+
+def test_view():
+    mem = Memory()
+    view = mem.view(0x0100, 0x0200)
+    mem(0x01ff, 0x55, True)
+    assert len(view) == 0x100 and bytearray(view)[0xff] == 0x55
+    view[0:1] = b'\xaa'
+    assert mem(0x0100) == 0xaa
+
+def test_watch():
+    mem = Memory()
+    hits = []
+    mem.watch(0x0200, 0x0210, hits.append)
+    mem(0x01ff, 0x11, True)
+    mem(0x0200, 0x22, True)
+    mem(0x020f, 0x00, True)
+    mem(0x0210, 0x33, True)
+    mem(0x0205)
+    assert hits == [0x0200, 0x020f]
+    mem.unwatch(0x0200, 0x0208)
+    mem(0x0200, 0x44, True)
+    mem(0x0208, 0x55, True)
+    assert hits == [0x0200, 0x020f, 0x0208]
+
+    # Each callback keeps its own ranges
+    others = []
+    mem.watch(0x0204, 0x0206, others.append)
+    mem(0x0205, 0x66, True)
+    mem(0x020a, 0x77, True)
+    mem.unwatch(0x0200, 0x0210, hits.append)
+    mem(0x0204, 0x88, True)
+    mem(0x020b, 0x99, True)
+    assert hits == [0x0200, 0x020f, 0x0208, 0x020a]
+    assert others == [0x0205, 0x0204]
+
+
+if __name__ == '__main__':
+    test_call()
+    test_size()
+    test_load_hex()
+    test_load_bin()
+    test_view()
+    test_watch()
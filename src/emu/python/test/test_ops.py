@@ -1,5 +1,11 @@
 #!/usr/bin/env python
 
+import argparse
+import multiprocessing
+import sys
+import time
+import traceback
+
 import test_sbi
 import test_iem
 import test_str
@@ -7,9 +13,47 @@ import test_rmw
 import test_misc
 
 
+TEST_SETS = [
+    (test_sbi, 'test_set_SBI'),
+    (test_iem, 'test_set_IEM'),
+    (test_str, 'test_set_STR'),
+    (test_rmw, 'test_set_RMW'),
+    (test_misc, 'test_set_MISC'),
+]
+
+
+def run_set(index):
+    """Run a test set and return the traceback on failure"""
+    module, name = TEST_SETS[index]
+    try:
+        getattr(module, name)()
+    except Exception:
+        return '{}.{}\n{}'.format(
+            module.__name__, name, traceback.format_exc())
+    return None
+
+def run(jobs=1):
+    """Run the test sets on `jobs` processes and return the failures"""
+    indices = range(len(TEST_SETS))
+    if jobs <= 1:
+        return [ret for ret in map(run_set, indices) if ret]
+    pool = multiprocessing.Pool(jobs)
+    try:
+        return [ret for ret in pool.map(run_set, indices) if ret]
+    finally:
+        pool.close()
+        pool.join()
+
+
 if __name__ == '__main__':
-    test_sbi.test_set_SBI()
-    test_iem.test_set_IEM()
-    test_str.test_set_STR()
-    test_rmw.test_set_RMW()
-    test_misc.test_set_MISC()
+    parser = argparse.ArgumentParser(description='Run the opcode test sets')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes')
+    args = parser.parse_args()
+    start = time.time()
+    failures = run(args.jobs)
+    for failure in failures:
+        print(failure)
+    print('{} failed, {} passed in {:.2f}s'.format(
+        len(failures), len(TEST_SETS) - len(failures), time.time() - start))
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+from test_common import *
+from mc6502.fastmpu import FastMPU
+from mc6502.profile import Profile
+
+
+# LDX #$00, LDA #$01, STA $0300,X, INX, JMP $0004
+PROGRAM = set_mem([0xa2, 0x00, 0xa9, 0x01, 0x9d, 0x00, 0x03, 0xe8, 0x4c,
+                   0x04, 0x00])
+
+def test_counters():
+    mem = Memory(PROGRAM)
+    mpu = MPU()
+    load_reg(mpu, set_reg(pc=0x0000))
+    profile = Profile()
+    profile.attach(mpu)
+    clk, instr = mpu.run(mem, 3000)
+
+    assert sum(profile.states.values()) == clk
+    assert sum(profile.reads) + sum(profile.writes) == clk
+    assert sum(profile.opcodes) == instr
+    assert profile.writes[0x03] == profile.opcodes[0x9d]
+    assert profile.opcodes[0xe8] == profile.opcodes[0x4c]
+    assert profile.opcodes[0x00] == 0
+    assert profile.states['Tx_write_data'] == profile.opcodes[0x9d]
+    assert 'Tx_write_data' in profile.report()
+    assert sum(profile.pairs) == instr - 1
+    assert sorted(profile.fusions(3)) == [(0x4c, 0x9d), (0x9d, 0xe8),
+                                          (0xe8, 0x4c)]
+
+def test_detach():
+    # Profiled and detached runs behave as the plain MPU
+    for cls in [MPU, FastMPU]:
+        pmem, mem = Memory(PROGRAM), Memory(PROGRAM)
+        pmpu, mpu = cls(), cls()
+        load_reg(pmpu, set_reg(pc=0x0000))
+        load_reg(mpu, set_reg(pc=0x0000))
+        profile = Profile()
+        profile.attach(pmpu)
+        assert pmpu.run(pmem, 1000) == mpu.run(mem, 1000)
+        step = pmpu.step_instruction(pmem)
+        assert step == mpu.step_instruction(mem)
+        # Every cycle is counted whatever the engine
+        assert sum(profile.states.values()) == 1000 + step
+        profile.detach(pmpu)
+        assert 'run' not in pmpu.__dict__
+        assert pmpu.run(pmem, 1000) == mpu.run(mem, 1000)
+        assert save_reg(pmpu) == save_reg(mpu)
+        assert save_mem(pmem) == save_mem(mem)
+
+
+def test_fusions():
+    # FastMPU fusing the hottest pairs runs as the MPU
+    mem = Memory(PROGRAM)
+    mpu = MPU()
+    load_reg(mpu, set_reg(pc=0x0000))
+    profile = Profile()
+    profile.attach(mpu)
+    mpu.run(mem, 3000)
+
+    cmem, fmem = Memory(PROGRAM), Memory(PROGRAM)
+    cmpu, fmpu = MPU(), FastMPU()
+    fmpu.fuse(profile.fusions())
+    load_reg(cmpu, set_reg(pc=0x0000))
+    load_reg(fmpu, set_reg(pc=0x0000))
+    assert cmpu.run(cmem, 3001) == fmpu.run(fmem, 3001)
+    assert save_reg(cmpu) == save_reg(fmpu)
+    assert save_mem(cmem) == save_mem(fmem)
+
+if __name__ == '__main__':
+    test_counters()
+    test_detach()
+    test_fusions()
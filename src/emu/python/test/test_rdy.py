@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+from test_common import *
+from mc6502.blockmpu import BlockMPU
+from mc6502.bus import Bus
+from mc6502.controller import WRITE_STATES
+from mc6502.fastmpu import FastMPU
+from mc6502.profile import Profile
+from mc6502.tracer import Tracer
+
+
+# LDX #$00, STA $0202, INX, JMP $0002
+WSYNC_LOOP = set_mem([0xa2, 0x00, 0x8d, 0x02, 0x02, 0xe8, 0x4c, 0x02, 0x00])
+LINE = 76
+
+class Sync(object):
+    # WSYNC: RDY is low up to the beginning of the next line
+    def __init__(self, mpu):
+        self.mpu = mpu
+        self.release = 0
+
+    def read(self, address):
+        return 0x00
+
+    def write(self, address, data):
+        self.release = (self.mpu.cycles // LINE + 1) * LINE
+
+    def stall(self):
+        return max(0, self.release - self.mpu.cycles)
+
+def system(cls):
+    bus = Bus(WSYNC_LOOP)
+    mpu = cls()
+    sync = Sync(mpu)
+    bus.map_device(0x0200, 0x0300, sync.read, sync.write)
+    load_reg(mpu, set_reg(pc=0x0000))
+    return bus, mpu, sync
+
+def reference(cycles, addresses=None):
+    # One cycle at a time with RDY given to `MPU.__call__`
+    bus, mpu, sync = system(MPU)
+    for _ in range(cycles):
+        address = mpu.address
+        data = 0x00 if mpu.controller._state in WRITE_STATES else \
+            bus(address)
+        data, addr = mpu(data, rdy=sync.stall() == 0)
+        if mpu.r_w == 'w':
+            bus(addr, data, True)
+            address = addr
+        if addresses is not None:
+            addresses.append(address)
+        mpu.cycles += 1
+    return save_reg(mpu), mpu.cycles
+
+def test_bulk():
+    for budget in [3, 20, 76, 77, 1000, 7601]:
+        expected = reference(budget)
+        bus, mpu, sync = system(MPU)
+        mpu.stall = sync.stall
+        assert mpu.run(bus, budget)[0] == budget
+        assert (save_reg(mpu), mpu.cycles) == expected, budget
+
+        # Same with the profile, counting the halted cycles to the state
+        bus, mpu, sync = system(MPU)
+        mpu.stall = sync.stall
+        profile = Profile()
+        profile.attach(mpu)
+        mpu.run(bus, budget)
+        assert (save_reg(mpu), mpu.cycles) == expected, budget
+        assert sum(profile.states.values()) == budget
+
+def test_tracer():
+    # One record per cycle, the halted ones holding the bus address
+    for budget, size in [(228, 0x100), (228, 100), (1000, 64)]:
+        addresses = []
+        reference(budget, addresses)
+        bus, mpu, sync = system(MPU)
+        mpu.stall = sync.stall
+        tracer = Tracer(size)
+        tracer.attach(mpu)
+        for clk in [5, 100, budget - 105]:
+            mpu.run(bus, clk)
+        records = list(tracer.records())
+        assert len(tracer) == len(records) == min(budget, size)
+        assert [r[0] for r in records] == list(range(budget))[-size:]
+        assert [r[1] for r in records] == addresses[-size:]
+        assert len(list(tracer.lines())) == len(records)
+        # Most cycles are the opcode fetch of INX halted after WSYNC
+        halted = [r for r in records if r[1:4] == (0x0005, 0x00, 0)]
+        assert len(halted) > len(records) // 2
+
+def test_lines():
+    # One loop per line whatever the MPU, the last one waiting for INX
+    for cls in [MPU, FastMPU, BlockMPU]:
+        bus, mpu, sync = system(cls)
+        mpu.stall = sync.stall
+        ncycles, ninstrs = mpu.run(bus, LINE * 100)
+        assert ncycles == LINE * 100 and mpu.datapath.x.data == 99, cls
+        assert ninstrs <= 3 * 100
+
+    # Without RDY the loop runs freely
+    bus, mpu, sync = system(MPU)
+    mpu.run(bus, LINE * 100)
+    assert mpu.datapath.x.data == LINE * 100 // 9 & 0xff
+
+
+if __name__ == '__main__':
+    test_bulk()
+    test_tracer()
+    test_lines()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+import unittest
+
+from test_common import *
+from mc6502.bus import Bus
+from mc6502.riot import RIOT
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+    if __name__ != '__main__':
+        # Skipped as a whole by the test runner
+        raise unittest.SkipTest('yaml is not installed')
+
+
+VECTORS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       os.path.pardir, os.path.pardir, os.path.pardir,
+                       os.path.pardir, 'test', 'cpp', 'mm6532',
+                       'sim_mm6532.yml')
+REGS = ['DRA', 'DDRA', 'DRB', 'DDRB']
+
+def replay(test):
+    # Same clocking as sim_mm6532.cpp: one access per edge with the inputs
+    # of the latest command, then the outputs after `cycle` + 1 edges
+    now = [0]
+    riot = RIOT(clock=lambda: now[0])
+    for name in REGS:
+        setattr(riot, name.lower(), test['initial']['reg'][name])
+    for addr, data in test['initial'].get('ram', {}).items():
+        riot.ram[addr] = data
+    commands = dict((command['clock'], command['reg'])
+                    for command in test.get('command', []))
+
+    reg = dict(test['initial']['reg'])
+    for now[0] in range(test['cycle'] + 2):
+        reg.update(commands.get(now[0], {}))
+        riot.pa_in, riot.pb_in = reg['PA_IN'], reg['PB_IN']
+        address = reg['RS_N'] << 9 | reg['A']
+        if now[0] > test['cycle']:
+            break
+        if reg['R_W']:
+            riot.read(address)
+        else:
+            riot.write(address, reg['D_IN'])
+
+    out = {'D_OUT': riot.peek(address, not reg['R_W']),
+           'PA_OUT': riot.pa_out, 'PB_OUT': riot.pb_out,
+           'IRQ_N': int(riot.irq_n)}
+    for name in REGS:
+        out[name] = getattr(riot, name.lower())
+    ram = dict((addr, riot.ram[addr]) for addr in test['expected']['ram'])
+    return out == test['expected']['reg'] and ram == test['expected']['ram']
+
+def test_vectors():
+    with open(VECTORS) as f:
+        targets = yaml.safe_load(f)
+    failed = [test['comment'] for target in targets
+              for test in target['tests'] if not replay(test)]
+    assert not failed, failed
+
+def test_lazy():
+    # Timer at 0x0280 of the bus: INTIM counts down without any access
+    bus = Bus()
+    mpu = MPU()
+    riot = RIOT(clock=lambda: mpu.cycles)
+    bus.map_device(0x0200, 0x0400, riot.read, riot.write)
+    mpu.cycles = 1000
+    bus(0x0296, 0x10, True)        # TIM64T
+    mpu.cycles += 1 + 64 * 3 + 5
+    assert bus(0x0284) == 0x0c
+    # 1T after the underflow, read with the flag set as in mm6532.v
+    mpu.cycles = 1001 + 64 * 16 + 9
+    assert bus(0x0284) == ~(0xff - 9) & 0xff
+    assert bus(0x0285) == 0x00 and riot.irq_n
+
+    # Interrupt enabled by TIM1T with A[3]
+    bus(0x029c, 0x05, True)
+    mpu.cycles += 1 + 5
+    assert not riot.irq_n and bus(0x0285) == 0x80
+    bus(0x0284)
+    mpu.cycles += 1
+    assert riot.irq_n
+
+
+if __name__ == '__main__':
+    if yaml is None:
+        print('skip: yaml is not installed')
+        sys.exit(0)
+    test_vectors()
+    test_lazy()
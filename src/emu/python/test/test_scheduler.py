@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+import time
+
+from test_common import *
+from mc6502.blockmpu import BlockMPU
+from mc6502.bus import Bus
+from mc6502.controller import T1_FETCH_OPERAND
+from mc6502.fastmpu import FastMPU
+from mc6502.flag import I
+from mc6502.riot import RIOT
+from mc6502.scheduler import Scheduler
+
+
+# CLI, LDA #$10, STA $029e (TIM64T with interrupt), INX, JMP $1006
+MAIN = [0x58, 0xa9, 0x10, 0x8d, 0x9e, 0x02, 0xe8, 0x4c, 0x06, 0x10]
+# INC $10, LDA #$05, STA $029d (TIM8T with interrupt), RTI
+IRQ = [0xe6, 0x10, 0xa9, 0x05, 0x8d, 0x9d, 0x02, 0x40]
+# INC $11, RTI
+NMI = [0xe6, 0x11, 0x40]
+# NMI_N low from each cycle up to the next one
+PULSES = [(3000, 3100), (7777, 9000)]
+
+def system(cls, scheduler):
+    mem = set_mem([], {0xfffa: 0x00, 0xfffb: 0x12,
+                       0xfffe: 0x00, 0xffff: 0x11})
+    for start, code in [(0x1000, MAIN), (0x1100, IRQ), (0x1200, NMI)]:
+        mem[start:start + len(code)] = bytearray(code)
+    bus = Bus(mem)
+    mpu = cls()
+    riot = RIOT(clock=lambda: mpu.cycles, scheduler=scheduler)
+    bus.map_device(0x0200, 0x0400, riot.read, riot.write)
+    load_reg(mpu, set_reg(pc=0x1000, p=I))
+    nmi_n = lambda: not any(a <= mpu.cycles < b for a, b in PULSES)
+    return bus, mpu, riot, nmi_n
+
+def reference(cls, end):
+    # Interrupt lines polled at every instruction boundary
+    bus, mpu, riot, nmi_n = system(cls, None)
+    level = True
+    while True:
+        if mpu.controller._state == T1_FETCH_OPERAND:
+            nmi = level and not nmi_n()
+            level = nmi_n()
+            if nmi or (not riot.irq_n and not mpu.datapath.p.data & I):
+                mpu.interrupt(nmi=nmi)
+                mpu.enter(bus)
+                continue
+        mpu.run(bus, instructions=1)
+        if mpu.cycles >= end:
+            return save_reg(mpu), mpu.cycles, bus(0x10), bus(0x11)
+
+def test_events():
+    scheduler = Scheduler()
+    fired = []
+    for cycle in [30, 10, 20, 10]:
+        scheduler.schedule(cycle, fired.append)
+    scheduler.cancel(scheduler.schedule(15, fired.append))
+    assert scheduler.deadline == 10
+    scheduler.fire(20)
+    assert fired == [10, 10, 20] and scheduler.deadline == 30
+    scheduler.fire(100)
+    assert fired == [10, 10, 20, 30] and scheduler.deadline is None
+
+def test_interrupts():
+    end = 12000
+    for cls in [MPU, FastMPU, BlockMPU]:
+        expected = reference(cls, end)
+        scheduler = Scheduler()
+        bus, mpu, riot, nmi_n = system(cls, scheduler)
+        scheduler.irq_n = lambda: riot.irq_n
+        scheduler.nmi_n = nmi_n
+        for start, stop in PULSES:
+            scheduler.schedule(start)
+            scheduler.schedule(stop)
+        scheduler.run(mpu, bus, until=lambda mpu: mpu.cycles >= end)
+        assert (save_reg(mpu), mpu.cycles, bus(0x10), bus(0x11)) == \
+            expected, cls
+        # Both interrupts taken and returned from
+        assert expected[2] > 100 and expected[3] == len(PULSES)
+
+def test_budget():
+    # The same run cut through instructions and interrupt entries
+    scheduler = Scheduler()
+    bus, mpu, riot, nmi_n = system(MPU, scheduler)
+    scheduler.irq_n = lambda: riot.irq_n
+    ncycles = 0
+    while ncycles < 5000:
+        ncycles += scheduler.run(mpu, bus, 8)[0]
+    assert ncycles == 5000 and mpu.cycles == 5000
+
+    other = Scheduler()
+    bus2, mpu2, riot2, _ = system(MPU, other)
+    other.irq_n = lambda: riot2.irq_n
+    assert other.run(mpu2, bus2, 5000)[0] == 5000
+    assert save_reg(mpu) == save_reg(mpu2) and bus(0x10) == bus2(0x10)
+    assert bus(0x10) > 40
+
+def test_ram():
+    # LDA #$ff, STA $029f (TIM1024T with interrupt), LDA $80, JMP $1005
+    scheduler = Scheduler()
+    bus, mpu, riot, _ = system(MPU, scheduler)
+    bus.map_device(0x0000, 0x0100, riot.read, riot.write)
+    for i, data in enumerate([0xa9, 0xff, 0x8d, 0x9f, 0x02, 0xa5, 0x80,
+                              0x4c, 0x05, 0x10]):
+        bus(0x1000 + i, data, True)
+    scheduler.irq_n = lambda: riot.irq_n
+    scheduler.run(mpu, bus, 100000)
+    # The event of the timer is the only one left
+    assert len(scheduler._events) == 1
+    assert scheduler.deadline == riot._tim_irq_edge()
+
+def test_idle():
+    # CLI, LDA #$40, STA $029e, JMP $1006 waiting for the interrupt
+    # INC $10, LDA #$40, STA $029e, RTI
+    def run(idle, cycles):
+        scheduler = Scheduler()
+        bus, mpu, riot, _ = system(lambda: MPU(idle=idle), scheduler)
+        for start, code in [(0x1000, [0x58, 0xa9, 0x40, 0x8d, 0x9e, 0x02,
+                                      0x4c, 0x06, 0x10]),
+                            (0x1100, [0xe6, 0x10, 0xa9, 0x40, 0x8d, 0x9e,
+                                      0x02, 0x40])]:
+            for i, data in enumerate(code):
+                bus(start + i, data, True)
+        scheduler.irq_n = lambda: riot.irq_n
+        ret = scheduler.run(mpu, bus, cycles)
+        return ret, save_reg(mpu), mpu.cycles, bus(0x10)
+
+    expected = run(False, 30000)
+    assert expected[3] == 30000 // (0x40 * 64)
+    assert run(True, 30000) == expected
+
+    # The loop is skipped up to each timer interrupt, one every 4113
+    # cycles with the timer restarted by the handler
+    start = time.time()
+    assert run(True, 10 ** 7)[2:] == (10 ** 7, (10 ** 7 // 4113) & 0xff)
+    assert time.time() - start < 10
+
+if __name__ == '__main__':
+    test_events()
+    test_interrupts()
+    test_budget()
+    test_ram()
+    test_idle()
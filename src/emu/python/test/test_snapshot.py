@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+from test_common import *
+from mc6502.blockmpu import BlockMPU
+from mc6502.fastmpu import FastMPU
+from mc6502.mpu import SNAPSHOT
+
+
+def save_state(mpu, mem):
+    state = save_reg(mpu), save_mem(mem), str(mpu.controller)
+    if isinstance(mpu, FastMPU):
+        # FastMPU does not update the internal latches
+        return state
+    return state + (str(mpu.datapath), mpu.datapath.pcadder.carry)
+
+def test_resume():
+    # LDA #$77, STA $0300,X with page crossing, BNE, JSR, RTS
+    imem = set_mem([0xa9, 0x77, 0x9d, 0xf0, 0x02, 0xd0, 0x7e, 0x00],
+                   {0x0085: 0x20, 0x0086: 0x00, 0x0087: 0x40,
+                    0x4000: 0x60})
+    for clk in range(1, 24):
+        mem = Memory(imem)
+        mpu = MPU()
+        load_reg(mpu, set_reg(pc=0x0000, x=0x20))
+        mpu.run(mem, clk)
+        blob = mpu.snapshot(mem)
+        assert len(blob) == SNAPSHOT.size + 0x10000
+        mpu.run(mem, 12)
+
+        for cls, kw in [(MPU, {}), (MPU, {'precompiled': True}),
+                        (FastMPU, {})]:
+            rmem = Memory()
+            rmpu = cls(**kw)
+            rmpu.restore(blob, rmem)
+            rmpu.run(rmem, 12)
+            state = save_state(rmpu, rmem)
+            assert state == save_state(mpu, mem)[:len(state)]
+
+def test_registers():
+    mpu = MPU()
+    mpu.restore(MPU().snapshot())
+    assert save_reg(mpu) == save_reg(MPU())
+    try:
+        mpu.restore(b'M6501' + MPU().snapshot()[5:])
+        assert False
+    except AssertionError as e:
+        assert 'unknown snapshot' in str(e)
+
+def test_block():
+    # LDY #$00, JMP $0000
+    mem = Memory(set_mem([0xa0, 0x00, 0x4c, 0x00, 0x00]))
+    mpu = BlockMPU()
+    load_reg(mpu, set_reg(pc=0x0000))
+    mpu.run(mem, 1000)
+    blob = mpu.snapshot(mem)
+    mem(0x0001, 0x55, True)
+    mpu.run(mem, 1000)
+    assert mpu.datapath.y.data == 0x55
+
+    mpu.restore(blob, mem)
+    assert mpu._blocks == {}
+    mpu.run(mem, 1000)
+    assert mpu.datapath.y.data == 0x00
+
+
+if __name__ == '__main__':
+    test_resume()
+    test_registers()
+    test_block()
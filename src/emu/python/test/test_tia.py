@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+
+import glob
+import random
+import unittest
+
+from test_common import *
+
+from mc6502.bus import Bus
+from mc6502.controller import WRITE_STATES
+
+try:
+    import numpy
+    import yaml
+    from mc6502.tia import TIA, STATE, REGISTERS, RESETS, MOTIONS, COPIES, \
+        WIDTHS, REVERSE8, RSYNC, HMOVE, HMCLR, CXCLR, LINES, WIDTH
+except ImportError:
+    TIA = None
+    if __name__ != '__main__':
+        # Skipped as a whole by the test runner
+        raise unittest.SkipTest('numpy or yaml is not installed')
+
+
+TIA1A = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                     os.path.pardir, os.path.pardir, os.path.pardir,
+                     os.path.pardir, 'test', 'cpp', 'tia1a')
+if TIA is not None:
+    sys.path.append(TIA1A)
+    from tiasm import TIAssembler
+
+
+def pixel_on(px, pos, mask, siz):
+    # objPixelOn.v
+    index = (px - pos - 1) & 0xff
+    byte = (1 << (index >> 3)) & 0x1ff
+    sel = {5: index >> 1, 7: index >> 2}.get(siz, index) & 0x07
+    return byte & COPIES[siz] != 0 and mask >> sel & 1 == 1 and \
+        pos < px <= pos + 72
+
+class Reference(object):
+    # tia1a.v one color clock at a time
+
+    def __init__(self, initial):
+        self.reg = dict.fromkeys(STATE, 0)
+        self.reg.update(initial)
+        self.hcount = 0
+        self.screen = []
+        self.reads = []
+
+    def dots(self, hcount):
+        r = self.reg
+        px = hcount - 68 if hcount >= 68 else 0
+        grp0 = r['grp0d'] if r['vdelp0'] else r['grp0']
+        grp1 = r['grp1d'] if r['vdelp1'] else r['grp1']
+        p0 = pixel_on(px, r['posp0'], REVERSE8[grp0] if r['refp0'] else grp0,
+                      r['nusiz0'] & 7)
+        p1 = pixel_on(px, r['posp1'], REVERSE8[grp1] if r['refp1'] else grp1,
+                      r['nusiz1'] & 7)
+        m0 = r['enam0'] and pixel_on(
+            px, r['posp0'] if r['resmp0'] else r['posm0'],
+            WIDTHS[r['nusiz0'] >> 4 & 3], r['nusiz0'] & 7)
+        m1 = r['enam1'] and pixel_on(
+            px, r['posp1'] if r['resmp1'] else r['posm1'],
+            WIDTHS[r['nusiz1'] >> 4 & 3], r['nusiz1'] & 7)
+        bl = (r['enabld'] if r['vdelbl'] else r['enabl']) and pixel_on(
+            px, r['posbl'], WIDTHS[r['ctrlpf'] >> 4 & 3], 0)
+        pf = r['pf2'] << 12 | REVERSE8[r['pf1']] << 4 | r['pf0'] >> 4
+        pixelpf = px >> 2
+        if pixelpf >= 20:
+            pixelpf = 39 - pixelpf if r['ctrlpf'] & 1 else pixelpf - 20
+        return bool(p0), bool(p1), bool(m0), bool(m1), bool(bl), \
+            bool(pf >> pixelpf & 1)
+
+    def color(self, hcount):
+        r = self.reg
+        p0, p1, m0, m1, bl, pf = self.dots(hcount)
+        colupf_ = r['colupf']
+        if r['ctrlpf'] & 2:
+            colupf_ = r['colup0'] if hcount - 68 < 80 else r['colup1']
+        if r['ctrlpf'] & 4:
+            order = [(bl, r['colupf']), (pf, colupf_), (p0 or m0, r['colup0']),
+                     (p1 or m1, r['colup1'])]
+        else:
+            order = [(p0 or m0, r['colup0']), (p1 or m1, r['colup1']),
+                     (bl, r['colupf']), (pf, colupf_)]
+        return next((c for on, c in order if on), r['colubk']) & 0xfe
+
+    def collisions(self, hcount):
+        p0, p1, m0, m1, bl, pf = self.dots(hcount)
+        pairs = [(m0, p0), (m0, p1), (m1, p1), (m1, p0), (p0, bl), (p0, pf),
+                 (p1, bl), (p1, pf), (m0, bl), (m0, pf), (m1, bl), (m1, pf),
+                 (bl, pf), (m0, m1), (p0, p1)]
+        return sum(1 << i for i, (a, b) in enumerate(pairs) if a and b)
+
+    def write(self, a, data, hcount):
+        r = self.reg
+        if a in REGISTERS:
+            name, bit = REGISTERS[a]
+            r[name] = data if bit is None else int(data & bit != 0)
+        elif a in RESETS:
+            name, offset = RESETS[a]
+            r[name] = offset if hcount < 68 else hcount - 68
+        elif a == HMOVE:
+            for pos, hm in MOTIONS:
+                motion = r[hm] >> 4 | (0xf0 if r[hm] & 0x80 else 0)
+                r[pos] = ((r[pos] - motion) & 0xff) % 160
+        elif a == HMCLR:
+            for _, hm in MOTIONS:
+                r[hm] = 0
+        elif a == CXCLR:
+            r['cxclr'] = 1
+
+    def run(self, accesses, end):
+        r = self.reg
+        for edge in range(1, end + 1):
+            access = accesses.get(edge - edge % 3 + (3 if edge % 3 else 0))
+            hcount = self.hcount
+            cxr = 0 if r['cxclr'] else r['cxr'] | self.collisions(hcount)
+            if hcount == 0:
+                r['grp0d'], r['grp1d'], r['enabld'] = \
+                    r['grp0'], r['grp1'], r['enabl']
+            if access is not None and access[1] is not None and \
+               access[0] == RSYNC:
+                self.hcount = 0
+            else:
+                self.hcount = (hcount + 1) % 228
+            if edge % 3 == 0 and access is not None:
+                if access[1] is None:
+                    self.reads.append(r['cxr'])
+                else:
+                    self.write(access[0], access[1], hcount)
+            r['cxr'] = cxr
+            if self.hcount >= 68:
+                self.screen.append(self.color(self.hcount))
+
+def run(initial, accesses, end):
+    # Accesses are {color clock: (address, data)} at CPU cycle boundaries
+    now = [0]
+    frames = []
+    tia = TIA(clock=lambda: now[0],
+              on_frame=lambda screen: frames.append(screen.copy()))
+    for name, value in initial.items():
+        setattr(tia, name, value)
+    reads = []
+    for now[0] in sorted(accesses):
+        address, data = accesses[now[0]]
+        if data is None:
+            tia.read(address)
+            reads.append(tia.cxr)
+        else:
+            tia.write(address, data)
+    now[0] = end
+    tia.update()
+    return tia, frames, reads
+
+def compare(initial, accesses, end):
+    tia, frames, reads = run(initial, accesses, end)
+    ref = Reference(initial)
+    ref.run(dict((clock + 3, access) for clock, access in accesses.items()),
+            end)
+    screen = numpy.concatenate([frame.reshape(-1) for frame in frames] +
+                               [tia.screen.reshape(-1)[:tia._pixel]])
+    return screen.tolist() == ref.screen and reads == ref.reads and \
+        all(getattr(tia, name) == ref.reg[name] for name in STATE)
+
+def tiasm(filename):
+    asm = TIAssembler(filename)
+    accesses = {}
+    for a in asm.asm:
+        clock = a['clock'] - a['clock'] % 3
+        # D_IN is 8 bits wide
+        accesses[clock] = (a['addr'],
+                           a['data'] & 0xff if a['r_w'] == 'w' else None)
+    end = asm.get_clock(asm.code[-1][0], asm.height, 0) + 1
+    if asm.asm[-1]['r_w'] == 'r':
+        # The last read is held up to the end of sim_tia1a.cpp
+        accesses[end - end % 3 - 3] = (asm.asm[-1]['addr'], None)
+    initial = dict((k.lower(), v) for k, v in asm.initial['reg'].items())
+    return asm, initial, accesses, end
+
+def test_sync():
+    with open(os.path.join(TIA1A, 'sim_tia1a_sync.yml')) as f:
+        targets = yaml.safe_load(f)
+    for target in targets:
+        for test in target['tests']:
+            end = test['cycle'] + 1
+            now = [0]
+            tia = TIA(clock=lambda: now[0])
+            inputs = dict((i['clock'], i['in']) for i in test['inputs'])
+            # Strobes act from the first color clock of the access and
+            # the others at the MCLK edge
+            for now[0] in range(0, end, 3):
+                clocks = [c for c in inputs if c <= now[0]]
+                if not clocks:
+                    continue
+                i = inputs[max(clocks)]
+                tia.inpt = i['I']
+                if i['CS'] != 1:
+                    continue
+                if i['R_W']:
+                    if now[0] + 3 <= end:
+                        tia.read(i['A'])
+                else:
+                    tia.write(i['A'], i['D_IN'])
+            now[0] = end
+            tia.update()
+            out = {'RDY': tia.rdy, 'HSYNC': tia.hsync, 'HBLANK': tia.hblank,
+                   'VSYNC': tia.vsync, 'VBLANK': tia.vblank >> 1 & 1,
+                   'LUM': tia.colu >> 1 & 7, 'COL': tia.colu >> 4,
+                   'AUD': 0, 'D_OUT': tia.d_out}
+            expected = test['expected']
+            assert all(int(out[k]) == v for k, v in expected['out'].items()), \
+                test['comment']
+            assert all(getattr(tia, k.lower()) == v
+                       for k, v in expected['reg'].items()), test['comment']
+
+def test_tiasm():
+    for filename in sorted(glob.glob(os.path.join(TIA1A, 'tiasm', '*.tiasm'))):
+        asm, initial, accesses, end = tiasm(filename)
+        tia, frames, _ = run(initial, accesses, end)
+        assert len(frames) == 1 and tia.screen.shape == (LINES, WIDTH)
+        if 'D_OUT' in asm.expected['out']:
+            assert tia.d_out == asm.expected['out']['D_OUT'], filename
+        assert all(getattr(tia, k.lower()) == v
+                   for k, v in asm.expected['reg'].items()), filename
+
+    # Pixel by pixel against the color clock reference
+    for name in ['p0_hmove', 'p1_vdel', 'm0_2size_resmp', 'bl_8size_prio',
+                 'pf_vband_score', 'cx_ppmm']:
+        _, initial, accesses, end = tiasm(
+            os.path.join(TIA1A, 'tiasm', name + '.tiasm'))
+        assert compare(initial, accesses, end), name
+
+def test_random():
+    rand = random.Random(6532)
+    addresses = list(REGISTERS) + list(RESETS) + [HMOVE, HMCLR, RSYNC]
+    for seed in range(6):
+        accesses = {}
+        clock = 0
+        for i in range(150):
+            clock += 3 * rand.choice([1, 2, 3, 5, 8, 20])
+            address = rand.choice(addresses + [CXCLR] * (seed % 2))
+            accesses[clock] = (address, rand.randrange(0x100))
+            # Collisions read in every cycle for a while
+            for j in range(rand.choice([0, 0, 1, 30])):
+                clock += 3
+                accesses[clock] = (rand.randrange(0x08), None)
+        initial = {'grp0': 0xa5, 'grp1': 0x3c, 'enam0': 1, 'enam1': 1,
+                   'enabl': 1, 'pf1': 0x81, 'posp1': 40, 'posbl': 100}
+        assert compare(initial, accesses, clock + 228 * 3), seed
+
+def test_wsync():
+    # LDX #$00, STA WSYNC, INX, JMP $1002 with RDY per cycle and in bulk
+    def system(stall):
+        bus = Bus(set_mem([0xa2, 0x00, 0x85, 0x02, 0xe8, 0x4c, 0x02, 0x10]))
+        bus.map_ram(0x1000, 0x2000, base=0x0000, size=0x1000)
+        mpu = MPU()
+        tia = TIA(clock=lambda: 3 * mpu.cycles)
+        bus.map_device(0x0000, 0x0100, tia.read, tia.write)
+        load_reg(mpu, set_reg(pc=0x1000))
+        if stall:
+            mpu.stall = tia.stall
+        return bus, mpu, tia
+
+    bus, mpu, tia = system(False)
+    for _ in range(LINES * 76):
+        data = 0x00 if mpu.controller._state in WRITE_STATES else \
+            bus(mpu.address)
+        data, addr = mpu(data, rdy=tia.rdy)
+        if mpu.r_w == 'w':
+            bus(addr, data, True)
+        mpu.cycles += 1
+    expected = save_reg(mpu)
+    assert expected['x'] == LINES - 1 & 0xff
+
+    bus, mpu, tia = system(True)
+    mpu.run(bus, LINES * 76)
+    assert save_reg(mpu) == expected
+
+
+if __name__ == '__main__':
+    if TIA is None:
+        print('skip: numpy or yaml is not installed')
+        sys.exit(0)
+    test_sync()
+    test_tiasm()
+    test_random()
+    test_wsync()
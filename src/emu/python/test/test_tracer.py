@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+import os
+import tempfile
+
+from test_common import *
+from mc6502.tracer import Tracer
+
+
+# LDA #$77, STA $0300, JMP $0000
+PROGRAM = set_mem([0xa9, 0x77, 0x8d, 0x00, 0x03, 0x4c, 0x00, 0x00])
+
+def traced(size, cycles):
+    mem = Memory(PROGRAM)
+    mpu = MPU()
+    load_reg(mpu, set_reg(pc=0x0000))
+    tracer = Tracer(size)
+    tracer.attach(mpu)
+    for clk in cycles:
+        mpu.run(mem, clk)
+    return tracer
+
+def test_ring():
+    full = list(traced(1000, [100]).records())
+    assert [r[0] for r in full] == list(range(100))
+
+    # Only the last cycles are kept whatever the run lengths are
+    ring = list(traced(32, [7, 50, 43]).records())
+    assert ring == full[-32:]
+
+    writes = [r for r in full if r[3]]
+    assert writes and all(r[1:3] == (0x0300, 0x77) for r in writes)
+
+def test_dump():
+    tracer = traced(32, [100])
+    fd, filename = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        tracer.dump(filename)
+        loaded = Tracer.load(filename)
+    finally:
+        os.remove(filename)
+    assert list(loaded.records()) == list(tracer.records())
+    assert list(loaded.lines()) == list(tracer.lines())
+    assert 'OPCODE=STA(0x8d) STATE=T2_abs_addr_mode' in \
+        '\n'.join(tracer.lines())
+
+def test_detach():
+    mem = Memory(PROGRAM)
+    mpu = MPU()
+    tracer = Tracer(16)
+    tracer.attach(mpu)
+    mpu.run(mem, 10)
+    tracer.detach(mpu)
+    mpu.run(mem, 10)
+    assert len(tracer) == 10
+
+
+if __name__ == '__main__':
+    test_ring()
+    test_dump()
+    test_detach()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+import random
+import unittest
+
+from test_common import *
+from mc6502.decoder import InstructionDecoder
+from mc6502.fastmpu import FastMPU
+
+try:
+    from mc6502.vectormpu import VectorMPU, FAULTS
+except ImportError:
+    VectorMPU = None
+    if __name__ != '__main__':
+        # Skipped as a whole by the test runner
+        raise unittest.SkipTest('numpy is not installed')
+
+
+def compare(imems, regs, count):
+    # Run FastMPU on each lane and compare with VectorMPU every instruction
+    vmpu = VectorMPU(len(imems))
+    mpus, mems = [], []
+    for lane, (imem, reg) in enumerate(zip(imems, regs)):
+        mpu, mem = FastMPU(), Memory(imem)
+        load_reg(mpu, reg)
+        mpu.step_instruction(mem)
+        vmpu.load(lane, mpu, mem)
+        mpus.append(mpu)
+        mems.append(mem)
+
+    for i in range(count):
+        vclk = vmpu.step()
+        for lane, (mpu, mem) in enumerate(zip(mpus, mems)):
+            if mpu is None:
+                continue
+            try:
+                clk = mpu.step(mem)
+            except Exception as e:
+                if FAULTS.get(int(vmpu.fault[lane])) is not type(e):
+                    return False
+                mpus[lane] = None
+                continue
+            vmpu_reg, vmem = FastMPU(), Memory()
+            vmpu.save(lane, vmpu_reg, vmem)
+            if clk != vclk[lane] or save_reg(mpu) != save_reg(vmpu_reg) or \
+               save_mem(mem) != save_mem(vmem):
+                return False
+    return True
+
+def test_step():
+    # LDA #imm, SEC, ADC zpg, STA abs, INC zpg, NOP
+    imem = set_mem([0xa9, 0x77, 0x38, 0x65, 0x55, 0x8d, 0x44, 0x22,
+                    0xe6, 0x55, 0xea], {0x0055: 0x11})
+    regs = [set_reg(pc=0x0000, p=p) for p in [0x00, 0x08, 0xc3, 0xff]]
+    assert compare([imem] * len(regs), regs, 6)
+
+def test_addressing():
+    # Page crossing, branches, subroutines and interrupts
+    imem = set_mem([], {0x3366: 0x20, 0x3367: 0x55, 0x3368: 0x22,
+                        0x2255: 0xbd, 0x2256: 0xf0, 0x2257: 0x21,
+                        0x2258: 0xb1, 0x2259: 0x67, 0x225a: 0x91,
+                        0x225b: 0x67, 0x225c: 0xd0, 0x225d: 0xe0,
+                        0x233e: 0x00, 0x233f: 0xea, 0xfffe: 0x00,
+                        0xffff: 0x44, 0x4400: 0x6c, 0x4401: 0x10,
+                        0x4402: 0x44, 0x4410: 0x00, 0x4411: 0x45,
+                        0x4500: 0x40, 0x0067: 0xf0, 0x0068: 0x21})
+    regs = [set_reg(pc=0x3366, x=0x65, y=0x65),
+            set_reg(pc=0x3366, x=0x11, y=0x11, p=0x09),
+            set_reg(pc=0x3366, x=0xff, y=0x00, p=0x02)]
+    assert compare([imem] * len(regs), regs, 10)
+
+def test_fault():
+    # Illegal opcode, ASL zpg and branch out of the page with NOPs
+    imems = [set_mem([0xea, 0x02]), set_mem([0xea, 0x06, 0x10]),
+             set_mem([], {0xfffd: 0xea, 0xfffe: 0xd0, 0xffff: 0x10}),
+             set_mem([0xea, 0xea, 0xea])]
+    regs = [set_reg(pc=0x0000)] * 3 + [set_reg(pc=0xfffd)]
+    assert compare(imems, regs, 3)
+
+def test_random():
+    decoder = InstructionDecoder()
+    legal = [op for op in range(0x100) if decoder(op)[0] and
+             not (decoder(op)[0] in ['ASL', 'LSR', 'ROL', 'ROR'] and
+                  decoder(op)[1] != 'acc')]
+    random.seed(6502)
+    imems, regs = [], []
+    for lane in range(8):
+        imems.append([random.choice(legal) for _ in range(0x10000)])
+        regs.append(set_reg(pc=random.randrange(0x10000),
+                            a=random.randrange(0x100),
+                            x=random.randrange(0x100),
+                            y=random.randrange(0x100),
+                            s=random.randrange(0x100),
+                            p=random.randrange(0x100)))
+    assert compare(imems, regs, 50)
+
+
+if __name__ == '__main__':
+    if VectorMPU is None:
+        print('skip: numpy is not installed')
+        sys.exit(0)
+    test_step()
+    test_addressing()
+    test_fault()
+    test_random()
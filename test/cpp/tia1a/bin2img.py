@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 # https://en.wikipedia.org/wiki/List_of_video_game_console_palettes
 
+import argparse
+from functools import partial
+import multiprocessing
 import numpy as np
 from PIL import Image
 import sys
@@ -120,35 +123,66 @@ secam_table = {
 }
 
 def colu_to_rgb(colu, format='NTSC'):
-    lum = (colu >> 0) & 0xf
+    # LUM is the 3 bits of COLU[3:1]
+    lum = (colu >> 0) & 0xe
     col = (colu >> 4) & 0xf
     if format == 'SECAM':
-        code = secam_table[lum]
+        code = secam_table[lum >> 1]
     else:
         code = pal_table[lum][col] if format == 'PAL' else ntsc_table[lum][col]
     return ((code >> 16) & 0xff, (code >> 8) & 0xff, code & 0xff)
 
+def palette(format='NTSC'):
+    """Return 256x3 RGB table indexed by COLU"""
+    return np.array([colu_to_rgb(colu, format) for colu in range(0x100)],
+                    dtype='u1')
+
 def convert_colu_to_rgb(array, format='NTSC'):
-    ret = map(lambda x: colu_to_rgb(x, format), array.flatten().tolist())
-    return np.array(ret, dtype='u1').reshape(array.shape + (3,))
+    return palette(format)[array]
+
+def read_frames(filename, width=228, height=262):
+    """Return the dump mapped as an array of frames x height x width"""
+    size = width * height
+    data = np.memmap(filename, dtype='u1', mode='r')
+    count = len(data) // size
+    return data[:count * size].reshape((count, height, width))
+
+def convert_frame(
+        i, filename, width=228, height=262,
+        hblank=68, vsync=3, vblank=37, overscan=30, format='NTSC', lut=None):
+    array = read_frames(filename, width, height)[i]
+    array = array[(vsync + vblank):height - overscan, hblank:] # clipping
+    lut = palette(format) if lut is None else lut
+    image = Image.fromarray(lut[array])                        # colu to rgb
+    name = '{}_{}.png'.format(filename.replace('.bin', ''), i)
+    image.save(name)
+    return name
 
 def convert_binary_to_images(
         filename, width=228, height=262,
-        hblank=68, vsync=3, vblank=37, overscan=30, format='NTSC'):
-    with open(filename, 'rb') as fh:
-        data = map(lambda x: ord(x), fh.read())
-    size = width * height
-    for i in range(len(data) / size):
-        array = np.array(data[i:(i + 1) * size], dtype='u4')
-        array = array.reshape((height, width))             # reshape
-        array = array[(vsync + vblank):-overscan, hblank:] # clipping
-        array = convert_colu_to_rgb(array, format=format)  # colu to rgb
-        image = Image.fromarray(array)
-        image.save('{}_{}.png'.format(filename.replace('.bin', ''), i))
+        hblank=68, vsync=3, vblank=37, overscan=30, format='NTSC', jobs=None):
+    count = len(read_frames(filename, width, height))
+    convert = partial(
+        convert_frame, filename=filename, width=width, height=height,
+        hblank=hblank, vsync=vsync, vblank=vblank, overscan=overscan,
+        format=format, lut=palette(format))
+    if jobs == 1 or count < 2:
+        return [convert(i) for i in range(count)]
+    pool = multiprocessing.Pool(jobs)
+    try:
+        return pool.map(convert, range(count), chunksize=16)
+    finally:
+        pool.close()
+        pool.join()
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print('usage: {} <screen-bin>'.format(sys.argv[0]))
-        quit()
-    filename = sys.argv[1]
-    convert_binary_to_images(filename, width=160, height=262, hblank=0)
+    parser = argparse.ArgumentParser(
+        description='Convert TIA screen dump to PNG images per frame')
+    parser.add_argument('filename', help='screen binary file')
+    parser.add_argument('-f', '--format', default='NTSC',
+                        choices=['NTSC', 'PAL', 'SECAM'])
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of processes (default: CPU count)')
+    args = parser.parse_args()
+    convert_binary_to_images(args.filename, width=160, height=262, hblank=0,
+                             format=args.format, jobs=args.jobs)
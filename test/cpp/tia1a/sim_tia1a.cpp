@@ -2,12 +2,14 @@
 // Simlation for Television Interface Adaptor (Model 1A)
 //------------------------------------------------------------------------------
 
+#include <cstring>
 #include <fstream>
 #include <iomanip>
 #include <iostream>
 #include <fstream>
 #include <map>
 #include <memory>
+#include <stdexcept>
 
 #include <yaml-cpp/yaml.h>
 
@@ -55,6 +57,17 @@ public:
             }
         }
 
+        ModuleValues(
+            const std::vector<std::string>& keys, const uint64_t mask,
+            const std::vector<value_type>& values)
+        {
+            // Set values whose bit is set in the mask
+            for (size_t i = 0; i < keys.size(); ++i) {
+                values_.emplace(
+                    keys[i], std::make_tuple(values[i], (mask >> i) & 1));
+            }
+        }
+
         value_type operator()(const std::string& key) const
         {
             return std::get<0>(values_.at(key));
@@ -74,7 +87,11 @@ public:
             ModuleValues(GetKeys(), nodes)
         {}
 
-        const std::vector<std::string> GetKeys() const
+        Inputs(const uint64_t mask, const std::vector<value_type>& values) :
+            ModuleValues(GetKeys(), mask, values)
+        {}
+
+        static const std::vector<std::string> GetKeys()
         {
             return {
                 "DEL", "R_W", "CS", "A", "I", "D_IN"
@@ -88,7 +105,11 @@ public:
             ModuleValues(GetKeys(), nodes)
         {}
 
-        const std::vector<std::string> GetKeys() const
+        Outputs(const uint64_t mask, const std::vector<value_type>& values) :
+            ModuleValues(GetKeys(), mask, values)
+        {}
+
+        static const std::vector<std::string> GetKeys()
         {
             return {
                 "HSYNC", "HBLANK", "VSYNC", "VBLANK",
@@ -103,7 +124,11 @@ public:
             ModuleValues(GetKeys(), nodes)
         {}
 
-        const std::vector<std::string> GetKeys() const
+        Registers(const uint64_t mask, const std::vector<value_type>& values) :
+            ModuleValues(GetKeys(), mask, values)
+        {}
+
+        static const std::vector<std::string> GetKeys()
         {
             return {
                 "VSYNC", "VBLANK", "NUSIZ0", "NUSIZ1",
@@ -437,6 +462,130 @@ private:
 };
 
 
+//------------------------------------------------------------------------------
+// Binary stimulus written by `tiasm.py -b`
+//
+//   header   : "TIASTM", version (u8), name size (u8), cycle (u32), count (u32)
+//   name     : name size bytes
+//   initial  : mask (u64), Registers values (u16 each)
+//   expected : mask (u64), Registers values, mask (u64), Outputs values
+//   records  : count x (clock (u32), R_W (u8), A (u8), D_IN (u8), pad (u8))
+//
+// All fields are little-endian and packed.
+//------------------------------------------------------------------------------
+
+class Stimulus
+{
+public:
+
+    static constexpr uint8_t VERSION = 1;
+    static constexpr size_t HEADER_SIZE = 16;
+    static constexpr size_t RECORD_SIZE = 8;
+
+    Stimulus(const std::string& filename)
+    {
+        // Load the whole file with a single read
+        std::ifstream file(filename, std::ios::in | std::ios::binary);
+        if (!file) {
+            throw std::runtime_error("cannot open " + filename);
+        }
+        file.seekg(0, std::ios::end);
+        buffer_.resize(file.tellg());
+        file.seekg(0, std::ios::beg);
+        file.read(&buffer_[0], buffer_.size());
+
+        if (buffer_.size() < HEADER_SIZE ||
+            buffer_.compare(0, 6, "TIASTM") != 0 ||
+            Get<uint8_t>(6) != VERSION) {
+            throw std::runtime_error("invalid stimulus " + filename);
+        }
+        name_ = buffer_.substr(HEADER_SIZE, Get<uint8_t>(7));
+        cycle_ = Get<uint32_t>(8);
+        count_ = Get<uint32_t>(12);
+
+        // Offsets of the blocks
+        initial_ = HEADER_SIZE + name_.size();
+        expected_reg_ = initial_ + BlockSize<TestBench::Registers>();
+        expected_out_ = expected_reg_ + BlockSize<TestBench::Registers>();
+        records_ = expected_out_ + BlockSize<TestBench::Outputs>();
+        if (buffer_.size() != records_ + count_ * RECORD_SIZE) {
+            throw std::runtime_error("truncated stimulus " + filename);
+        }
+    }
+
+    const std::string& Name() const { return name_; }
+    int Cycle() const { return cycle_; }
+
+    TestBench::Registers Initial() const
+    {
+        return Block<TestBench::Registers>(initial_);
+    }
+
+    TestBench::Registers ExpectedRegisters() const
+    {
+        return Block<TestBench::Registers>(expected_reg_);
+    }
+
+    TestBench::Outputs ExpectedOutputs() const
+    {
+        return Block<TestBench::Outputs>(expected_out_);
+    }
+
+    std::map<int, TestBench::Inputs> Inputs() const
+    {
+        // DEL, R_W, CS, A, I, D_IN as in tiasm.py to_yaml
+        std::map<int, TestBench::Inputs> inputs;
+        for (size_t i = 0; i < count_; ++i) {
+            const auto offset = records_ + i * RECORD_SIZE;
+            inputs.emplace(
+                Get<uint32_t>(offset),
+                TestBench::Inputs(~0ull, {
+                    0, Get<uint8_t>(offset + 4), 1,
+                    Get<uint8_t>(offset + 5), 0, Get<uint8_t>(offset + 6)}));
+        }
+        return inputs;
+    }
+
+private:
+
+    template <typename T>
+    T Get(const size_t offset) const
+    {
+        T value;
+        std::memcpy(&value, &buffer_[offset], sizeof(T));
+        return value;
+    }
+
+    template <typename T>
+    static size_t BlockSize()
+    {
+        return sizeof(uint64_t) + T::GetKeys().size() * sizeof(uint16_t);
+    }
+
+    template <typename T>
+    T Block(const size_t offset) const
+    {
+        std::vector<ModuleValues::value_type> values;
+        for (size_t i = 0; i < T::GetKeys().size(); ++i) {
+            values.push_back(
+                Get<uint16_t>(offset + sizeof(uint64_t) + i * sizeof(uint16_t)));
+        }
+        return T(Get<uint64_t>(offset), values);
+    }
+
+    using ModuleValues = TestBench::ModuleValues;
+
+    std::string buffer_;
+    std::string name_;
+    uint32_t cycle_;
+    uint32_t count_;
+    size_t initial_;
+    size_t expected_reg_;
+    size_t expected_out_;
+    size_t records_;
+};
+
+
 int main(int argc, char **argv)
 {
     // Intialize Verilated
@@ -445,6 +594,42 @@ int main(int argc, char **argv)
     // Create testbench
     auto tb = std::make_unique<TestBench>("sim_tia1a.vcd");
 
+    // Execute a test pattern and verify it
+    auto run_test = [&tb](
+        const std::string& target_name, const std::string& comment,
+        const TestBench::Registers& initial,
+        const std::map<int, TestBench::Inputs>& inputs, const int cycle,
+        const std::string& screen_name,
+        const TestBench::Outputs& expected_out,
+        const TestBench::Registers& expected_reg) {
+        tb->Reset(initial);
+        tb->Run(cycle, inputs, screen_name);
+        const auto is_valid = tb->Verify(expected_out, expected_reg);
+
+        std::cout << (is_valid ? "Success" : "   Fail") << ": "
+                  << target_name << ": "
+                  << comment << std::endl;
+    };
+
+    // Run screen tests from binary stimulus files if given
+    std::vector<std::string> stimulus_files;
+    for (int i = 1; i < argc; ++i) {
+        const std::string arg(argv[i]);
+        if (arg.size() > 5 && arg.compare(arg.size() - 5, 5, ".stim") == 0) {
+            stimulus_files.push_back(arg);
+        }
+    }
+    if (!stimulus_files.empty()) {
+        for (const auto& filename : stimulus_files) {
+            const Stimulus stimulus(filename);
+            run_test("Screen", stimulus.Name(), stimulus.Initial(),
+                     stimulus.Inputs(), stimulus.Cycle(),
+                     stimulus.Name() + ".bin", stimulus.ExpectedOutputs(),
+                     stimulus.ExpectedRegisters());
+        }
+        return 0;
+    }
+
     // Read test config yaml file
     const auto test_patterns = YAML::LoadFile("sim_tia1a.yml");
 
@@ -457,31 +642,21 @@ int main(int argc, char **argv)
 
             // Execute a test pattern
             const auto& initial = test["initial"];
-            tb->Reset(TestBench::Registers(initial["reg"]));
-
-            // Run
             std::map<int, TestBench::Inputs> inputs;
             for (const auto& input : test["inputs"]) {
                 inputs.emplace(
                     input["clock"].as<int>(),
                     TestBench::Inputs(input["in"]));
             }
-            if (target_name == "Screen") {
-                const auto screen_name = test["screen_name"].as<std::string>();
-                tb->Run(test["cycle"].as<int>(), inputs, screen_name);
-            } else {
-                tb->Run(test["cycle"].as<int>(), inputs);
-            }
+            const auto screen_name = (target_name == "Screen") ?
+                test["screen_name"].as<std::string>() : "";
 
-            // Verify the test
             const auto& expected = test["expected"];
-            const auto is_valid = tb->Verify(
-                TestBench::Outputs(expected["out"]),
-                TestBench::Registers(expected["reg"]));
-
-            std::cout << (is_valid ? "Success" : "   Fail") << ": "
-                      << target_name << ": "
-                      << comment << std::endl;
+            run_test(target_name, comment,
+                     TestBench::Registers(initial["reg"]), inputs,
+                     test["cycle"].as<int>(), screen_name,
+                     TestBench::Outputs(expected["out"]),
+                     TestBench::Registers(expected["reg"]));
         }
     }
 
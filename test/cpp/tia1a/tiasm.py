@@ -1,13 +1,39 @@
 #!/usr/bin/env python
 
+import argparse
 import csv
 from collections import OrderedDict
 import glob
 import os
+import struct
 import sys
 import yaml
 
 
+# Binary stimulus: header, scenario name, initial registers, expected
+# registers and outputs as (set mask, values), then the input records
+STIMULUS_MAGIC = b'TIASTM'
+STIMULUS_VERSION = 1
+STIMULUS = struct.Struct('<6sBBII')  # magic, version, name size, cycle, count
+RECORD = struct.Struct('<IBBBx')     # clock, R_W, A, D_IN
+
+# Same order as TestBench::Registers and TestBench::Outputs
+REGISTERS = [
+    'VSYNC', 'VBLANK', 'NUSIZ0', 'NUSIZ1',
+    'COLUP0', 'COLUP1', 'COLUPF', 'COLUBK', 'CTRLPF',
+    'REFP0', 'REFP1', 'PF0', 'PF1', 'PF2',
+    'GRP0', 'GRP1', 'GRP0D', 'GRP1D',
+    'ENAM0', 'ENAM1', 'ENABL', 'ENABLD',
+    'HMP0', 'HMP1', 'HMM0', 'HMM1', 'HMBL',
+    'POSP0', 'POSP1', 'POSM0', 'POSM1', 'POSBL',
+    'VDELP0', 'VDELP1', 'VDELBL',
+    'RESMP0', 'RESMP1', 'CXCLR', 'CXR',
+]
+OUTPUTS = [
+    'HSYNC', 'HBLANK', 'VSYNC', 'VBLANK', 'RDY', 'LUM', 'COL', 'AUD', 'D_OUT',
+]
+
+
 class TIAssembler(object):
 
     _command_table = {
@@ -141,11 +167,39 @@ class TIAssembler(object):
             })
         return asm
 
+    @property
+    def name(self):
+        return os.path.splitext(os.path.basename(self.filename))[0]
+
+    def cycle(self):
+        return self.get_clock(self.code[-1][0], self.height, 0)
+
+    def to_binary(self):
+        name = self.name.encode('ascii')
+
+        def block(keys, values):
+            fmt = struct.Struct('<Q{}H'.format(len(keys)))
+            mask = sum(1 << i for i, key in enumerate(keys) if key in values)
+            return fmt.pack(mask, *[values.get(key, 0) for key in keys])
+
+        data = [
+            STIMULUS.pack(STIMULUS_MAGIC, STIMULUS_VERSION, len(name),
+                          self.cycle(), len(self.asm)),
+            name,
+            block(REGISTERS, self.initial['reg']),
+            block(REGISTERS, self.expected['reg']),
+            block(OUTPUTS, self.expected['out']),
+        ]
+        for a in self.asm:
+            data.append(RECORD.pack(a['clock'], int(a['r_w'] == 'r'),
+                                    a['addr'], a['data'] & 0xff))
+        return b''.join(data)
+
     def to_yaml(self):
-        name = os.path.splitext(os.path.basename(self.filename))[0]
+        name = self.name
         test_comment = name
         screen_name = name + '.bin'
-        cycle = self.get_clock(self.code[-1][0], self.height, 0)
+        cycle = self.cycle()
 
         # Input commands
         inputs = []
@@ -186,11 +240,16 @@ class TIAssembler(object):
 
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print('usage: {} <tiasm-file>'.format(sys.argv[0]))
-        quit()
+    parser = argparse.ArgumentParser(
+        description='Convert TIAsm files to test patterns of sim_tia1a')
+    parser.add_argument('paths', nargs='+',
+                        help='TIAsm files, a directory or a list file')
+    parser.add_argument('-b', '--binary', action='store_true',
+                        help='write <name>.stim binary stimulus files '
+                        'instead of printing YAML')
+    args = parser.parse_args()
 
-    path = sys.argv[1]
+    path = args.paths[0]
     if os.path.isdir(path):
         fnames = glob.glob(os.path.join(path, '*.tiasm'))
     elif '.txt' in path:
@@ -202,9 +261,13 @@ if __name__ == '__main__':
                     continue;
                 fnames.append(os.path.join(dname, f.replace('\n', '')))
     else:
-        fnames = sys.argv[1:]
+        fnames = args.paths
 
     fnames = sorted(fnames)
     for fname in fnames:
-        yml_str = TIAssembler(fname).to_yaml()
-        print(yml_str)
+        asm = TIAssembler(fname)
+        if args.binary:
+            with open(asm.name + '.stim', 'wb') as fh:
+                fh.write(asm.to_binary())
+        else:
+            print(asm.to_yaml())